@@ -0,0 +1,89 @@
+"""
+Tareas periodicas dentro del mismo proceso del servidor.
+
+Algunas cosas no tienen que pasar durante una peticion, sino cada cierto
+tiempo: pasar a "expired" las reservas abandonadas, por ejemplo. En vez de un
+cron aparte (otro servicio en Railway, otra cosa que vigilar), corren aqui,
+como tareas de asyncio que arrancan y paran con la app.
+
+Cada tarea es una funcion NORMAL (sync) que se ejecuta en un hilo, para que
+pueda usar la base con Session igual que el resto del codigo sin bloquear el
+event loop. Una excepcion se registra en el log y la tarea sigue en la
+siguiente vuelta: un fallo puntual no puede apagarla para siempre.
+
+Con varios workers cada uno corre sus propias tareas. Por eso todas tienen
+que poder correr a la vez sin pisarse (las de db/ lo son: cada UPDATE repite
+su condicion).
+"""
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Callable
+
+log = logging.getLogger(__name__)
+
+# nombre -> (cada cuantos segundos, funcion)
+_jobs: dict[str, tuple[float, Callable[[], object]]] = {}
+
+# nombre -> evento que la despierta antes de tiempo (ver wake).
+_wakers: dict[str, asyncio.Event] = {}
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def register(name: str, seconds: float, fn: Callable[[], object]) -> None:
+    """Anota una tarea para que corra cada `seconds` mientras viva la app."""
+    _jobs[name] = (seconds, fn)
+
+
+def wake(name: str) -> None:
+    """Adelanta la siguiente vuelta de una tarea, sin esperar su intervalo.
+
+    Se puede llamar desde una ruta async o desde un hilo: el evento se
+    activa siempre dentro del event loop. Si la app no arranco las tareas
+    (un script, una prueba), no hace nada.
+    """
+    event = _wakers.get(name)
+    if event is None or _loop is None:
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _loop:
+        event.set()
+    else:
+        _loop.call_soon_threadsafe(event.set)
+
+
+async def _run(name: str, seconds: float, fn: Callable[[], object]) -> None:
+    event = _wakers[name]
+    while True:
+        try:
+            await asyncio.to_thread(fn)
+        except Exception:
+            log.exception("background job %s failed", name)
+        try:
+            await asyncio.wait_for(event.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Arranca las tareas registradas al iniciar la app y las para al cerrarla."""
+    global _loop
+    _loop = asyncio.get_running_loop()
+    for name in _jobs:
+        _wakers[name] = asyncio.Event()
+    tasks = [asyncio.create_task(_run(name, seconds, fn))
+             for name, (seconds, fn) in _jobs.items()]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        _wakers.clear()
+        _loop = None
@@ -28,6 +28,7 @@ EL DICCIONARIO `taken`
 """
 
 import json
+from bisect import bisect_left
 from datetime import date, datetime, time, timedelta
 from pathlib import Path
 from zoneinfo import ZoneInfo
@@ -100,8 +101,18 @@ HORIZON_DAYS = 30
 # del negocio, no de la base de datos. La consume db/bookings.py.
 HOLD_MINUTES = 30
 
+# Cuanto tiempo DESPUES de vencer su apartado una pendiente pasa a "expired".
+#
+# No cambia la disponibilidad: el cupo ya se libero al vencer HOLD_MINUTES.
+# Sirve para que las abandonadas dejen de estar en "pending" — la lista de
+# "review" del admin y las consultas de cupos no tienen que recorrerlas.
+# El margen deja a la pagina de confirmacion y al webhook terminar lo que
+# estuviera en vuelo. Lo consume db/sweep.py.
+EXPIRE_GRACE_MINUTES = 60
+
 # Feriados y dias libres. Es un array de fechas "YYYY-MM-DD".
-# Se lee en cada peticion, asi que editarlo tiene efecto sin tocar codigo.
+# Se vuelve a leer en cuanto cambia la fecha de modificacion del archivo,
+# asi que editarlo tiene efecto sin tocar codigo ni reiniciar.
 BLOCKED_FILE = Path("data/blocked_dates.json")
 
 # Deposito que se cobra al reservar. Igual en los tres planes: un solo
@@ -114,6 +125,11 @@ BLOCKED_FILE = Path("data/blocked_dates.json")
 DEPOSIT = settings.booking_deposit
 
 
+# El unico mensaje de rechazo (ver el final de validate_selection). Constante
+# porque tambien lo usa la ruta cuando el cupo se pierde al guardar.
+UNAVAILABLE = "That time is no longer available. Please pick another one."
+
+
 class BookingUnavailable(Exception):
     """La franja que pidio el cliente ya no se puede reservar.
 
@@ -140,6 +156,140 @@ def slot_label(slot: int) -> str:
     return f"{start:%-I:%M %p} - {end:%-I:%M %p}"
 
 
+def _blocked_dates() -> set[date]:
+    """Feriados de data/blocked_dates.json, ya convertidos a fechas.
+
+    Si el archivo tiene una fecha mal escrita (por ejemplo "2026-13-45"),
+    fromisoformat lanza ValueError y la pagina falla. Eso es intencional: es
+    preferible que reviente ahora, mientras se prueba, a que la fecha se
+    ignore en silencio y se termine tomando una reserva el 25 de diciembre.
+
+    Se guarda en memoria junto a la fecha de modificacion del archivo. Leer
+    esa fecha es una llamada al sistema; abrir y parsear el JSON solo pasa
+    cuando alguien lo edito.
+    """
+    global _blocked_cache
+    mtime = BLOCKED_FILE.stat().st_mtime_ns
+    if _blocked_cache is None or _blocked_cache[0] != mtime:
+        blocked = {date.fromisoformat(d) for d in json.loads(BLOCKED_FILE.read_text())}
+        _blocked_cache = (mtime, blocked)
+    return _blocked_cache[1]
+
+
+# (mtime del archivo, fechas). None = todavia no se leyo.
+_blocked_cache: tuple[int, set[date]] | None = None
+
+
+# ---------------------------------------------------------------------------
+# LAS REGLAS
+#
+# Las dos funciones de abajo son las reglas del calendario, escritas UNA vez.
+# open_days las aplica a todo el horizonte; validate_selection a un solo par
+# (dia, franja). Si las reglas estuvieran copiadas en los dos sitios, tarde o
+# temprano se desincronizan — se cambia el horizonte en un lado, se olvida el
+# otro, y el calendario ofrece un dia que la validacion rechaza.
+# ---------------------------------------------------------------------------
+
+def _day_is_open(day: date, ref: datetime, blocked: set[date]) -> bool:
+    """El dia entra en el calendario: dentro del horizonte, laborable y no feriado.
+
+    El horizonte va de hoy hasta HORIZON_DAYS dias despues, los dos incluidos.
+    """
+    today = ref.date()
+    return (today <= day <= today + timedelta(days=HORIZON_DAYS)
+            and day.weekday() in WORK_WEEKDAYS
+            and day not in blocked)
+
+
+def _slot_is_open(start: datetime, used: int, ref: datetime) -> bool:
+    """La franja que empieza en `start` se puede ofrecer.
+
+    Dos condiciones:
+      (a) Todavia hay cupo: los `used` ocupados no llegan al maximo.
+      (b) Falta suficiente anticipacion. Restar dos datetimes con zona da un
+          timedelta, que se compara directo contra las 24 horas. Es ">=",
+          asi que exactamente 24 horas si califica.
+    """
+    return used < CREWS and start - ref >= timedelta(hours=LEAD_HOURS)
+
+
+def _slot_start(day: date, slot: int) -> datetime:
+    """Inicio de la franja en la zona del negocio.
+
+    datetime.combine junta la fecha del dia con la hora de inicio de la
+    franja y le pone la zona horaria.
+    """
+    return datetime.combine(day, SLOTS[slot][0], TZ)
+
+
+# ---------------------------------------------------------------------------
+# EL ESQUELETO DEL CALENDARIO
+#
+# La mitad del trabajo de open_days no depende de las reservas: que dias del
+# horizonte se trabajan, a que hora empieza cada franja y como se escriben
+# las etiquetas. Eso solo cambia cuando cambia el dia o se edita el archivo de
+# feriados, asi que se calcula una vez y se guarda. Cada peticion solo le
+# superpone lo que si cambia: los cupos ocupados y el corte de anticipacion.
+# ---------------------------------------------------------------------------
+
+def _skeleton(ref: datetime) -> list[tuple[str, str, list[tuple[int, datetime, str]]]]:
+    """Dias laborables del horizonte con sus franjas ya calculadas.
+
+        [("2026-08-21", "Fri, Aug 21", [(1, <inicio con zona>, "8:00 AM - 10:00 AM"), ...]), ...]
+
+    Se reconstruye solo si cambio el dia de `ref` o el mtime de los feriados.
+    """
+    return _skeleton_entry(ref)[1]
+
+
+def _skeleton_entry(ref: datetime):
+    """El esqueleto con su clave y la lista ordenada de inicios de franja.
+
+    Los inicios sueltos y ordenados los usa calendar_version() para saber,
+    con una busqueda binaria, cuantas franjas ya cerro la anticipacion.
+    """
+    global _skeleton_cache
+    blocked = _blocked_dates()
+    key = (ref.date(), _blocked_cache[0])
+    if _skeleton_cache is None or _skeleton_cache[0] != key:
+        days = []
+        # Recorrer un dia a la vez desde hoy hasta el horizonte.
+        # El "+ 1" hace que el ultimo dia tambien entre (range excluye el final).
+        for i in range(HORIZON_DAYS + 1):
+            day = ref.date() + timedelta(days=i)
+            if _day_is_open(day, ref, blocked):
+                days.append((
+                    day.isoformat(),                      # para el value del <select>
+                    f"{day:%a, %b %-d}",                  # "Fri, Aug 21" para el cliente
+                    [(n, _slot_start(day, n), slot_label(n)) for n in SLOTS],
+                ))
+        starts = sorted(start for _, _, slots in days for _, start, _ in slots)
+        _skeleton_cache = (key, days, starts)
+    return _skeleton_cache
+
+
+# ((dia, mtime de feriados), esqueleto, inicios ordenados). None = todavia
+# no se armo.
+_skeleton_cache = None
+
+
+def calendar_version(ref: datetime | None = None) -> str:
+    """Todo lo que, aparte de los cupos, cambia lo que devuelve open_days.
+
+    Son tres cosas: el dia (el horizonte se corre), el archivo de feriados y
+    cuantas franjas ya quedaron dentro del corte de anticipacion. Las dos
+    primeras son la clave del esqueleto; la tercera solo cambia cuando el
+    reloj pasa por el inicio de una franja, no a cada segundo.
+
+    Junto con la version de los cupos forma el ETag de /booking/availability:
+    si las dos coinciden, open_days devolveria exactamente lo mismo.
+    """
+    ref = ref or datetime.now(TZ)
+    (day, mtime), _, starts = _skeleton_entry(ref)
+    closed = bisect_left(starts, ref + timedelta(hours=LEAD_HOURS))
+    return f"{day.isoformat()}.{mtime}.{closed}"
+
+
 def open_days(taken: dict, ref: datetime | None = None) -> list[dict]:
     """Devuelve los dias que tienen al menos una franja libre.
 
@@ -150,7 +300,7 @@ def open_days(taken: dict, ref: datetime | None = None) -> list[dict]:
                cualquier fecha sin cambiar el reloj de la maquina.
 
                OJO: si se pasa un valor, tiene que traer zona horaria. Un
-               datetime sin zona hace que la resta de mas abajo falle con
+               datetime sin zona hace que la resta de _slot_is_open falle con
                TypeError.
 
     Returns:
@@ -170,52 +320,18 @@ def open_days(taken: dict, ref: datetime | None = None) -> list[dict]:
     """
     ref = ref or datetime.now(TZ)
 
-    # Cargar los feriados. Si el archivo tiene una fecha mal escrita
-    # (por ejemplo "2026-13-45"), fromisoformat lanza ValueError y la pagina
-    # falla. Eso es intencional: es preferible que reviente ahora, mientras
-    # se prueba, a que la fecha se ignore en silencio y se termine tomando
-    # una reserva el 25 de diciembre.
-    blocked = {date.fromisoformat(d) for d in json.loads(BLOCKED_FILE.read_text())}
-
     days = []
-
-    # Recorrer un dia a la vez desde hoy hasta el horizonte.
-    # El "+ 1" hace que el ultimo dia tambien entre (range excluye el final).
-    for i in range(HORIZON_DAYS + 1):
-        day = ref.date() + timedelta(days=i)
-
-        # Filtro 1: dias que no se trabajan. `continue` salta al siguiente
-        # dia del bucle sin evaluar nada mas.
-        if day.weekday() not in WORK_WEEKDAYS or day in blocked:
-            continue
-
+    for iso, label, slots in _skeleton(ref):
         # Cupos ya ocupados de ESTE dia. Si el dia no esta en el diccionario,
         # .get devuelve {} — o sea, dia completamente libre.
-        used = taken.get(day.isoformat(), {})
-
-        # Filtro 2 y 3: recorrer las franjas y quedarse con las que pasan
-        # las dos condiciones.
-        free = [
-            n
-            for n, (start, _) in SLOTS.items()
-            # (a) Todavia hay cupo: los ocupados no llegan al maximo.
-            if used.get(n, 0) < CREWS
-            # (b) Falta suficiente anticipacion.
-            #     datetime.combine junta la fecha del dia con la hora de
-            #     inicio de la franja y le pone la zona horaria. Restar dos
-            #     datetimes da un timedelta, que se compara directo contra
-            #     las 24 horas.
-            #     Es ">=", asi que exactamente 24 horas si califica.
-            and datetime.combine(day, start, TZ) - ref >= timedelta(hours=LEAD_HOURS)
-        ]
+        used = taken.get(iso, {})
+        free = [{"n": n, "label": text}
+                for n, start, text in slots
+                if _slot_is_open(start, used.get(n, 0), ref)]
 
         # Si quedo alguna franja libre, el dia entra en la respuesta.
         if free:
-            days.append({
-                "date": day.isoformat(),                  # para el value del <select>
-                "label": f"{day:%a, %b %-d}",             # "Fri, Aug 21" para el cliente
-                "slots": [{"n": n, "label": slot_label(n)} for n in free],
-            })
+            days.append({"date": iso, "label": label, "slots": free})
 
     return days
 
@@ -236,14 +352,11 @@ def validate_selection(day: str, slot: int, taken: dict, ref=None) -> tuple[date
         que devolver dinero.
 
     COMO ESTA HECHA
-        No repite las reglas (dia habil, feriado, horizonte, anticipacion,
-        cupo). En vez de eso le pregunta a open_days: "esta esta seleccion
-        entre las opciones que yo mismo ofreci?".
-
-        Eso importa: si las reglas estuvieran escritas dos veces, tarde o
-        temprano se desincronizan — se cambia el horizonte en un lado, se
-        olvida el otro, y el calendario ofrece un dia que la validacion
-        rechaza. Con una sola fuente de verdad eso no puede pasar.
+        Evalua solo el par (dia, franja) que llego, con las MISMAS funciones
+        de reglas que usa open_days (_day_is_open y _slot_is_open). Antes
+        generaba el calendario entero — 31 dias con sus etiquetas — para
+        buscar una sola opcion en el. Ahora cuesta lo mismo tenga el
+        horizonte 30 dias o 300, y las reglas siguen escritas una sola vez.
 
     Args:
         day:   fecha en texto ISO, tal como vino del formulario ("2026-08-21").
@@ -258,9 +371,24 @@ def validate_selection(day: str, slot: int, taken: dict, ref=None) -> tuple[date
     Raises:
         BookingUnavailable: si la seleccion no esta disponible.
     """
-    for d in open_days(taken, ref):
-        if d["date"] == day and any(s["n"] == slot for s in d["slots"]):
-            return date.fromisoformat(day), slot
+    ref = ref or datetime.now(TZ)
+
+    # Una fecha que no se puede leer cuenta como "no disponible", igual que
+    # cuando se buscaba en la lista de open_days y no aparecia. Tambien una
+    # que Python si entiende pero no esta en formato ISO ("20260821"): el
+    # calendario nunca la habria ofrecido asi.
+    try:
+        picked = date.fromisoformat(day)
+    except ValueError:
+        picked = None
+
+    if (picked is not None
+            and picked.isoformat() == day
+            and slot in SLOTS
+            and _day_is_open(picked, ref, _blocked_dates())
+            and _slot_is_open(_slot_start(picked, slot),
+                              taken.get(day, {}).get(slot, 0), ref)):
+        return picked, slot
 
     # Un solo mensaje para todos los casos de rechazo.
     #
@@ -269,4 +397,4 @@ def validate_selection(day: str, slot: int, taken: dict, ref=None) -> tuple[date
     # validas. Quien llega hasta aqui o tiene la pagina vieja abierta — y
     # para el, "ya no esta disponible" es literalmente la verdad — o esta
     # manipulando el POST, y a ese no se le deben explicaciones.
-    raise BookingUnavailable("That time is no longer available. Please pick another one.")
\ No newline at end of file
+    raise BookingUnavailable(UNAVAILABLE)
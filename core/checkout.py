@@ -1,58 +1,181 @@
 """
 Lógica de Stripe Checkout — funciones reutilizables.
 
-Aqui se configura la clave de la API, y no en un router: los dos modulos que
-hablan con Stripe (payments y booking) importan este archivo, asi que la clave
-queda puesta llegue quien llegue primero. Antes vivia en routes/payments.py y
-las reservas solo funcionaban porque main.py lo importaba antes — reordenar
-esos imports las habria roto con "No API key provided".
+Todas las llamadas a la API de Stripe pasan por aqui, y todas son async. La
+libreria de Stripe por defecto hace cada llamada con un cliente HTTP
+bloqueante: el hilo que atiende la peticion se queda parado todo el viaje de
+ida y vuelta a Stripe, y con el pool de hilos lleno la latencia de Stripe
+pasaba a ser el techo de peticiones por segundo de todo el sitio.
+
+Ahora hay UN cliente compartido (stripe_client()) sobre httpx.AsyncClient,
+que se cierra al apagar la app (close_stripe_client):
+
+  - Reutiliza conexiones. No se repite el handshake TLS con Stripe en cada
+    checkout.
+  - Tiene timeout (STRIPE_TIMEOUT). Un Stripe lento devuelve error en vez de
+    colgar la peticion.
+  - Limita cuantas llamadas hay en vuelo a la vez (STRIPE_MAX_CONCURRENCY).
+    Una rafaga de checkouts espera su turno aqui en vez de abrir cientos de
+    conexiones.
+
+La clave de la API vive en el cliente, no en un router: los modulos que
+hablan con Stripe importan este archivo, asi que la clave queda puesta llegue
+quien llegue primero.
 """
+import asyncio
+import ssl
+import time
+from dataclasses import dataclass
+
+import httpx
 import stripe
+
 from core.config import settings
 
-stripe.api_key = settings.stripe_secret_key
 
+class _PooledHTTPXClient(stripe.HTTPClient):
+    """Cliente HTTP para la libreria de Stripe sobre un httpx.AsyncClient propio.
+
+    stripe.HTTPXClient crea su httpx.AsyncClient sin dejar configurar el pool.
+    La libreria acepta cualquier subclase de stripe.HTTPClient que implemente
+    las llamadas, asi que esta hace las async con un pool del tamano de
+    STRIPE_MAX_CONCURRENCY, que es justo el numero de conexiones que el
+    semaforo deja usar a la vez. Solo async: nada en la app llama a Stripe
+    de forma sincrona.
+    """
+
+    name = "httpx"
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._client = httpx.AsyncClient(
+            verify=ssl.create_default_context(cafile=stripe.ca_bundle_path),
+            timeout=settings.stripe_timeout,
+            limits=httpx.Limits(max_connections=settings.stripe_max_concurrency,
+                                max_keepalive_connections=settings.stripe_max_concurrency),
+        )
+
+    async def request_async(self, method, url, headers, post_data=None):
+        try:
+            response = await self._client.request(method, url, headers=headers, content=post_data)
+        except httpx.HTTPError as e:
+            # Lo mismo que hace stripe.HTTPXClient: un error de red es
+            # APIConnectionError, y max_network_retries lo reintenta.
+            raise stripe.APIConnectionError(
+                f"Unexpected error communicating with Stripe. (Network error: {e!r})",
+                should_retry=True) from e
+        return response.content, response.status_code, response.headers
+
+    def sleep_async(self, secs):
+        return asyncio.sleep(secs)
+
+    async def close_async(self) -> None:
+        await self._client.aclose()
+
+
+# (event loop, cliente, su cliente HTTP, semaforo). Un httpx.AsyncClient y un
+# Semaphore solo sirven dentro del event loop en que se usaron por primera
+# vez: si el loop cambia (las pruebas arrancan uno por cliente), se crean de
+# nuevo y el anterior se cierra.
+_state: tuple[asyncio.AbstractEventLoop, stripe.StripeClient,
+              _PooledHTTPXClient, asyncio.Semaphore] | None = None
+
+
+def stripe_client() -> tuple[stripe.StripeClient, asyncio.Semaphore]:
+    """El cliente compartido de Stripe y el semaforo que limita las llamadas.
 
-def create_stripe_session(amount: float, description: str = "") -> str:
+    Se usa asi:
+
+        client, limit = stripe_client()
+        async with limit:
+            s = await client.checkout.sessions.retrieve_async(session_id)
+
+    STRIPE_API_BASE cambia el servidor al que se habla. Vacio = la API real;
+    en pruebas apunta a un doble local de Stripe.
+    """
+    global _state
+    loop = asyncio.get_running_loop()
+    if _state is None or _state[0] is not loop:
+        _discard(_state)
+        http = _PooledHTTPXClient()
+        base = {"api": settings.stripe_api_base} if settings.stripe_api_base else {}
+        client = stripe.StripeClient(
+            settings.stripe_secret_key,
+            http_client=http,
+            base_addresses=base,
+            max_network_retries=1,
+        )
+        _state = (loop, client, http, asyncio.Semaphore(settings.stripe_max_concurrency))
+    return _state[1], _state[3]
+
+
+def _discard(state) -> None:
+    """Cierra el cliente de un loop que ya no es el actual.
+
+    Sus conexiones solo se pueden cerrar desde su propio loop: si sigue
+    vivo, se le pide a el. Si ya se cerro (asyncio.run termino), no queda
+    donde esperar el cierre y sus sockets se van con el recolector.
+    """
+    if state is not None and not state[0].is_closed():
+        asyncio.run_coroutine_threadsafe(state[2].close_async(), state[0])
+
+
+async def close_stripe_client() -> None:
+    """Cierra el cliente compartido. Lo llama el apagado de la app (main.py)."""
+    global _state
+    state, _state = _state, None
+    if state is None:
+        return
+    if state[0] is asyncio.get_running_loop():
+        await state[2].close_async()
+    else:
+        _discard(state)
+
+
+def _line_item(amount: float, name: str) -> dict:
+    return {
+        "price_data": {
+            "currency": settings.stripe_currency,
+            "product_data": {"name": name},
+            "unit_amount": int(round(amount * 100)),  # Stripe usa centavos
+        },
+        "quantity": 1,
+    }
+
+
+async def create_stripe_session(amount: float, description: str = "") -> str:
     """
     Crea una sesión de Stripe Checkout.
-    
+
     Args:
         amount: Monto en dólares (ej: 99.99)
         description: Descripción del producto (ej: "Electrical Service Payment")
-    
+
     Returns:
         La URL de la sesión de Stripe (session.url)
-    
+
     Raises:
         ValueError: Si amount <= 0
     """
     if amount <= 0:
         raise ValueError("Amount must be greater than 0")
-    
-    session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        mode="payment",
-        line_items=[
-            {
-                "price_data": {
-                    "currency": settings.stripe_currency,
-                    "product_data": {
-                        "name": description.strip() or "Electric Service Payment",
-                    },
-                    "unit_amount": int(round(amount * 100)),  # Stripe usa centavos
-                },
-                "quantity": 1,
-            }
-        ],
-        success_url=f"{settings.base_url}/payments/success",
-        cancel_url=f"{settings.base_url}/payments/cancel",
-    )
-    
+
+    client, limit = stripe_client()
+    async with limit:
+        session = await client.checkout.sessions.create_async(params={
+            "payment_method_types": ["card"],
+            "mode": "payment",
+            "line_items": [_line_item(amount, description.strip() or "Electric Service Payment")],
+            "success_url": f"{settings.base_url}/payments/success",
+            "cancel_url": f"{settings.base_url}/payments/cancel",
+        })
+
     return session.url
 
-def create_booking_session(amount: float, description: str,
-                           success_url: str, cancel_url: str, metadata: dict):
+
+async def create_booking_session(amount: float, description: str,
+                                 success_url: str, cancel_url: str, metadata: dict,
+                                 idempotency_key: str | None = None):
     """Sesion de Stripe para una reserva de instalacion.
 
     Se separa de create_stripe_session porque una reserva necesita tres
@@ -70,22 +193,135 @@ def create_booking_session(amount: float, description: str,
     con create_stripe_session, y por eso son dos funciones y no una con
     parametros opcionales: cambiarle el retorno a la existente romperia
     routes/payments.py.
+
+    `idempotency_key` se manda a Stripe tal cual: dos llamadas con la misma
+    clave (y los mismos datos) devuelven la MISMA sesion en vez de crear
+    otra. Stripe recuerda la clave 24 horas.
     """
     if amount <= 0:
         raise ValueError("Amount must be greater than 0")
 
-    return stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        mode="payment",
-        line_items=[{
-            "price_data": {
-                "currency": settings.stripe_currency,
-                "product_data": {"name": description},
-                "unit_amount": int(round(amount * 100)),  # Stripe usa centavos
-            },
-            "quantity": 1,
-        }],
-        metadata=metadata,
-        success_url=success_url,
-        cancel_url=cancel_url,
-    )
\ No newline at end of file
+    client, limit = stripe_client()
+    async with limit:
+        return await client.checkout.sessions.create_async(params={
+            "payment_method_types": ["card"],
+            "mode": "payment",
+            "line_items": [_line_item(amount, description)],
+            "metadata": metadata,
+            "success_url": success_url,
+            "cancel_url": cancel_url,
+        }, options={"idempotency_key": idempotency_key} if idempotency_key else {})
+
+
+def stripe_email(obj) -> str:
+    """Email que Stripe recogio en su checkout. Cadena vacia si no viene.
+
+    Sirve igual para la sesion que devuelve la API y para el objeto que llega
+    en el webhook: los dos son diccionarios con la misma forma.
+
+    El encadenado con "or" evita reventar si Stripe omitiera el bloque — no
+    deberia pasar, pero un email ausente jamas puede tumbar la confirmacion de
+    un pago que ya se cobro.
+    """
+    return (obj.get("customer_details") or {}).get("email") or ""
+
+
+async def retrieve_session(session_id: str):
+    """Estado actual de una sesion de Checkout. Lanza stripe.StripeError si falla."""
+    client, limit = stripe_client()
+    async with limit:
+        return await client.checkout.sessions.retrieve_async(session_id)
+
+
+# Cache de retrieve_session() para la pagina de gracias (ver session_status).
+# Un pago pendiente puede cambiar en cualquier momento, asi que su resultado
+# vale poco; uno pagado ya no cambia. Un error de Stripe se recuerda un rato
+# para no martillar a Stripe mientras falla.
+STATUS_TTL_SECONDS = 5
+PAID_TTL_SECONDS = 300
+ERROR_TTL_SECONDS = 10
+STATUS_CACHE_MAX = 1000
+
+
+@dataclass(frozen=True)
+class _Failed:
+    """Lo que se guarda de un error de Stripe: sus datos, no la excepcion.
+
+    Relanzar la misma instancia en cada acierto le iria sumando frames a su
+    __traceback__ y mantendria vivos los de la primera peticion. Cada
+    acierto lanza una stripe.StripeError nueva con estos datos.
+    """
+    message: str
+    http_status: int | None
+    code: str | None
+
+
+# session_id -> (vence, sesion o _Failed)
+_status_cache: dict[str, tuple[float, object]] = {}
+# session_id -> la consulta que ya esta en vuelo
+_status_inflight: dict[str, asyncio.Future] = {}
+
+
+async def session_status(session_id: str):
+    """retrieve_session() compartida entre peticiones y cacheada unos segundos.
+
+    La pagina /booking/confirmed pregunta a Stripe cada vez que se carga una
+    reserva aun pendiente: el cliente que recarga, la etiqueta de GA4 que
+    vuelve a pedir la pagina. Cada carga era un viaje a Stripe, y varias a la
+    vez eran varios viajes simultaneos por la misma sesion.
+
+    Ahora:
+
+      - Si ya hay una consulta en vuelo para ese session_id, se espera a esa
+        en vez de lanzar otra. N cargas simultaneas = 1 llamada a Stripe.
+      - El resultado se guarda STATUS_TTL_SECONDS (PAID_TTL_SECONDS si ya
+        esta pagada, que no va a cambiar).
+      - Un error de Stripe tambien se guarda, ERROR_TTL_SECONDS, y quien
+        pregunte en ese rato recibe una stripe.StripeError nueva con el mismo
+        mensaje y estado HTTP.
+
+    Lanza stripe.StripeError igual que retrieve_session().
+    """
+    now = time.monotonic()
+    hit = _status_cache.get(session_id)
+    if hit and hit[0] > now:
+        if isinstance(hit[1], _Failed):
+            f = hit[1]
+            raise stripe.StripeError(f.message, http_status=f.http_status, code=f.code)
+        return hit[1]
+
+    pending = _status_inflight.get(session_id)
+    if pending is None or pending.get_loop() is not asyncio.get_running_loop():
+        pending = asyncio.ensure_future(_fetch_status(session_id))
+        _status_inflight[session_id] = pending
+    # shield: si se cancela una de las peticiones que esperan (el cliente
+    # cerro la pestana), la consulta sigue para las demas.
+    return await asyncio.shield(pending)
+
+
+async def _fetch_status(session_id: str):
+    """La consulta de verdad. Guarda el resultado (o el error) en la cache."""
+    try:
+        s = await retrieve_session(session_id)
+    except stripe.StripeError as e:
+        _remember(session_id, ERROR_TTL_SECONDS,
+                  _Failed(e.user_message or str(e), e.http_status, e.code))
+        raise
+    finally:
+        _status_inflight.pop(session_id, None)
+    ttl = PAID_TTL_SECONDS if s.payment_status == "paid" else STATUS_TTL_SECONDS
+    _remember(session_id, ttl, s)
+    return s
+
+
+def _remember(session_id: str, ttl: float, value: object) -> None:
+    now = time.monotonic()
+    # Sin tope la cache creceria con cada session_id visto. Al llenarse se
+    # tiran las vencidas; si aun asi esta llena, se vacia entera — es solo
+    # una cache, lo peor que pasa es una consulta de mas.
+    if len(_status_cache) >= STATUS_CACHE_MAX:
+        for key in [k for k, (exp, _) in _status_cache.items() if exp <= now]:
+            del _status_cache[key]
+        if len(_status_cache) >= STATUS_CACHE_MAX:
+            _status_cache.clear()
+    _status_cache[session_id] = (now + ttl, value)
@@ -60,6 +60,12 @@ class Settings:
     smtp_user: str = _get("SMTP_USER", "")
     smtp_pass: str = _get("SMTP_PASS", "")
     email_to_owner: str = _get("EMAIL_TO_OWNER", "")
+    # Avisos al dueno que llegan con menos de estos segundos de diferencia
+    # salen juntos en un solo correo (ver core/emailer.py). 0 = uno por aviso.
+    notify_coalesce_seconds: int = int(_get("NOTIFY_COALESCE_SECONDS", "60") or "60")
+    # Hora local (0-23) del resumen diario con las instalaciones de manana.
+    # Vacia = sin resumen (ver core/notify.py).
+    notify_digest_hour: str = _get("NOTIFY_DIGEST_HOUR", "")
 
     # Stripe
     stripe_secret_key: str = _get("STRIPE_SECRET_KEY", "")
@@ -67,6 +73,11 @@ class Settings:
     stripe_webhook_secret_booking: str = _get("STRIPE_WEBHOOK_SECRET_BOOKING", "")
     stripe_currency: str = _get("STRIPE_CURRENCY", "usd")
     stripe_deposit_amount: float = float(_get("STRIPE_DEPOSIT_AMOUNT", "99.00"))
+    # Cliente HTTP de Stripe (ver core/checkout.py). La base vacia = API real;
+    # en pruebas apunta a un doble local de Stripe.
+    stripe_api_base: str = _get("STRIPE_API_BASE", "")
+    stripe_timeout: float = float(_get("STRIPE_TIMEOUT", "10") or "10")
+    stripe_max_concurrency: int = int(_get("STRIPE_MAX_CONCURRENCY", "10") or "10")
 
     # Booking
     # El depósito vive en .env, no en el código: así bajarlo para probar no
@@ -88,5 +99,9 @@ class Settings:
     # Upload rules
     max_upload_mb: int = int(_get("MAX_UPLOAD_MB", "8") or "8")
 
+    # Paginas publicas pre-renderizadas (python -m core.prerender). Vacia =
+    # todo se renderiza en vivo, como siempre.
+    prerender_dir: str = _get("PRERENDER_DIR", "")
+
 
 settings = Settings()
@@ -3,33 +3,191 @@ Envía correo al dueño (opcional).
 Si no hay SMTP configurado, NO falla: solo devuelve False.
 
 Esto es ideal para MVP: primero guardamos en DB, luego activas email.
+
+Los correos no salen durante la peticion. send_owner_email() los deja en la
+cola (tabla OutboxEmail, db/outbox.py) y los manda send_outbox(), una tarea
+de fondo que registra main.py. Antes cada correo abria su propia conexion,
+con STARTTLS y LOGIN, dentro de la peticion: el envio de un estimado o la
+confirmacion de una reserva esperaban al servidor de correo, y si este
+fallaba el aviso se perdia sin rastro.
+
+Ahora:
+  - La tarea mantiene UNA conexion autenticada y la reutiliza para todos los
+    correos mientras no pase SMTP_IDLE_SECONDS sin usarla.
+  - Los avisos que llegan cerca salen juntos en un solo correo
+    (NOTIFY_COALESCE_SECONDS).
+  - Un correo que falla se reintenta con espera creciente (db/outbox.py).
+  - Los que se dan por perdidos quedan en "failed", salen en el log y en
+    /admin/queues.
 """
 
+import logging
 import smtplib
+import time
 from email.message import EmailMessage
+
+from sqlmodel import Session
+
+from core import background
 from core.config import settings
+from db.models import OutboxEmail
+from db.outbox import claim_due, enqueue_email, mark_failed, mark_sent
+from db.session import engine
+
+log = logging.getLogger(__name__)
+
+# Cada cuanto se revisa la cola aunque nadie la despierte. Normalmente la
+# despierta send_owner_email() y el correo sale al momento; esto recoge los
+# reintentos programados.
+OUTBOX_SECONDS = 30
+
+# Una conexion sin usar mas que esto se cierra. Los servidores SMTP cortan
+# las conexiones ociosas por su cuenta; mejor cerrarla antes que descubrirlo
+# al mandar.
+SMTP_IDLE_SECONDS = 60
 
 
 def can_send_email() -> bool:
     return all([settings.smtp_host, settings.smtp_user, settings.smtp_pass, settings.email_to_owner])
 
 
-def send_owner_email(subject: str, body: str) -> bool:
+def send_owner_email(subject: str, body: str, coalesce: bool = True,
+                     dedupe_key: str | None = None) -> bool:
+    """Deja un correo al dueno en la cola. False si no hay SMTP configurado.
+
+    True quiere decir "encolado", no "entregado": lo manda send_outbox() en
+    segundo plano.
+
+    Con `coalesce` (lo normal para los avisos) el correo espera
+    NOTIFY_COALESCE_SECONDS, y los avisos que lleguen mientras tanto salen con
+    el en un solo mensaje: un dia con muchas reservas son unos pocos correos,
+    no uno por reserva. Sale en la primera vuelta de send_outbox() despues de
+    la ventana, como mucho OUTBOX_SECONDS mas tarde. `dedupe_key` evita mandar dos veces lo mismo (ver
+    db/outbox.py); un repetido devuelve False.
+    """
     if not can_send_email():
         return False
 
+    window = settings.notify_coalesce_seconds if coalesce else 0
+    with Session(engine) as session:
+        added = enqueue_email(session, settings.email_to_owner, subject, body,
+                              group_key="owner" if window else None, delay=window,
+                              dedupe_key=dedupe_key)
+    if added and not window:
+        background.wake("outbox")
+    return added
+
+
+class _SMTPConnection:
+    """La conexion SMTP de la tarea de fondo, abierta y autenticada una vez.
+
+    Solo la usa send_outbox(), que corre en un hilo a la vez por proceso: no
+    hace falta lock.
+    """
+
+    def __init__(self) -> None:
+        self._server: smtplib.SMTP | None = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        if self._server is not None and time.monotonic() - self._last_used < SMTP_IDLE_SECONDS:
+            return self._server
+        self.close()
+        server = smtplib.SMTP(settings.smtp_host, settings.smtp_port, timeout=30)
+        try:
+            server.starttls()
+            server.login(settings.smtp_user, settings.smtp_pass)
+        except Exception:
+            server.close()
+            raise
+        self._server = server
+        self._last_used = time.monotonic()
+        return server
+
+    def send(self, msg: EmailMessage) -> None:
+        """Manda un mensaje. Si el servidor corto la conexion, reconecta una vez."""
+        try:
+            self._connect().send_message(msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.close()
+            self._connect().send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self) -> None:
+        if self._server is not None and time.monotonic() - self._last_used >= SMTP_IDLE_SECONDS:
+            self.close()
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            pass                                # ya estaba cerrada
+        self._server = None
+
+
+_smtp = _SMTPConnection()
+
+
+def _message(emails: list[OutboxEmail]) -> EmailMessage:
+    """Un solo mensaje para uno o varios correos del mismo grupo.
+
+    Varios avisos se juntan uno debajo del otro, cada uno con su formato
+    alineado de siempre. El asunto cuenta cuantos son y los enumera: en el
+    movil se ve el numero y el primero sin abrir el mensaje.
+    """
+    if len(emails) == 1:
+        subject, body = emails[0].subject, emails[0].body
+    else:
+        subject = f"{len(emails)} NEW - " + " | ".join(e.subject for e in emails)
+        if len(subject) > 180:
+            subject = subject[:177] + "..."
+        body = "\n\n".join(e.body.rstrip("\n") + "\n" for e in emails)
+
     msg = EmailMessage()
     msg["Subject"] = subject
     msg["From"] = settings.smtp_user
-    msg["To"] = settings.email_to_owner
+    msg["To"] = emails[0].to
     msg.set_content(body)
+    return msg
 
-    try:
-        with smtplib.SMTP(settings.smtp_host, settings.smtp_port) as server:
-            server.starttls()
-            server.login(settings.smtp_user, settings.smtp_pass)
-            server.send_message(msg)
-        return True
-    except Exception:
-        # Para producción: loggear excepción. Para MVP: no explotar la app.
-        return False
+
+def _messages(batch: list[OutboxEmail]) -> list[list[OutboxEmail]]:
+    """Parte una tanda en mensajes: los de un mismo grupo y destinatario juntos."""
+    out: dict[tuple, list[OutboxEmail]] = {}
+    for email in batch:
+        key = (email.to, email.group_key) if email.group_key else ("id", email.id)
+        out.setdefault(key, []).append(email)
+    return list(out.values())
+
+
+def send_outbox() -> int:
+    """Tarea de fondo: manda todo lo que ya toca. Devuelve cuantos correos de
+    la cola salieron (varios agrupados cuentan cada uno).
+
+    Un correo que falla no frena los demas: se programa su reintento y se
+    sigue. Si el fallo no fue una respuesta del servidor (red, TLS, login),
+    la conexion se tira y el siguiente correo abre otra.
+    """
+    sent = 0
+    with Session(engine) as session:
+        while batch := claim_due(session):
+            ok = []
+            for emails in _messages(batch):
+                try:
+                    _smtp.send(_message(emails))
+                except Exception as e:
+                    if not isinstance(e, smtplib.SMTPResponseException):
+                        _smtp.close()
+                    for email in emails:
+                        if mark_failed(session, email, repr(e)):
+                            log.error("email %s to %s failed for good: %r", email.id, email.to, e)
+                        else:
+                            log.warning("email %s to %s failed, will retry: %r", email.id, email.to, e)
+                    continue
+                ok.extend(emails)
+            mark_sent(session, ok)
+            sent += len(ok)
+    _smtp.close_if_idle()
+    return sent
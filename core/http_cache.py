@@ -0,0 +1,75 @@
+"""
+GET condicional: ETag, Last-Modified y respuestas 304.
+
+Un navegador (o un bot) que ya tiene una copia manda el ETag que recibio en
+If-None-Match, o la fecha en If-Modified-Since. Si no cambio nada se le
+contesta 304 sin cuerpo: no hay que renderizar, ni serializar, ni mandar
+bytes. Las rutas que lo usan calculan el ETag con algo mucho mas barato que
+la respuesta entera — una version, un mtime — y solo arman el cuerpo cuando
+de verdad hace falta.
+"""
+
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True si el cliente ya tiene esta version (If-None-Match).
+
+    La cabecera puede traer varios ETags separados por comas, o "*". Para
+    If-None-Match el estandar pide la comparacion "debil": un W/ delante no
+    cambia nada, por eso se quita antes de comparar.
+    """
+    header = request.headers.get("if-none-match", "")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    tags = {t.strip().removeprefix("W/") for t in header.split(",")}
+    return etag.removeprefix("W/") in tags
+
+
+def not_modified_since(request: Request, last_modified: datetime) -> bool:
+    """True si la copia del cliente no es anterior a `last_modified`.
+
+    Solo se mira si NO vino If-None-Match: cuando vienen las dos, manda el
+    ETag, que es mas preciso (las fechas HTTP no tienen fracciones de
+    segundo). Una fecha ilegible cuenta como "no tengo copia".
+    """
+    if "if-none-match" in request.headers:
+        return False
+    header = request.headers.get("if-modified-since", "")
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError):
+        return False
+    return last_modified.replace(microsecond=0) <= since
+
+
+def validators(etag: str, last_modified: datetime | None = None,
+               cache_control: str = "no-cache") -> dict:
+    """Cabeceras que acompanan a la respuesta, sea 200 o 304.
+
+    "no-cache" no significa "no guardar": significa "guardalo, pero
+    preguntame antes de usarlo". Es lo que hace que la siguiente visita
+    llegue con If-None-Match y se pueda contestar 304.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def is_fresh(request: Request, etag: str, last_modified: datetime | None = None) -> bool:
+    """True si se puede contestar 304: el cliente ya tiene esta version."""
+    if etag_matches(request, etag):
+        return True
+    return last_modified is not None and not_modified_since(request, last_modified)
+
+
+def not_modified(headers: dict) -> Response:
+    """Respuesta 304. Lleva las mismas cabeceras de cache que la 200."""
+    return Response(status_code=304, headers=headers)
@@ -0,0 +1,296 @@
+"""
+Versiones livianas de las fotos de estimados: preview y miniatura en WebP.
+
+Las fotos llegan tal cual salen del telefono: JPEG de 3-8 MB, a veces de
+lado (el telefono guarda la rotacion en el EXIF en vez de girar la imagen).
+Quien las miraba bajaba el original entero.
+
+Despues de guardar un estimado, submit_estimate despierta la tarea "images"
+y sigue: la peticion no espera nada de esto. La tarea (process_pending_photos)
+toma las fotos sin versiones y genera, por cada una:
+
+  - preview  WebP de hasta PREVIEW_PX de lado, para verla en pantalla
+  - thumb    WebP de hasta THUMB_PX, para listados
+
+Las dos ya derechas (se aplica la rotacion del EXIF) y SIN EXIF: de paso se
+va la ubicacion GPS que traen las fotos de telefono.
+
+El trabajo de imagen corre en un pool de PROCESOS, no de hilos: decodificar
+y redimensionar es CPU pura, y en un hilo competiria por el GIL con las
+peticiones del servidor.
+
+Las fotos se guardan por contenido (core/uploads.py): la misma foto subida
+dos veces es un solo archivo, y sus versiones tambien. Si ya existen, la fila
+nueva se marca "done" sin volver a generarlas. collect_orphan_photos borra
+los archivos que ya no usa ninguna fila.
+
+Generar las versiones es idempotente — mismo nombre de salida, escritura
+atomica — asi que si dos workers toman la misma foto a la vez solo se gasta
+CPU de mas.
+"""
+
+import logging
+import math
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from pathlib import Path
+
+from PIL import Image, ImageOps
+from sqlmodel import Session, select
+
+from core import background
+from db.models import EstimatePhoto
+from db.session import engine
+
+log = logging.getLogger(__name__)
+
+# Donde guarda las fotos routes/estimates.py.
+UPLOAD_ROOT = Path("static/uploads/estimates")
+
+PREVIEW_PX = 1600
+THUMB_PX = 320
+PREVIEW_QUALITY = 80
+THUMB_QUALITY = 70
+
+# Procesos del pool. Pocos: es un negocio pequeno y el servidor comparte la
+# maquina con ellos.
+IMAGE_WORKERS = 2
+
+# Cada cuanto se revisa si quedo alguna foto sin procesar. Normalmente la
+# despierta submit_estimate y la foto sale al momento.
+IMAGES_SECONDS = 60
+
+# Fotos por pasada.
+BATCH = 20
+
+# Una imagen de mas pixeles se rechaza sin decodificar: make_variants mira
+# el tamano de la cabecera antes de tocar los datos. 50 MP cubre cualquier
+# telefono. El limite propio de PIL no basta: solo lanza error por encima del
+# DOBLE de MAX_IMAGE_PIXELS; entre una y dos veces da un aviso y decodifica
+# igual, que es justo el tamano que puede tumbar un proceso del pool.
+MAX_PIXELS = 50_000_000
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _executor() -> ProcessPoolExecutor:
+    """El pool, creado la primera vez que hace falta.
+
+    "spawn" y no "fork": el servidor tiene hilos (el pool de FastAPI, estas
+    mismas tareas) y hacer fork de un proceso con hilos puede heredar un lock
+    tomado y colgar al hijo.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=get_context("spawn"))
+    return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+
+
+def _save_webp(img: Image.Image, dest: Path, quality: int) -> None:
+    """Guarda via .part + rename, como core/uploads.py: nunca a medias. El pid
+    en el .part: dos procesos con la misma foto no comparten temporal."""
+    tmp = dest.with_name(f"{dest.name}.{os.getpid()}.part")
+    try:
+        img.save(tmp, "WEBP", quality=quality, method=4)
+        os.replace(tmp, dest)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def make_variants(src: str, preview: str, thumb: str) -> dict:
+    """Genera preview y miniatura de `src`. Corre dentro del pool de procesos.
+
+    draft() le pide al decodificador JPEG que entregue la imagen ya reducida
+    (1/2, 1/4, 1/8): una foto de 12 MP se decodifica a unos 3 MP en vez de
+    entera, que es lo que mas tiempo y memoria ahorra. Se le pide el tamano
+    final con la proporcion de la foto: draft solo reduce mientras los DOS
+    lados sigan por encima de lo pedido, y con un cuadrado de PREVIEW_PX una
+    foto 4:3 no bajaba nunca.
+
+    Devuelve segundos y pico de memoria del proceso, para medir.
+    """
+    started = time.perf_counter()
+    with Image.open(src) as img:
+        if img.width * img.height > MAX_PIXELS:
+            raise Image.DecompressionBombError(
+                f"{img.width}x{img.height} is over {MAX_PIXELS} pixels")
+        scale = PREVIEW_PX / max(img.size)
+        img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+
+        img.thumbnail((PREVIEW_PX, PREVIEW_PX), Image.Resampling.LANCZOS)
+        _save_webp(img, Path(preview), PREVIEW_QUALITY)
+
+        img.thumbnail((THUMB_PX, THUMB_PX), Image.Resampling.LANCZOS)
+        _save_webp(img, Path(thumb), THUMB_QUALITY)
+
+    return {
+        "seconds": time.perf_counter() - started,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _variant_paths(file_path: str) -> tuple[str, str]:
+    """/static/.../1_abc.jpg -> (/static/.../1_abc.preview.webp, ...thumb.webp)"""
+    stem = file_path.rsplit(".", 1)[0]
+    return f"{stem}.preview.webp", f"{stem}.thumb.webp"
+
+
+def _disk(rel_path: str) -> str:
+    """Ruta web (/static/...) -> ruta en disco (static/...)."""
+    return rel_path.lstrip("/")
+
+
+def _mark_done(photo: EstimatePhoto, preview: str, thumb: str) -> None:
+    photo.preview_path, photo.thumb_path = preview, thumb
+    photo.variants_status = "done"
+
+
+def _mark_failed(photo: EstimatePhoto, error: object) -> None:
+    log.warning("photo %s (%s): no variants: %r", photo.id, photo.file_path, error)
+    photo.variants_status = "failed"
+
+
+def process_pending_photos() -> int:
+    """Tarea de fondo: genera las versiones que falten. Devuelve cuantas hizo.
+
+    Una foto que no se puede abrir (no es imagen, esta cortada, es demasiado
+    grande, el decodificador revienta con lo que sea) queda en "failed" y no
+    se reintenta; el original sigue ahi. Nunca puede frenar a las demas: las
+    fotos se toman por id, y una que fallara sin marcarse seria la primera de
+    cada vuelta para siempre.
+
+    Si muere un proceso del pool, todas las fotos en vuelo reciben el mismo
+    BrokenProcessPool y no se sabe cual fue. Se guardan las que ya salieron,
+    y las afectadas se repiten DE A UNA en un pool nuevo: la que lo vuelve a
+    tumbar sola es la culpable y queda "failed"; las demas salen bien.
+    """
+    done = 0
+    with Session(engine) as session:
+        while photos := session.exec(
+            select(EstimatePhoto)
+            .where(EstimatePhoto.variants_status == "pending")
+            .order_by(EstimatePhoto.id)
+            .limit(BATCH)
+        ).all():
+            jobs = []
+            # La misma foto dos veces en la tanda (mismo archivo): se procesa
+            # una vez y las dos filas esperan el mismo resultado.
+            futures = {}
+            for photo in photos:
+                preview, thumb = _variant_paths(photo.file_path)
+                if photo.sha256 and os.path.exists(_disk(preview)) and os.path.exists(_disk(thumb)):
+                    # La misma foto ya se habia subido: sus versiones estan.
+                    _mark_done(photo, preview, thumb)
+                    session.add(photo)
+                    done += 1
+                    continue
+                future = futures.get(photo.file_path)
+                if future is None:
+                    future = _executor().submit(make_variants, _disk(photo.file_path),
+                                                _disk(preview), _disk(thumb))
+                    futures[photo.file_path] = future
+                jobs.append((photo, preview, thumb, future))
+
+            broken = []
+            for photo, preview, thumb, future in jobs:
+                try:
+                    future.result()
+                except BrokenProcessPool:
+                    broken.append((photo, preview, thumb))
+                    continue
+                except Exception as e:
+                    _mark_failed(photo, e)
+                else:
+                    _mark_done(photo, preview, thumb)
+                    done += 1
+                session.add(photo)
+            session.commit()
+
+            if broken:
+                _reset_pool()
+            for photo, preview, thumb in broken:
+                try:
+                    _executor().submit(make_variants, _disk(photo.file_path),
+                                       _disk(preview), _disk(thumb)).result()
+                except BrokenProcessPool as e:
+                    _reset_pool()
+                    _mark_failed(photo, e)
+                except Exception as e:
+                    _mark_failed(photo, e)
+                else:
+                    _mark_done(photo, preview, thumb)
+                    done += 1
+                session.add(photo)
+                session.commit()
+    return done
+
+
+def wake_images() -> None:
+    """Pide procesar ya las fotos nuevas, sin esperar a IMAGES_SECONDS."""
+    background.wake("images")
+
+
+# Un archivo sin filas se borra solo si nadie lo toco en este rato: una
+# peticion que lo acaba de subir (o de reutilizar) aun no confirmo su fila.
+ORPHAN_GRACE_SECONDS = 3600
+ORPHAN_SECONDS = 3600
+
+
+def collect_orphan_photos() -> int:
+    """Tarea de fondo: borra las fotos que no usa ninguna EstimatePhoto.
+
+    Una foto queda huerfana si falla la peticion que la subio (su fila se
+    deshace, pero el archivo puede ser de otra peticion con la misma foto y
+    no se borra ahi) o si algun dia se borran estimados. Se cuentan las
+    referencias por sha256, de a 500 hashes por consulta; con cero, se va el
+    original y sus versiones. Tambien se van los .part que dejo un proceso
+    muerto a mitad de copia. Devuelve cuantas fotos borro.
+
+    Solo mira las carpetas por contenido (ab/...): las fotos viejas, con
+    nombre {id}_{uuid}, no se tocan.
+    """
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    for part in UPLOAD_ROOT.glob("**/*.part"):
+        if part.stat().st_mtime < cutoff:
+            part.unlink(missing_ok=True)
+
+    files: dict[str, list[Path]] = {}
+    for path in UPLOAD_ROOT.glob("??/*"):
+        files.setdefault(path.name.split(".", 1)[0], []).append(path)
+
+    def touched_recently(paths: list[Path]) -> bool:
+        return any(p.exists() and p.stat().st_mtime >= cutoff for p in paths)
+
+    removed = 0
+    digests = [d for d, paths in files.items() if not touched_recently(paths)]
+    with Session(engine) as session:
+        for i in range(0, len(digests), 500):
+            chunk = digests[i:i + 500]
+            used = set(session.exec(
+                select(EstimatePhoto.sha256).where(EstimatePhoto.sha256.in_(chunk)).distinct()
+            ).all())
+            for digest in chunk:
+                # Se vuelve a mirar la fecha justo antes de borrar: una subida
+                # de la misma foto pudo reutilizarla mientras tanto.
+                if digest in used or touched_recently(files[digest]):
+                    continue
+                for path in files[digest]:
+                    path.unlink(missing_ok=True)
+                removed += 1
+    return removed
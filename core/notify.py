@@ -3,11 +3,27 @@ Aviso al equipo cuando entra una reserva pagada.
 
 Se apoya en core/emailer.py, que ya existe y ya devuelve False sin romper
 cuando no hay SMTP configurado. No agrega ningun servicio ni dependencia.
+El correo no sale aqui: queda en la cola de core/emailer.py y lo manda la
+tarea de fondo. Los avisos que llegan seguidos se juntan alli en un solo
+correo (NOTIFY_COALESCE_SECONDS), cada uno con este mismo formato.
+
+Con NOTIFY_DIGEST_HOUR hay ademas un resumen diario con las instalaciones
+del dia siguiente (send_daily_digest).
 """
 
-from core.booking import slot_label
+from datetime import date, datetime, timedelta
+
+from sqlmodel import Session
+
+from core.booking import TZ, slot_label
+from core.config import settings
 from core.emailer import send_owner_email
+from db.booking import paid_on
 from db.models import Booking
+from db.session import engine
+
+# Cada cuanto la tarea de fondo mira si ya toca el resumen diario.
+DIGEST_CHECK_SECONDS = 300
 
 
 def _subject(b: Booking) -> str:
@@ -16,7 +32,8 @@ def _subject(b: Booking) -> str:
     Lleva fecha, franja y nombre porque en el telefono el asunto es lo unico
     que se ve sin abrir el mensaje: con eso ya se sabe si hay que moverse.
     """
-    return f"BOOKING {b.service_date:%a %b %-d} {slot_label(b.slot)} - {b.customer_name}"
+    prefix = "OVERBOOKED - PAID, NO SLOT" if b.status == "overbooked" else "BOOKING"
+    return f"{prefix} {b.service_date:%a %b %-d} {slot_label(b.slot)} - {b.customer_name}"
 
 
 def _body(b: Booking) -> str:
@@ -25,9 +42,13 @@ def _body(b: Booking) -> str:
     En texto plano y con las etiquetas alineadas a proposito — se lee igual
     de bien en el movil que en el escritorio, sin depender de HTML.
     """
+    warning = ("" if b.status != "overbooked" else
+               "PAID AFTER THE HOLD EXPIRED AND THE SLOT IS FULL.\n"
+               "Call the customer to move the job or refund the deposit.\n\n")
     return (
         f"NEW BOOKING   #{b.public_id}\n"
         f"{'=' * 44}\n\n"
+        f"{warning}"
         f"WHEN     {b.service_date:%A, %B %-d}  -  {slot_label(b.slot)}\n"
         f"WHO      {b.customer_name}  -  {b.customer_phone}\n"
         f"EMAIL    {b.customer_email or '-'}\n"
@@ -40,7 +61,7 @@ def _body(b: Booking) -> str:
 
 
 def notify_new_booking(booking: Booking) -> bool:
-    """Avisa de una reserva pagada. Devuelve True si el correo salio.
+    """Avisa de una reserva pagada. Devuelve True si el correo quedo en cola.
 
     NUNCA lanza. El cliente ya pago y su pagina de confirmacion tiene que
     cargar aunque el correo falle. La reserva ya esta guardada en la base, asi
@@ -50,3 +71,46 @@ def notify_new_booking(booking: Booking) -> bool:
         return send_owner_email(subject=_subject(booking), body=_body(booking))
     except Exception:
         return False
+
+
+def _digest_body(day: date, bookings: list[Booking]) -> str:
+    """Las instalaciones de un dia, una debajo de otra, con el mismo formato
+    alineado que el aviso de reserva."""
+    lines = [f"INSTALLS  {day:%A, %B %-d}  -  {len(bookings)}", "=" * 44, ""]
+    for b in bookings:
+        lines += [
+            f"WHEN     {slot_label(b.slot)}",
+            f"WHO      {b.customer_name}  -  {b.customer_phone}",
+            f"WHERE    {b.address}",
+            f"PACKAGE  {b.plan_name}  -  collect ${b.balance_due}",
+            f"NOTES    {b.notes or '-'}",
+            "",
+        ]
+    return "\n".join(lines)
+
+
+def send_daily_digest() -> bool:
+    """Tarea de fondo: resumen de las instalaciones de manana, una vez al dia.
+
+    Sale a partir de NOTIFY_DIGEST_HOUR (hora del negocio). La tarea mira
+    cada DIGEST_CHECK_SECONDS; el dedupe_key por fecha hace que salga una
+    sola vez aunque haya varios workers o la app se reinicie. Un dia sin
+    instalaciones no manda nada. Devuelve True si encolo el resumen.
+    """
+    if not settings.notify_digest_hour:
+        return False
+    now = datetime.now(TZ)
+    if now.hour < int(settings.notify_digest_hour):
+        return False
+
+    day = now.date() + timedelta(days=1)
+    with Session(engine) as session:
+        bookings = paid_on(session, day)
+    if not bookings:
+        return False
+    return send_owner_email(
+        subject=f"TOMORROW {day:%a %b %-d} - {len(bookings)} install(s)",
+        body=_digest_body(day, bookings),
+        coalesce=False,
+        dedupe_key=f"digest-{day.isoformat()}",
+    )
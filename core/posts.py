@@ -1,16 +1,64 @@
 """
-Lectura del indice del blog (data/blog_posts.json).
+Lectura del indice del blog (data/blog_posts.json) y de los posts (posts/).
 
 Un solo sitio que lo abre, para que /blog y /sitemap.xml nunca se
 desincronicen: publicar un post lo hace aparecer en los dos a la vez.
+
+Todo queda en memoria. Antes cada visita a un post releia el JSON, buscaba
+el slug recorriendo la lista y convertia el markdown a HTML; el contenido solo
+cambia cuando se despliega o se edita un archivo, y el trafico del blog viene
+de Google, un post a la vez. Ahora:
+
+  - El indice se lee una vez, con un diccionario slug -> post al lado.
+  - El HTML de cada post se genera una vez.
+  - Cada archivo se recuerda con su (mtime, tamano). Por peticion solo se
+    hace un stat(): si cambio, se relee ESE archivo y nada mas. Si el
+    contenido es el mismo (un deploy que solo toca la fecha), ni se vuelve a
+    convertir: tambien se guarda su sha256.
+
+Las rutas corren en hilos: dos peticiones a la vez sobre un archivo recien
+cambiado pueden convertirlo las dos. Es trabajo de mas, no un error: cada
+entrada se sustituye entera de una vez.
 """
 
+import hashlib
 import json
+from datetime import datetime, timezone
 from pathlib import Path
 
+import markdown as md
+
 # Ruta absoluta y no relativa: asi funciona sin depender de desde donde se
 # arranque el proceso. Mismo patron que core/offers.py con surge_offers.json.
 _PATH = Path(__file__).resolve().parent.parent / "data" / "blog_posts.json"
+POSTS_DIR = Path(__file__).resolve().parent.parent / "posts"
+
+# (mtime, tamano) del indice, la lista y slug -> post.
+_index: tuple[tuple | None, list[dict], dict[str, dict]] = (None, [], {})
+# archivo .md -> ((mtime, tamano), sha256 del texto, html)
+_html: dict[str, tuple[tuple, str, str]] = {}
+
+
+def _stamp(path: Path) -> tuple | None:
+    """(mtime, tamano) del archivo, o None si no existe."""
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _load_index() -> tuple[list[dict], dict[str, dict]]:
+    global _index
+    stamp = _stamp(_PATH)
+    if stamp != _index[0]:
+        posts = json.loads(_PATH.read_text(encoding="utf-8")) if stamp else []
+        _index = (stamp, posts, {p["slug"]: p for p in posts if p.get("slug")})
+        # Los HTML de posts que salieron del indice ya no se van a pedir.
+        files = {p.get("file") for p in posts}
+        for name in [n for n in _html if n not in files]:
+            _html.pop(name, None)
+    return _index[1], _index[2]
 
 
 def load_posts() -> list[dict]:
@@ -19,7 +67,39 @@ def load_posts() -> list[dict]:
     No revienta cuando falta el archivo a proposito: un blog sin posts es una
     pagina vacia, no un error de servidor — y ahora tambien lo lee el sitemap,
     donde un fallo dejaria a Google sin ninguna URL.
+
+    La lista es la de la cache, compartida: se lee, no se modifica.
     """
-    if not _PATH.exists():
-        return []
-    return json.loads(_PATH.read_text(encoding="utf-8"))
+    return _load_index()[0]
+
+
+def index_modified() -> datetime | None:
+    """Cuando cambio data/blog_posts.json (UTC), o None si no esta."""
+    _load_index()
+    stamp = _index[0]
+    return datetime.fromtimestamp(stamp[0] / 1e9, timezone.utc) if stamp else None
+
+
+def get_post(slug: str) -> dict | None:
+    """El post con ese slug, o None. Una busqueda en diccionario."""
+    return _load_index()[1].get(slug)
+
+
+def render_post(post: dict) -> str | None:
+    """HTML del markdown del post, o None si su archivo no esta."""
+    name = post["file"]
+    path = POSTS_DIR / name
+    stamp = _stamp(path)
+    if stamp is None:
+        _html.pop(name, None)
+        return None
+
+    hit = _html.get(name)
+    if hit and hit[0] == stamp:
+        return hit[2]
+
+    text = path.read_text(encoding="utf-8")
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    html = hit[2] if hit and hit[1] == digest else md.markdown(text)
+    _html[name] = (stamp, digest, html)
+    return html
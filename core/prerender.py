@@ -0,0 +1,197 @@
+"""
+Paginas publicas pre-renderizadas: se generan una vez y se sirven del disco.
+
+La home, las tres landings de /services, /blog y cada post son iguales para
+todo visitante anonimo del mismo idioma, pero cada visita las volvia a pasar
+por Jinja (y la de surge protector releia data/surge_offers.json). Ninguna lee
+la peticion salvo para el idioma (?lang= o la cookie, core/utils.get_lang).
+
+Dos piezas:
+
+  - El build, en el deploy, despues de instalar y antes de arrancar:
+
+        python -m core.prerender                 # a PRERENDER_DIR o "build/"
+        python -m core.prerender --out /tmp/site
+
+    Pide cada pagina a las mismas rutas de siempre (en memoria, sin
+    servidor) una vez por idioma de SUPPORTED_LANGS, y guarda el HTML mas
+    una copia .gz ya comprimida al maximo. manifest.json anota por pagina
+    el tipo, el ETag (hash del contenido) y la fecha de modificacion; un
+    rebuild que no cambia una pagina le conserva la fecha.
+
+  - Prerendered: middleware que, con PRERENDER_DIR configurado, contesta
+    esas rutas desde los archivos — la version .gz si el navegador acepta
+    gzip — con ETag, Last-Modified y 304 (core/http_cache.py). Todo lo demas
+    (formularios, reservas, admin, un post publicado despues del build) pasa
+    a la app como siempre.
+
+Lo pre-renderizado es una foto del momento del build: cambiar un post, un
+precio de data/surge_offers.json o una plantilla pide volver a correrlo.
+"""
+
+import argparse
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI, Request
+
+from core.http_cache import is_fresh, not_modified, validators
+from core.posts import load_posts
+from core.utils import SUPPORTED_LANGS, get_lang
+
+log = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+# Las landings de servicio que existen como pagina (las retiradas son 301).
+SERVICE_PAGES = (
+    "/services/electrical-repair-installation",
+    "/services/surge-protector-installation",
+    "/services/ev-charger-installation",
+)
+
+
+def static_paths() -> list[str]:
+    """Las rutas que se pre-renderizan."""
+    return ["/", *SERVICE_PAGES, "/blog", *(f"/blog/{p['slug']}" for p in load_posts())]
+
+
+def _page_app() -> FastAPI:
+    """Solo los routers de paginas publicas: el build no necesita la base,
+    ni las tareas de fondo, ni nada de lo que arranca main.create_app."""
+    from routes.blog import router as blog_router
+    from routes.home import router as home_router
+    from routes.services import router as services_router
+
+    app = FastAPI()
+    for router in (home_router, services_router, blog_router):
+        app.include_router(router)
+    return app
+
+
+def _file_for(out: Path, lang: str, path: str) -> Path:
+    """/blog/x en "es" -> out/es/blog/x/index.html"""
+    return out / lang / path.strip("/") / "index.html"
+
+
+async def build(out: Path) -> dict:
+    """Genera todas las paginas en `out` y escribe el manifest. Lo devuelve."""
+    manifest_path = out / MANIFEST
+    previous = json.loads(manifest_path.read_text()) if manifest_path.exists() else {}
+    now = datetime.now(timezone.utc).replace(microsecond=0).isoformat()
+
+    manifest: dict[str, dict[str, dict]] = {}
+    transport = httpx.ASGITransport(app=_page_app())
+    async with httpx.AsyncClient(transport=transport, base_url="http://prerender") as client:
+        for lang in sorted(SUPPORTED_LANGS):
+            manifest[lang] = {}
+            for path in static_paths():
+                r = await client.get(path, params={"lang": lang})
+                if r.status_code != 200:
+                    # Un post en el indice sin archivo, por ejemplo: se queda
+                    # en vivo, que es como se comportaba siempre.
+                    log.warning("prerender: %s (%s) -> %s, skipped", path, lang, r.status_code)
+                    continue
+
+                body = r.content
+                etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+                old = previous.get(lang, {}).get(path, {})
+
+                dest = _file_for(out, lang, path)
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                dest.write_bytes(body)
+                dest.with_name(dest.name + ".gz").write_bytes(gzip.compress(body, 9, mtime=0))
+
+                manifest[lang][path] = {
+                    "file": dest.relative_to(out).as_posix(),
+                    "type": r.headers["content-type"],
+                    "etag": etag,
+                    "last_modified": old["last_modified"] if old.get("etag") == etag else now,
+                }
+
+    manifest_path.write_text(json.dumps(manifest, indent=1))
+    return manifest
+
+
+class Prerendered:
+    """Contesta GET/HEAD de las paginas del manifest desde `directory`.
+
+    Todo se carga en memoria al arrancar (son unas decenas de KB): servir una
+    pagina es un diccionario y un send. Sin manifest, no hace nada y todo va
+    a la app — un deploy que se salto el build sigue funcionando, en vivo.
+
+    Se monta por FUERA de GZipMiddleware (main.py): lo que sale de aqui ya
+    va comprimido.
+    """
+
+    def __init__(self, app, directory: str) -> None:
+        self.app = app
+        # (lang, path) -> (cabeceras de cache, tipo, cuerpo, cuerpo .gz, fecha)
+        self.pages: dict[tuple[str, str], tuple] = {}
+
+        root = Path(directory)
+        try:
+            manifest = json.loads((root / MANIFEST).read_text())
+        except FileNotFoundError:
+            log.warning("prerender: no %s in %s, serving live", MANIFEST, root)
+            return
+        for lang, pages in manifest.items():
+            for path, page in pages.items():
+                body = (root / page["file"]).read_bytes()
+                gz = (root / (page["file"] + ".gz")).read_bytes()
+                modified = datetime.fromisoformat(page["last_modified"])
+                self.pages[(lang, path)] = (validators(page["etag"], modified), page["type"],
+                                            body, gz, modified)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD") or not self.pages:
+            return await self.app(scope, receive, send)
+
+        request = Request(scope)
+        page = self.pages.get((get_lang(request), scope["path"]))
+        if page is None:
+            return await self.app(scope, receive, send)
+
+        cache_headers, media_type, body, gz, modified = page
+        # Vary: la misma URL cambia con el idioma (cookie) y la compresion.
+        headers = {**cache_headers, "Vary": "Accept-Encoding, Cookie"}
+        if is_fresh(request, cache_headers["ETag"], modified):
+            return await not_modified(headers)(scope, receive, send)
+
+        if "gzip" in request.headers.get("accept-encoding", "") and len(gz) < len(body):
+            body = gz
+            headers["Content-Encoding"] = "gzip"
+        headers["Content-Type"] = media_type
+        headers["Content-Length"] = str(len(body))
+
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+        await send({"type": "http.response.body",
+                    "body": b"" if scope["method"] == "HEAD" else body})
+
+
+def main() -> None:
+    from core.config import settings
+
+    parser = argparse.ArgumentParser(description="Pre-renderiza las paginas publicas.")
+    parser.add_argument("--out", default=settings.prerender_dir or "build",
+                        help="carpeta de salida (por defecto PRERENDER_DIR o build/)")
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    manifest = asyncio.run(build(out))
+    pages = sum(len(p) for p in manifest.values())
+    size = sum(f.stat().st_size for f in out.rglob("index.html"))
+    gz = sum(f.stat().st_size for f in out.rglob("index.html.gz"))
+    print(f"{pages} pages ({', '.join(sorted(manifest))}) in {out}: "
+          f"{size / 1024:.0f} KB html, {gz / 1024:.0f} KB gzip")
+
+
+if __name__ == "__main__":
+    main()
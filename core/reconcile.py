@@ -0,0 +1,109 @@
+"""
+Conciliacion de pagos: reservas sin pagar cuyo pago SI llego a Stripe.
+
+Si el webhook se pierde y el cliente no vuelve a /booking/confirmed, la
+reserva se queda en "pending" (y despues en "expired") aunque el deposito
+este cobrado. Antes eso solo se arreglaba mirando Stripe a mano desde la
+lista "review" de /admin/bookings.
+
+Este comando lo hace de golpe:
+
+    python -m core.reconcile            # ultimos RECONCILE_DAYS dias
+    python -m core.reconcile --days 7
+
+En vez de un retrieve por reserva, recorre las sesiones de Checkout
+completadas con la API de listado (100 por pagina) desde la reserva sin pagar
+mas vieja, busca cada pagina en la base con UNA consulta y pasa a "paid" con
+mark_paid() — la misma que usan el webhook y la confirmacion, asi que correrlo
+a la vez que ellos no avisa dos veces al dueno. Cada pago encontrado se anota
+tambien en el libro de pagos (db/ledger.py), una escritura por pagina. Al final imprime cuantas
+paginas, sesiones y reservas proceso y a que ritmo.
+
+STRIPE_API_BASE sirve igual aqui: apuntado a un doble local de Stripe, el
+comando se puede probar sin tocar la cuenta real.
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.checkout import stripe_client, stripe_email
+from core.notify import notify_new_booking
+from db.booking import mark_paid_async, unpaid_by_stripe_sessions_async, unpaid_since_async
+from db.ledger import ledger
+from db.session import async_engine, init_db
+
+# Hasta donde mira por defecto. Las sesiones de Checkout caducan a las 24
+# horas, asi que un pago real nunca es mas viejo que su reserva + 1 dia; el
+# margen cubre un fin de semana sin correr el comando.
+RECONCILE_DAYS = 3
+
+# El maximo que acepta la API de listado de Stripe.
+PAGE_SIZE = 100
+
+
+async def _paid_pages(since: datetime):
+    """Paginas de sesiones de Checkout pagadas creadas desde `since`.
+
+    Stripe devuelve de la mas nueva a la mas vieja; starting_after es el id
+    de la ultima de la pagina anterior. `since` es UTC sin zona, como
+    created_at; los 5 minutos de margen cubren el desfase entre crear la
+    reserva y crear su sesion.
+    """
+    client, limit = stripe_client()
+    params = {"limit": PAGE_SIZE, "status": "complete",
+              "created": {"gte": int((since - timedelta(minutes=5)).replace(tzinfo=timezone.utc).timestamp())}}
+    while True:
+        async with limit:
+            page = await client.checkout.sessions.list_async(params=params)
+        yield [s for s in page.data if s.payment_status == "paid"], len(page.data)
+        if not page.has_more or not page.data:
+            return
+        params["starting_after"] = page.data[-1].id
+
+
+async def reconcile(days: int = RECONCILE_DAYS) -> dict:
+    """Una pasada completa. Devuelve el informe (ver _report)."""
+    started = time.perf_counter()
+    report = {"pages": 0, "sessions": 0, "matched": 0, "marked_paid": 0}
+
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        # Nada sin pagar en la ventana = ni una llamada a Stripe.
+        since = await unpaid_since_async(session, datetime.utcnow() - timedelta(days=days))
+        if since is not None:
+            async for paid, seen in _paid_pages(since):
+                report["pages"] += 1
+                report["sessions"] += seen
+                by_id = {s.id: s for s in paid}
+                for booking in await unpaid_by_stripe_sessions_async(session, list(by_id)):
+                    report["matched"] += 1
+                    s = by_id[booking.stripe_session_id]
+                    ledger.record_stripe(s, "deposit", notes=booking.public_id)
+                    if await mark_paid_async(session, booking, stripe_email(s)):
+                        report["marked_paid"] += 1
+                        await asyncio.to_thread(notify_new_booking, booking)
+                await session.run_sync(ledger.flush)
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["sessions_per_second"] = (round(report["sessions"] / report["seconds"])
+                                     if report["seconds"] else 0)
+    return report
+
+
+def _report(r: dict) -> str:
+    return (f"{r['pages']} pages, {r['sessions']} sessions in {r['seconds']}s "
+            f"({r['sessions_per_second']}/s): {r['matched']} unpaid bookings matched, "
+            f"{r['marked_paid']} marked paid")
+
+
+if __name__ == "__main__":
+    import db.models  # noqa: F401 — registra las tablas antes de init_db()
+
+    parser = argparse.ArgumentParser(description="Mark bookings paid from Stripe Checkout Sessions.")
+    parser.add_argument("--days", type=int, default=RECONCILE_DAYS)
+    args = parser.parse_args()
+    init_db()
+    print(_report(asyncio.run(reconcile(args.days))))
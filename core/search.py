@@ -0,0 +1,263 @@
+"""
+Busqueda en el blog: indice invertido en memoria con ranking BM25.
+
+El blog no tenia busqueda, y cada post nuevo de SEO local lo hace mas largo
+de recorrer a mano. Los posts son pocos miles como mucho y viven en disco
+(data/blog_posts.json + posts/*.md): cabe todo en memoria y no hace falta
+un motor de busqueda aparte.
+
+  - Indexado: titulo + resumen + el markdown del post, en minusculas, sin
+    acentos (instalacion = instalación), sin palabras vacias en ingles y
+    espanol, y con una raiz simple (stem) para que "panels", "panel" y
+    "paneles" caigan en la misma entrada. El titulo cuenta doble.
+  - Ranking BM25: pesa mas un termino raro que uno que sale en todos los
+    posts, y no premia a un post solo por ser largo.
+  - Consultas rapidas: el puntaje de cada (termino, post) se calcula una
+    vez y se guarda ordenado de mayor a menor, por termino. Una consulta
+    recorre esas listas desde arriba a la vez y para en cuanto ningun post
+    no visto puede ya entrar en el top (algoritmo de umbral de Fagin): con
+    los terminos frecuentes ("orlando", "panel") no se suman miles de
+    puntajes para devolver 10. Las listas se recalculan, termino a termino y
+    solo al consultarlas, despues de cada cambio del indice.
+  - Actualizacion por post: la tarea "search" (main.py) arranca con la app
+    y construye el indice; despues, cada SEARCH_REFRESH_SECONDS, solo mira
+    el stat() de cada archivo y reindexa los que cambiaron. Un post que sale
+    del indice del blog sale tambien de aqui.
+
+Un lock protege el indice: lo actualiza la tarea en su hilo y lo leen las
+peticiones en los suyos. Una consulta lo tiene tomado menos de un
+milisegundo. Otro, aparte, hace que refresh() corra de a uno: las primeras
+consultas que llegan antes de la tarea esperan a UNA construccion en vez de
+hacer cada una la suya.
+"""
+
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+from core.posts import POSTS_DIR, load_posts
+
+SEARCH_REFRESH_SECONDS = 60
+
+# Parametros de BM25: los habituales.
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Enlaces e imagenes de markdown: el texto se queda, la URL no.
+_MD_URL = re.compile(r"\]\([^)]*\)")
+
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have how if in into is it its of on or
+our that the their this to was were what when which who why will with you your
+al con de del el en es la las lo los mas para pero por que se sin su sus un
+una uno y o como esta este esto muy ya le les me mi tu te
+""".split())
+
+# Sufijos que se quitan, los mas largos primero. No es un stemmer completo
+# (Snowball), pero junta singular/plural y las formas verbales comunes de los
+# dos idiomas sin una dependencia mas.
+_SUFFIXES = sorted("""
+aciones acion iciones icion amientos amiento imientos imiento mente
+ando iendo ados idos adas idas ado ido ada ida ores or
+ations ation ings ing edly ed ies ers er es s
+""".split(), key=len, reverse=True)
+
+
+def _fold(text: str) -> str:
+    """Minusculas y sin acentos: "Instalación" -> "instalacion"."""
+    text = text.lower()
+    if text.isascii():
+        return text
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+# El vocabulario de un blog es de miles de palabras, no millones: cada una
+# se reduce una vez.
+@lru_cache(maxsize=100_000)
+def stem(word: str) -> str:
+    """Quita el sufijo mas largo que deje al menos 3 letras."""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Texto -> terminos del indice (los mismos para posts y consultas)."""
+    return [stem(w) for w in _WORD.findall(_fold(_MD_URL.sub("]", text)))
+            if w not in STOPWORDS and len(w) > 1]
+
+
+class SearchIndex:
+    """Indice invertido: termino -> {slug: veces que aparece}."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()     # refresh() de a uno
+        self._postings: dict[str, dict[str, int]] = {}
+        self._terms: dict[str, tuple] = {}       # slug -> sus terminos
+        self._lens: dict[str, int] = {}          # slug -> cuantos terminos tiene
+        self._total_len = 0
+        self._posts: dict[str, dict] = {}        # slug -> entrada del indice del blog
+        self._seen: dict[str, tuple] = {}        # slug -> lo que se indexo (para ver si cambio)
+        # termino -> ({slug: puntaje}, [(puntaje, slug)] de mayor a menor).
+        # Depende de todo el indice (N, largo medio): se vacia en cada cambio.
+        self._ranked: dict[str, tuple[dict[str, float], list[tuple[float, str]]]] = {}
+        self.built = False
+
+    def _remove(self, slug: str) -> None:
+        terms = self._terms.pop(slug, None)
+        if terms is None:
+            return
+        for term in terms:
+            docs = self._postings[term]
+            del docs[slug]
+            if not docs:
+                del self._postings[term]
+        self._total_len -= self._lens.pop(slug)
+        self._posts.pop(slug, None)
+        self._seen.pop(slug, None)
+        self._ranked.clear()
+
+    def update(self, post: dict, body: str, seen: tuple = ()) -> None:
+        """Indexa (o reindexa) un post. `seen` es la huella con la que
+        refresh() decide si hay que volver a hacerlo."""
+        title = post.get("title", "")
+        terms = Counter(tokenize(f"{title} {title} {post.get('excerpt', '')} {body}"))
+        slug = post["slug"]
+        with self._lock:
+            self._remove(slug)
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[slug] = tf
+            self._terms[slug] = tuple(terms)
+            self._lens[slug] = terms.total()
+            self._total_len += self._lens[slug]
+            self._posts[slug] = post
+            self._seen[slug] = seen
+            self._ranked.clear()
+
+    def remove(self, slug: str) -> None:
+        with self._lock:
+            self._remove(slug)
+
+    def refresh(self) -> int:
+        """Pone el indice al dia con el blog. Devuelve cuantos posts reindexo.
+
+        La huella de cada post es el stat() de su archivo mas su entrada en
+        data/blog_posts.json: un cambio de titulo tambien reindexa.
+        """
+        with self._build_lock:
+            return self._refresh()
+
+    def _refresh(self) -> int:
+        changed = 0
+        posts = {p["slug"]: p for p in load_posts() if p.get("slug")}
+        # Copia tomada con el lock: update() y remove() cambian _seen.
+        with self._lock:
+            indexed = dict(self._seen)
+        for slug in [s for s in indexed if s not in posts]:
+            self.remove(slug)
+            changed += 1
+        for slug, post in posts.items():
+            path = POSTS_DIR / post.get("file", "")
+            try:
+                st = path.stat()
+            except (FileNotFoundError, IsADirectoryError):
+                st = None
+            seen = ((st.st_mtime_ns, st.st_size) if st else None, tuple(post.items()))
+            if indexed.get(slug) == seen:
+                continue
+            body = path.read_text(encoding="utf-8") if st else ""
+            self.update(post, body, seen)
+            changed += 1
+        self.built = True
+        return changed
+
+    def _ranking(self, term: str) -> tuple[dict[str, float], list[tuple[float, str]]] | None:
+        """Puntajes BM25 del termino en cada post, en dict y ordenados. Con el lock."""
+        hit = self._ranked.get(term)
+        if hit is None:
+            docs = self._postings.get(term)
+            if not docs:
+                return None
+            n = len(self._terms)
+            avg_len = self._total_len / n
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores = {}
+            for slug, tf in docs.items():
+                norm = K1 * (1 - B + B * self._lens[slug] / avg_len)
+                scores[slug] = idf * tf * (K1 + 1) / (tf + norm)
+            hit = (scores, sorted(((v, k) for k, v in scores.items()), reverse=True))
+            self._ranked[term] = hit
+        return hit
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[dict, float]]:
+        """Los `limit` posts que mejor responden a `query`: (post, puntaje).
+
+        El puntaje de un post es la suma de los de sus terminos. Se baja por
+        las listas ordenadas en paralelo; a cada nivel, ningun post aun no
+        visto puede sumar mas que la suma de los puntajes de ese nivel
+        (`threshold`), asi que si el peor del top ya la supera, el top es
+        exacto y se para.
+        """
+        if not self.built:
+            # Si la construccion ya esta en marcha (la tarea, otra consulta),
+            # se espera a que termine en vez de empezar otra.
+            with self._build_lock:
+                if not self.built:
+                    self._refresh()
+        with self._lock:
+            rankings = [r for term in set(tokenize(query)) if (r := self._ranking(term))]
+            if not rankings:
+                return []
+
+            if len(rankings) == 1:
+                top = rankings[0][1][:limit]
+            else:
+                top = self._top(rankings, limit)
+            return [(self._posts[slug], score) for score, slug in sorted(top, reverse=True)]
+
+    @staticmethod
+    def _top(rankings: list, limit: int) -> list[tuple[float, str]]:
+        """El algoritmo de umbral sobre varias listas (ver search)."""
+        gets = [scores.get for scores, _ in rankings]
+        lists = [ranked for _, ranked in rankings]
+        top: list[tuple[float, str]] = []              # heap de los mejores
+        floor = 0.0                                    # el peor del top lleno
+        seen: set[str] = set()
+        for depth in range(max(map(len, lists))):
+            threshold = 0.0
+            for ranked in lists:
+                if depth >= len(ranked):
+                    continue
+                score, slug = ranked[depth]
+                threshold += score
+                if slug in seen:
+                    continue
+                seen.add(slug)
+                total = 0.0
+                for get in gets:
+                    total += get(slug, 0.0)
+                if len(top) < limit:
+                    heapq.heappush(top, (total, slug))
+                    floor = top[0][0]
+                elif total > floor:
+                    heapq.heapreplace(top, (total, slug))
+                    floor = top[0][0]
+            if len(top) == limit and floor >= threshold:
+                break
+        return top
+
+
+search_index = SearchIndex()
+
+
+def refresh_search() -> int:
+    """Tarea de fondo (main.py): construye el indice y lo mantiene al dia."""
+    return search_index.refresh()
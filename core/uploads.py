@@ -0,0 +1,185 @@
+"""
+Subida de archivos: limite de tamano y guardado atomico en disco.
+
+Lo usa el formulario de estimados (routes/estimates.py), el unico que recibe
+fotos. Dos piezas:
+
+  - BodySizeLimit: middleware que corta una peticion demasiado grande ANTES
+    de que se lea entera. Starlette parsea el formulario completo — y copia
+    cada foto a un archivo temporal — antes de llamar a la ruta; sin esto un
+    POST de 2 GB se leia enterito solo para rechazarlo despues.
+
+  - save_upload: copia una foto ya recibida a su sitio final. La copia corre
+    en un hilo (escribir en disco bloquea), se corta en cuanto pasa del
+    limite y va primero a un archivo ".part" que se renombra al terminar:
+    nunca queda a la vista un archivo a medias.
+
+El sitio final depende del CONTENIDO: el archivo se llama como su sha256,
+calculado mientras se copia (root/ab/abcd...ef.jpg). Los clientes reenvian el
+formulario con las mismas fotos cuando dudan de si llego; antes cada reenvio
+era otra copia en disco y en los backups. Ahora la misma foto es el mismo
+archivo, y el nombre sirve de suma de control (sha256sum lo comprueba).
+Cuantas filas usan un archivo lo dice EstimatePhoto.sha256; los que ya no usa
+nadie los borra core/images.collect_orphan_photos.
+"""
+
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import BinaryIO, Callable
+
+from fastapi import Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+# Trozo de lectura/escritura. 1 MB: pocas vueltas por foto sin cargarla
+# entera en memoria.
+CHUNK = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """El archivo (o la peticion) pasa del limite."""
+
+
+class BodySizeLimit:
+    """Rechaza con `reject(request)` los POST a `path` de mas de `max_bytes`.
+
+    Primero mira Content-Length: si ya dice que no cabe, se contesta sin leer
+    ni un byte del cuerpo. Si no viene (subida "chunked") o miente, se van
+    contando los bytes segun llegan y se corta en cuanto pasan del limite.
+
+    Es middleware ASGI "puro" y no @app.middleware("http") porque tiene que
+    ver el cuerpo trozo a trozo, antes que FastAPI.
+    """
+
+    def __init__(self, app, path: str, max_bytes: int,
+                 reject: Callable[[Request], Response]) -> None:
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+        self.reject = reject
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] != "POST"
+                or scope["path"].rstrip("/") != self.path):
+            return await self.app(scope, receive, send)
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_bytes:
+            return await self.reject(Request(scope))(scope, receive, send)
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # FastAPI convierte la excepcion en un 400 generico; esa
+            # respuesta se descarta y sale la de `reject`.
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if exceeded:
+            await self.reject(Request(scope))(scope, receive, send)
+
+
+def content_path(root: Path, digest: str, ext: str) -> Path:
+    """root/ab/abcd...ef.jpg: dos letras de carpeta para no juntar miles de
+    archivos en un solo directorio."""
+    return root / digest[:2] / f"{digest}{ext}"
+
+
+def _copy(src: BinaryIO, root: Path, ext: str, max_bytes: int) -> tuple[Path, str, int | None]:
+    """Copia src a su ruta por contenido dentro de root.
+
+    Devuelve (ruta, sha256, creado): creado es el mtime (ns) que dejo esta
+    copia si el archivo es nuevo, o None si ya estaba (ver save_upload).
+
+    Se escribe a un .part con nombre al azar (aun no se sabe el hash) y se
+    calcula el sha256 trozo a trozo, sin volver a leer. El tamano se comprueba
+    ANTES de escribir cada trozo: el archivo nunca pasa del limite. Si algo
+    falla, el .part se borra.
+
+    Si ya existe un archivo con ese hash y ese tamano, es la misma foto: se
+    descarta la copia nueva. Con otro tamano el existente esta danado y la
+    copia nueva lo reemplaza.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    tmp = root / f".{uuid.uuid4().hex}.part"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp, "wb") as out:
+            while chunk := src.read(CHUNK):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+
+        dest = content_path(root, digest.hexdigest(), ext)
+        if dest.exists() and dest.stat().st_size == size:
+            tmp.unlink()
+            created = None
+            # Fecha al dia: collect_orphan_photos respeta los archivos
+            # tocados hace poco, y esta subida aun no tiene su fila.
+            os.utime(dest)
+        else:
+            dest.parent.mkdir(exist_ok=True)
+            # En el mismo sistema de archivos el rename es atomico: el
+            # archivo aparece completo o no aparece. Dos subidas iguales a la
+            # vez renombran el mismo contenido; gane quien gane, da igual.
+            os.replace(tmp, dest)
+            created = dest.stat().st_mtime_ns
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return dest, digest.hexdigest(), created
+
+
+async def save_upload(f: UploadFile, root: Path, ext: str,
+                      max_bytes: int) -> tuple[Path, str, int | None]:
+    """Guarda una foto recibida bajo `root`, nombrada por su contenido.
+
+    Devuelve (ruta en disco, sha256, creado). Lanza UploadTooLarge si no cabe.
+    `creado` es el mtime del archivo si lo escribio esta llamada, None si ya
+    existia: quien lo guardo sabe asi que archivos puede deshacer si la
+    peticion falla (ver discard_new).
+
+    Starlette ya sabe el tamano (f.size) al terminar de parsear: si se pasa,
+    se rechaza sin copiar nada. Si no lo sabe, la copia lo va contando.
+    """
+    if f.size is not None and f.size > max_bytes:
+        raise UploadTooLarge()
+    await f.seek(0)
+    return await run_in_threadpool(_copy, f.file, root, ext, max_bytes)
+
+
+def discard_new(written: list[tuple[Path, str, int | None]], used: set[str]) -> None:
+    """Borra los archivos que escribio una subida que al final fallo.
+
+    Solo los que creo ella (creado no es None), que ninguna fila usa (`used`:
+    sha256 con fila) y que nadie toco despues: si el mtime cambio, otra
+    subida de la misma foto lo reutilizo y aun no confirmo su fila. El resto
+    se queda; si sobra, se lo lleva core/images.collect_orphan_photos.
+    """
+    for path, digest, created in written:
+        if created is None or digest in used:
+            continue
+        try:
+            if path.stat().st_mtime_ns == created:
+                path.unlink()
+        except FileNotFoundError:
+            pass
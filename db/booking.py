@@ -2,17 +2,30 @@
 
 Es el unico puente entre la base de datos y core/booking.py: traduce filas
 en el diccionario `taken` que consume la logica de calendario.
+
+Las funciones `*_async` son las mismas consultas para rutas `async def`. No
+estan reescritas: corren la version normal con AsyncSession.run_sync, que
+ejecuta el codigo sincrono sobre la conexion asincrona sin bloquear el event
+loop. Asi cada regla (el UPDATE condicional de mark_paid, el filtro de
+taken_map) sigue escrita una sola vez.
 """
 
-from datetime import datetime, timedelta
+import logging
+from datetime import date, datetime, timedelta
 
+from sqlalchemy import func, or_
 from sqlmodel import Session, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.booking import CREWS, EXPIRE_GRACE_MINUTES, HOLD_MINUTES, HORIZON_DAYS, TZ
+from db.models import Booking, SlotLock
+from db.occupancy import occupancy
+from db.session import insert_ignore
 
-from core.booking import HOLD_MINUTES
-from db.models import Booking
+log = logging.getLogger(__name__)
 
 
-def taken_map(session: Session) -> dict:
+def taken_map(session: Session, today: date | None = None) -> dict:
     """Cupos ocupados, en el formato que espera core/booking.py.
 
         {"2026-08-21": {1: 1, 3: 1}, ...}
@@ -25,34 +38,178 @@ def taken_map(session: Session) -> dict:
 
     Una pendiente vieja NO cuenta: si abandono el pago hace una hora, el
     cupo vuelve a estar libre. Por eso no hace falta ningun proceso que
-    limpie reservas abandonadas — se liberan solas al dejar de contarse.
+    libere cupos de reservas abandonadas — se liberan solas al dejar de
+    contarse. (db/sweep.py si las pasa despues a "expired", pero es orden,
+    no disponibilidad: ver expire_abandoned.)
+
+    El registro queda en la base como rastro del abandono, que despues sirve
+    para saber cuantos llegan al checkout y no pagan.
+
+    Las rutas ya no la llaman en cada visita: leen el indice en memoria de
+    db/occupancy.py. Esta consulta queda como la fuente de verdad contra la
+    que se compara ese indice (ver occupancy_drift).
+
+    COMO CONSULTA
+        Todo el trabajo lo hace la base: filtra, descarta las pendientes
+        vencidas y cuenta con GROUP BY. A Python solo llega una fila por
+        (dia, franja) ocupada, no una por reserva.
 
-    El registro pending queda en la base como rastro del abandono, que
-    despues sirve para saber cuantos llegan al checkout y no pagan.
+        Y solo mira de hoy al horizonte del calendario. Las reservas de hace
+        un ano no le quitan cupo a nadie; sin ese limite la consulta creceria
+        con cada reserva que se haya hecho nunca. Con el indice compuesto
+        (status, service_date, slot) de db/models.py, el coste depende de los
+        30 dias de la ventana, no del tamano de la tabla.
+
+    Args:
+        today: primer dia a contar. Vacio = hoy en la zona del negocio. Igual
+               que el `ref` de open_days, existe para las pruebas.
     """
+    today = today or datetime.now(TZ).date()
     cutoff = datetime.utcnow() - timedelta(minutes=HOLD_MINUTES)
 
     rows = session.exec(
-        select(Booking.service_date, Booking.slot, Booking.status, Booking.created_at)
+        select(Booking.service_date, Booking.slot, func.count())
+        # status IN (...) primero: es lo que deja usar el indice compuesto
+        # como un rango por cada estado, en vez de recorrer la tabla.
         .where(Booking.status.in_(("paid", "pending")))
+        .where(Booking.service_date.between(today, today + timedelta(days=HORIZON_DAYS)))
+        .where(or_(Booking.status == "paid", Booking.created_at >= cutoff))
+        .group_by(Booking.service_date, Booking.slot)
     ).all()
 
     out: dict = {}
-    for service_date, slot, status, created_at in rows:
-        if status == "pending" and created_at < cutoff:
-            continue
-        key = service_date.isoformat()
-        out.setdefault(key, {})
-        out[key][slot] = out[key].get(slot, 0) + 1
+    for service_date, slot, count in rows:
+        out.setdefault(service_date.isoformat(), {})[slot] = count
     return out
 
 
+def _lock_slot(session: Session, day: date, slot: int) -> None:
+    """Toma el cerrojo de la franja (la fila de SlotLock) hasta el commit."""
+    # La fila del cerrojo tiene que existir para poder bloquearla. Si dos
+    # peticiones la crean a la vez, una simplemente no hace nada.
+    insert_ignore(session, SlotLock, service_date=day, slot=slot, claims=0)
+    session.exec(
+        update(SlotLock)
+        .where(SlotLock.service_date == day, SlotLock.slot == slot)
+        .values(claims=SlotLock.claims + 1)
+    )
+
+
+def _used(session: Session, day: date, slot: int) -> int:
+    """Cupos ocupados de una franja: pagadas y pendientes recientes."""
+    cutoff = datetime.utcnow() - timedelta(minutes=HOLD_MINUTES)
+    return session.exec(
+        select(func.count())
+        .select_from(Booking)
+        .where(Booking.status.in_(("paid", "pending")))
+        .where(Booking.service_date == day, Booking.slot == slot)
+        .where(or_(Booking.status == "paid", Booking.created_at >= cutoff))
+    ).one()
+
+
+def reserve(session: Session, booking: Booking) -> bool:
+    """Guarda la reserva "pending" SOLO si su franja todavia tiene cupo.
+
+    POR QUE NO BASTA CON validate_selection()
+        validate_selection revisa el cupo con lo que se leyo un momento antes.
+        Entre esa lectura y el INSERT, otra peticion — otro hilo, otro worker
+        de uvicorn — puede haber leido lo mismo. Las dos ven "queda 1 cupo" y
+        las dos reservan: se vende el mismo equipo dos veces.
+
+    COMO LO EVITA
+        Contar y guardar pasan dentro de una sola transaccion que empieza
+        tomando el cerrojo de la franja (la fila de SlotLock). Quien llega
+        segundo espera en ese UPDATE hasta que el primero confirme, y cuando
+        cuenta ya ve la reserva del primero.
+
+          - Postgres: el UPDATE bloquea solo esa fila. Otras franjas siguen
+            reservandose en paralelo.
+          - SQLite: cualquier escritura bloquea la base entera hasta el
+            commit. Mas grueso, pero igual de correcto.
+
+        El mismo codigo vale para las dos bases, sin ramas.
+
+    El resto de reglas (dia habil, anticipacion...) no se repiten aqui: las
+    revisa validate_selection antes, y no dependen de otras peticiones.
+
+    Returns:
+        True si la reserva quedo guardada. False si la franja ya estaba
+        llena; en ese caso no se escribio nada.
+    """
+    _lock_slot(session, booking.service_date, booking.slot)
+
+    # Desde aqui nadie mas puede reservar esta franja hasta el commit.
+    if _used(session, booking.service_date, booking.slot) >= CREWS:
+        session.rollback()
+        return False
+
+    session.add(booking)
+    session.commit()
+    session.refresh(booking)
+    occupancy.add_hold(booking)
+    return True
+
+
 def get_by_public_id(session: Session, public_id: str) -> Booking | None:
     return session.exec(
         select(Booking).where(Booking.public_id == public_id)
     ).first()
 
 
+def get_by_checkout_key(session: Session, key: str) -> Booking | None:
+    return session.exec(
+        select(Booking).where(Booking.checkout_key == key)
+    ).first()
+
+
+def unpaid_since(session: Session, since: datetime) -> datetime | None:
+    """created_at de la reserva sin pagar mas vieja desde `since` que ya fue
+    a Stripe. None si no hay ninguna: entonces no hay nada que conciliar.
+    """
+    return session.exec(
+        select(func.min(Booking.created_at))
+        .where(Booking.status.in_(("pending", "expired")))
+        .where(Booking.stripe_session_id.is_not(None))
+        .where(Booking.created_at >= since)
+    ).one()
+
+
+def unpaid_by_stripe_sessions(session: Session, session_ids: list[str]) -> list[Booking]:
+    """Las reservas aun sin pagar de esas sesiones de Stripe, en UNA consulta.
+
+    Una pagina de la API de Stripe trae hasta 100 sesiones; buscarlas una a
+    una serian 100 consultas. Con IN va todo junto y lo resuelve el indice de
+    stripe_session_id.
+    """
+    if not session_ids:
+        return []
+    return list(session.exec(
+        select(Booking)
+        .where(Booking.stripe_session_id.in_(session_ids))
+        .where(Booking.status.in_(("pending", "expired")))
+    ).all())
+
+
+def paid_on(session: Session, day: date) -> list[Booking]:
+    """Reservas pagadas de un dia, en orden de franja."""
+    return list(session.exec(
+        select(Booking)
+        .where(Booking.status == "paid", Booking.service_date == day)
+        .order_by(Booking.slot)
+    ).all())
+
+
+def get_status(session: Session, public_id: str) -> str | None:
+    """Solo el estado de la reserva. None si no existe.
+
+    Lee una columna, no la fila entera: lo llama el sondeo de la pagina de
+    confirmacion, que pregunta cada pocos segundos.
+    """
+    return session.exec(
+        select(Booking.status).where(Booking.public_id == public_id)
+    ).first()
+
+
 def get_by_stripe_session(session: Session, session_id: str) -> Booking | None:
     return session.exec(
         select(Booking).where(Booking.stripe_session_id == session_id)
@@ -66,25 +223,48 @@ def mark_paid(session: Session, booking: Booking, customer_email: str = "") -> b
     dos caminos que confirman el pago — el webhook de Stripe y la pagina de
     confirmacion — y pueden llegar a la vez.
 
-    Por eso el UPDATE lleva la condicion status="pending" dentro: es la base
-    de datos la que decide quien gana, no el codigo. Si primero leyeramos el
+    Por eso el UPDATE lleva la condicion de estado dentro: es la base de
+    datos la que decide quien gana, no el codigo. Si primero leyeramos el
     estado y luego escribieramos, los dos caminos podrian leer "pending" a la
     vez y los dos creerian haber ganado.
 
-    Solo se pasa de "pending": una reserva cancelada no revive aunque llegue
-    un webhook tardio.
+    Solo se pasa de "pending" o "expired": una reserva cancelada no revive
+    aunque llegue un webhook tardio. Una expirada si — la sesion de Stripe
+    sigue abierta mucho mas que el apartado, y si el cliente pago tarde, el
+    dinero ya esta cobrado.
+
+    Pero un apartado vencido (expirada, o pendiente de mas de HOLD_MINUTES)
+    ya no guardaba el cupo: otro cliente pudo llevarselo mientras tanto. En
+    ese caso se vuelve a contar bajo el cerrojo de la franja, como en
+    reserve(). Si no cabe, la reserva queda en "overbooked" en vez de
+    "paid": cobrada pero sin cupo, para que el negocio le ofrezca otra hora
+    o le devuelva el deposito (sale aparte en /admin/bookings y en el aviso).
+    Tambien devuelve True: es la primera vez que se resuelve el pago.
 
     customer_email llega de Stripe, que lo pide siempre en su checkout. Se
     guarda en el mismo UPDATE para no hacer dos escrituras: el que gana la
     carrera es el unico que lo escribe, y el que pierde no lo pisa.
     """
+    values = dict(paid_at=datetime.utcnow(), customer_email=customer_email)
+    cutoff = datetime.utcnow() - timedelta(minutes=HOLD_MINUTES)
+
+    # Apartado vivo: su cupo ya esta contado, no hace falta el cerrojo.
     result = session.exec(
         update(Booking)
         .where(Booking.id == booking.id)
-        .where(Booking.status == "pending")
-        .values(status="paid", paid_at=datetime.utcnow(),
-                customer_email=customer_email)
+        .where(Booking.status == "pending", Booking.created_at >= cutoff)
+        .values(status="paid", **values)
     )
+    if result.rowcount != 1:
+        _lock_slot(session, booking.service_date, booking.slot)
+        # El conteo no incluye a esta reserva: su apartado ya no cuenta.
+        full = _used(session, booking.service_date, booking.slot) >= CREWS
+        result = session.exec(
+            update(Booking)
+            .where(Booking.id == booking.id)
+            .where(Booking.status.in_(("pending", "expired")))
+            .values(status="overbooked" if full else "paid", **values)
+        )
     session.commit()
 
     if result.rowcount != 1:
@@ -93,4 +273,88 @@ def mark_paid(session: Session, booking: Booking, customer_email: str = "") -> b
     # El objeto en memoria seguia diciendo "pending": hay que releerlo para
     # que quien llama vea el estado nuevo (la plantilla lo usa).
     session.refresh(booking)
+    if booking.status == "paid":
+        occupancy.mark_paid(booking)
+    else:
+        log.warning("booking %s paid after its hold lapsed and the slot filled up",
+                    booking.public_id)
+        occupancy.release(booking, was_paid=False)
     return True
+
+
+def expire_abandoned(session: Session, batch_size: int = 500) -> int:
+    """Pasa a "expired" las pendientes abandonadas. Devuelve cuantas.
+
+    Abandonada = sigue en "pending" HOLD_MINUTES + EXPIRE_GRACE_MINUTES
+    despues de crearse. Su cupo ya estaba libre; esto solo las saca del
+    conjunto "pending", que es el que recorren taken_map(), el indice de
+    cupos y la lista "review" del admin. Sin esto ese conjunto crece con
+    cada checkout abandonado, para siempre.
+
+    Las filas NO se borran ni se mueven de tabla: siguen siendo el rastro
+    del abandono. Cuantos llegan al checkout y no pagan se sigue contando
+    igual, ahora como status = "expired".
+
+    Va por lotes de `batch_size`, con un commit por lote, para no tener la
+    tabla bloqueada en una sola transaccion enorme la primera vez que corre
+    sobre anos de abandonos. El UPDATE repite status = "pending": si entre
+    el SELECT y el UPDATE una se pago, se queda pagada.
+    """
+    cutoff = datetime.utcnow() - timedelta(minutes=HOLD_MINUTES + EXPIRE_GRACE_MINUTES)
+    total = 0
+    while True:
+        ids = session.exec(
+            select(Booking.id)
+            .where(Booking.status == "pending", Booking.created_at < cutoff)
+            .limit(batch_size)
+        ).all()
+        if not ids:
+            break
+        result = session.exec(
+            update(Booking)
+            .where(Booking.id.in_(ids), Booking.status == "pending")
+            .values(status="expired")
+        )
+        session.commit()
+        total += result.rowcount
+        if len(ids) < batch_size:
+            break
+    return total
+
+
+def occupancy_drift(session: Session) -> dict:
+    """Compara el indice en memoria con la base. Vacio = todo cuadra.
+
+    Sirve para vigilar el indice: si algun dia devuelve algo, hay un camino
+    que cambia reservas sin avisarle. occupancy.reload() lo corrige.
+    """
+    return occupancy.drift(taken_map(session))
+
+
+async def taken_map_async(session: AsyncSession, today: date | None = None) -> dict:
+    return await session.run_sync(taken_map, today)
+
+
+async def get_by_stripe_session_async(session: AsyncSession, session_id: str) -> Booking | None:
+    return await session.run_sync(get_by_stripe_session, session_id)
+
+
+async def get_by_checkout_key_async(session: AsyncSession, key: str) -> Booking | None:
+    return await session.run_sync(get_by_checkout_key, key)
+
+
+async def unpaid_since_async(session: AsyncSession, since: datetime) -> datetime | None:
+    return await session.run_sync(unpaid_since, since)
+
+
+async def unpaid_by_stripe_sessions_async(session: AsyncSession,
+                                          session_ids: list[str]) -> list[Booking]:
+    return await session.run_sync(unpaid_by_stripe_sessions, session_ids)
+
+
+async def mark_paid_async(session: AsyncSession, booking: Booking, customer_email: str = "") -> bool:
+    return await session.run_sync(mark_paid, booking, customer_email)
+
+
+async def reserve_async(session: AsyncSession, booking: Booking) -> bool:
+    return await session.run_sync(reserve, booking)
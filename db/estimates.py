@@ -0,0 +1,77 @@
+"""Consultas de la bandeja de estimados (/admin/estimates).
+
+Los estimados solo se leian en el correo al dueno; la bandeja los lista del
+mas nuevo al mas viejo, de PAGE_SIZE en PAGE_SIZE, y tiene que seguir siendo
+rapida con decenas de miles de solicitudes. Por eso:
+
+  - Paginacion por cursor (keyset), no OFFSET. La pagina siguiente empieza
+    "despues del ultimo (created_at, id) visto": la base salta directo ahi
+    por el indice. Con OFFSET 20000 tendria que recorrer y tirar 20000 filas
+    en cada clic, y una solicitud nueva corre todo una fila (se repiten o se
+    pierden estimados entre paginas).
+  - Indices compuestos que terminan en (created_at, id): uno para la lista
+    sin filtro y uno por filtro (status, urgency). Cada pagina es una lectura
+    del indice ya en orden, sin ordenar nada.
+  - Las fotos de toda la pagina en UNA consulta (IN), no una por estimado.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import tuple_
+from sqlmodel import Session, select
+
+from db.models import EstimatePhoto, EstimateRequest
+
+PAGE_SIZE = 25
+
+STATUSES = ("new", "reviewed", "quoted", "closed")
+URGENCIES = ("low", "normal", "high", "emergency")
+
+
+def encode_cursor(est: EstimateRequest) -> str:
+    """El cursor de la pagina siguiente: "<created_at ISO>_<id>"."""
+    return f"{est.created_at.isoformat()}_{est.id}"
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int] | None:
+    """Lo contrario de encode_cursor. None si no se entiende."""
+    created, _, est_id = cursor.rpartition("_")
+    try:
+        return datetime.fromisoformat(created), int(est_id)
+    except ValueError:
+        return None
+
+
+def inbox_page(session: Session, status: str | None = None, urgency: str | None = None,
+               after: tuple[datetime, int] | None = None, limit: int = PAGE_SIZE
+               ) -> tuple[list[EstimateRequest], dict[int, list[EstimatePhoto]], str | None]:
+    """Una pagina de la bandeja, del mas nuevo al mas viejo.
+
+    Devuelve (estimados, fotos por estimate_id, cursor de la siguiente o None
+    si es la ultima). Se pide una fila de mas para saber si hay siguiente sin
+    contar nada.
+    """
+    query = select(EstimateRequest)
+    if status:
+        query = query.where(EstimateRequest.status == status)
+    if urgency:
+        query = query.where(EstimateRequest.urgency == urgency)
+    if after:
+        query = query.where(tuple_(EstimateRequest.created_at, EstimateRequest.id) < tuple_(*after))
+    rows = session.exec(
+        query.order_by(EstimateRequest.created_at.desc(), EstimateRequest.id.desc()).limit(limit + 1)
+    ).all()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    photos: dict[int, list[EstimatePhoto]] = {}
+    if rows:
+        for photo in session.exec(
+            select(EstimatePhoto)
+            .where(EstimatePhoto.estimate_id.in_([e.id for e in rows]))
+            .order_by(EstimatePhoto.estimate_id, EstimatePhoto.id)
+        ).all():
+            photos.setdefault(photo.estimate_id, []).append(photo)
+
+    return rows, photos, encode_cursor(rows[-1]) if more else None
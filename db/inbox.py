@@ -0,0 +1,116 @@
+"""Bandeja de entrada de webhooks: guardar, reclamar y cerrar eventos.
+
+Solo la parte de base de datos. Que se hace con cada evento lo decide
+core/webhooks.py.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlmodel import Session, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from db.models import WebhookEvent
+from db.session import insert_ignore
+
+# Intentos antes de dar un evento por perdido ("failed"). Con la espera de
+# abajo, el ultimo cae unas 8 horas despues del primero.
+MAX_ATTEMPTS = 10
+
+# Cuanto tiempo queda reservado un evento mientras un worker lo procesa. Si
+# el proceso muere a medias, pasado este plazo otro lo vuelve a tomar.
+LEASE = timedelta(minutes=5)
+
+
+def enqueue(session: Session, source: str, event_id: str, type_: str, payload: str) -> bool:
+    """Guarda un evento verificado. False si ya estaba (reenvio de Stripe)."""
+    now = datetime.utcnow()
+    added = insert_ignore(session, WebhookEvent, event_id=event_id, source=source, type=type_,
+                          payload=payload, status="pending", attempts=0,
+                          next_attempt_at=now, created_at=now)
+    session.commit()
+    return added
+
+
+async def enqueue_async(session: AsyncSession, source: str, event_id: str,
+                        type_: str, payload: str) -> bool:
+    return await session.run_sync(enqueue, source, event_id, type_, payload)
+
+
+def claim_due(session: Session, limit: int = 50) -> list[WebhookEvent]:
+    """Toma hasta `limit` eventos que ya toca procesar, en orden de llegada.
+
+    Cada uno se reclama con un UPDATE condicional que corre su
+    next_attempt_at LEASE hacia adelante. Si dos workers leen el mismo
+    evento, solo a uno le afecta el UPDATE; el otro lo salta. Asi un evento
+    no se procesa dos veces a la vez.
+    """
+    now = datetime.utcnow()
+    due = session.exec(
+        select(WebhookEvent)
+        .where(WebhookEvent.status == "pending", WebhookEvent.next_attempt_at <= now)
+        .order_by(WebhookEvent.id)
+        .limit(limit)
+    ).all()
+
+    claimed = []
+    for ev in due:
+        result = session.exec(
+            update(WebhookEvent)
+            .where(WebhookEvent.id == ev.id,
+                   WebhookEvent.next_attempt_at == ev.next_attempt_at)
+            .values(next_attempt_at=now + LEASE, attempts=WebhookEvent.attempts + 1)
+        )
+        if result.rowcount == 1:
+            claimed.append(ev.id)
+    session.commit()
+    if not claimed:
+        return []
+    return session.exec(
+        select(WebhookEvent).where(WebhookEvent.id.in_(claimed)).order_by(WebhookEvent.id)
+    ).all()
+
+
+def mark_done(session: Session, events: list[WebhookEvent]) -> None:
+    """Cierra los eventos de una tanda, con un solo commit."""
+    now = datetime.utcnow()
+    for ev in events:
+        ev.status = "done"
+        ev.processed_at = now
+        ev.last_error = None
+        session.add(ev)
+    session.commit()
+
+
+def mark_failed(session: Session, ev: WebhookEvent, error: str) -> None:
+    """Registra el fallo y programa el reintento con espera exponencial.
+
+    30 s, 1 min, 2 min, 4 min... hasta una hora como maximo entre intentos.
+    Pasados MAX_ATTEMPTS queda en "failed" y ya no se reintenta: aparece en
+    /admin/queues para mirarlo a mano.
+    """
+    ev.last_error = error[:1000]
+    if ev.attempts >= MAX_ATTEMPTS:
+        ev.status = "failed"
+    else:
+        delay = min(30 * 2 ** (ev.attempts - 1), 3600)
+        ev.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    session.add(ev)
+    session.commit()
+
+
+def depth(session: Session) -> dict:
+    """Estado de la cola: cuantos hay por estado y cuanto lleva esperando el mas viejo."""
+    counts = dict(session.exec(
+        select(WebhookEvent.status, func.count())
+        .where(WebhookEvent.status.in_(("pending", "failed")))
+        .group_by(WebhookEvent.status)
+    ).all())
+    oldest = session.exec(
+        select(func.min(WebhookEvent.created_at)).where(WebhookEvent.status == "pending")
+    ).one()
+    return {
+        "pending": counts.get("pending", 0),
+        "failed": counts.get("failed", 0),
+        "oldest_pending_seconds": int((datetime.utcnow() - oldest).total_seconds()) if oldest else 0,
+    }
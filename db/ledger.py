@@ -0,0 +1,139 @@
+"""Libro de pagos: cada pago confirmado de Stripe, una fila en PaymentRecord.
+
+Entran dos clases de pago:
+
+  - deposit  deposito de una reserva (checkout de /booking)
+  - invoice  cobro suelto de /payments
+
+POR QUE EN LOTES
+    Un pago se anota en memoria (record_stripe) y se escribe despues, junto
+    con los demas que se hayan juntado, en UN insert y UN commit (flush). En
+    una rafaga de webhooks eso es un commit por tanda, no uno por evento.
+
+    Lo vacian:
+      - core/webhooks.py, al terminar cada tanda de la bandeja de entrada,
+        ANTES de cerrar los eventos. Si el proceso muere antes, los eventos
+        se vuelven a procesar y el pago se anota de nuevo.
+      - la tarea "ledger" de main.py, cada LEDGER_FLUSH_SECONDS, para lo que
+        anotan la pagina de confirmacion y core/reconcile.py.
+
+    Lo que quede en memoria si el proceso muere no se pierde del todo: Stripe
+    manda el webhook de todo pago, y ese camino es durable.
+
+SIN DUPLICADOS
+    El mismo pago llega por varios caminos y Stripe reenvia webhooks. La
+    fila se identifica por provider_payment_id (unico en la base) y se
+    inserta con ON CONFLICT DO NOTHING: el segundo aviso no hace nada.
+"""
+
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+
+from sqlmodel import Session, select
+
+from core.booking import TZ
+from db.models import PaymentRecord
+from db.session import engine, insert_ignore_many
+
+# Cada cuanto la tarea de fondo escribe lo pendiente (ver main.py).
+LEDGER_FLUSH_SECONDS = 10
+
+
+class PaymentLedger:
+    """Pagos confirmados pendientes de escribir, por provider_payment_id.
+
+    Un diccionario y no una lista: si el mismo pago se anota dos veces antes
+    del flush (webhook y confirmacion a la vez), queda una sola entrada.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._pending: dict[str, dict] = {}
+
+    def record_stripe(self, obj, purpose: str, notes: str | None = None) -> None:
+        """Anota una sesion de Checkout pagada. No hace nada si no esta pagada.
+
+        `obj` es la sesion tal como llega: del webhook o de la API, tienen la
+        misma forma. El id del pago es el payment_intent, que es el mismo por
+        cualquier camino; la sesion solo si no trae uno.
+        """
+        if obj.get("payment_status") != "paid":
+            return
+        payment_id = obj.get("payment_intent") or obj["id"]
+        if not isinstance(payment_id, str):
+            payment_id = payment_id["id"]          # payment_intent expandido
+        row = {
+            "provider": "stripe",
+            "purpose": purpose,
+            "amount": (obj.get("amount_total") or 0) / 100,  # Stripe usa centavos
+            "currency": obj.get("currency") or "",
+            "provider_payment_id": payment_id,
+            "email": (obj.get("customer_details") or {}).get("email"),
+            "notes": notes,
+            "created_at": datetime.utcnow(),
+        }
+        with self._lock:
+            self._pending.setdefault(payment_id, row)
+
+    def flush(self, session: Session) -> int:
+        """Escribe todo lo pendiente. Devuelve cuantas filas nuevas entraron.
+
+        Si la escritura falla, lo pendiente vuelve al buffer para el
+        siguiente intento y la excepcion sigue hacia arriba.
+        """
+        with self._lock:
+            rows, self._pending = self._pending, {}
+        if not rows:
+            return 0
+        try:
+            added = insert_ignore_many(session, PaymentRecord, list(rows.values()))
+            session.commit()
+        except Exception:
+            session.rollback()
+            with self._lock:
+                for payment_id, row in rows.items():
+                    self._pending.setdefault(payment_id, row)
+            raise
+        return added
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+
+# Instancia unica del proceso, como `occupancy` en db/occupancy.py.
+ledger = PaymentLedger()
+
+
+def daily_totals(session: Session, start: date, end: date) -> list[dict]:
+    """Totales cobrados por dia (hora local del negocio), de `start` a `end`.
+
+        [{"day": "2026-10-18", "purpose": "deposit", "currency": "usd",
+          "count": 3, "amount": 150.0}, ...]
+
+    El rango se filtra en la base con el indice de created_at. El agrupado
+    por dia se hace aqui: created_at esta en UTC y el dia que importa es el
+    de Florida, y pasar de zona horaria en SQL se escribe distinto en
+    Postgres y en SQLite. Solo se leen las cuatro columnas que hacen falta.
+    """
+    lo, hi = (datetime.combine(d, time(), TZ).astimezone(timezone.utc).replace(tzinfo=None)
+              for d in (start, end + timedelta(days=1)))
+
+    totals: dict[tuple[str, str, str], dict] = {}
+    for created_at, purpose, currency, amount in session.exec(
+        select(PaymentRecord.created_at, PaymentRecord.purpose,
+               PaymentRecord.currency, PaymentRecord.amount)
+        .where(PaymentRecord.created_at >= lo, PaymentRecord.created_at < hi)
+    ).all():
+        day = created_at.replace(tzinfo=timezone.utc).astimezone(TZ).date().isoformat()
+        entry = totals.setdefault((day, purpose, currency), {
+            "day": day, "purpose": purpose, "currency": currency, "count": 0, "amount": 0.0,
+        })
+        entry["count"] += 1
+        entry["amount"] = round(entry["amount"] + amount, 2)
+    return [totals[key] for key in sorted(totals)]
+
+
+def flush_ledger() -> int:
+    """Tarea de fondo: escribe lo que se haya anotado fuera de la bandeja."""
+    with Session(engine) as session:
+        return ledger.flush(session)
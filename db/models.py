@@ -4,14 +4,28 @@ Modelos SQLite con SQLModel (simple y rápido).
 - EstimateRequest: solicitudes de estimado
 - EstimatePhoto: fotos asociadas
 - PaymentRecord: pagos confirmados (Stripe webhook + PayPal capture)
+- Booking: reservas de instalacion
+- SlotLock: cerrojo por (dia, franja) para apartar cupos sin sobreventa
+- WebhookEvent: bandeja de entrada de los webhooks de Stripe
+- OutboxEmail: correos al dueno esperando a salir por SMTP
 """
 
 from datetime import datetime, date as date_type
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
 class EstimateRequest(SQLModel, table=True):
+    # Para la bandeja /admin/estimates (db/estimates.py), que pagina por
+    # (created_at, id) del mas nuevo al mas viejo: un indice por cada forma
+    # de filtrar, todos terminando en esas dos columnas.
+    __table_args__ = (
+        Index("ix_estimaterequest_created_at_id", "created_at", "id"),
+        Index("ix_estimaterequest_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_estimaterequest_urgency_created_at_id", "urgency", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
 
     created_at: datetime = Field(default_factory=datetime.utcnow)
@@ -39,8 +53,31 @@ class EstimatePhoto(SQLModel, table=True):
     file_path: str  # ruta relativa dentro de /static (ej: /static/uploads/...)
     original_name: str
 
+    # Hash del contenido, que es tambien el nombre del archivo
+    # (core/uploads.py). Varias filas pueden compartir archivo: el numero de
+    # filas con un sha256 es cuantas referencias tiene. NULL en las fotos
+    # subidas antes, con nombre {id}_{uuid}.
+    sha256: Optional[str] = Field(default=None, index=True)
+
+    # Versiones livianas para mirar la foto sin bajar el original de varios
+    # MB. Las genera core/images.py en segundo plano; mientras tanto son NULL.
+    preview_path: Optional[str] = None     # WebP de hasta 1600 px
+    thumb_path: Optional[str] = None       # WebP de hasta 320 px
+    variants_status: str = Field(default="pending", index=True)  # pending|done|failed
+
 
 class PaymentRecord(SQLModel, table=True):
+    # provider_payment_id unico: el mismo pago llega por varios caminos (el
+    # webhook, la pagina de confirmacion, core/reconcile.py) y Stripe reenvia
+    # webhooks. El libro lo inserta con ON CONFLICT DO NOTHING (db/ledger.py),
+    # asi que el segundo aviso del mismo pago no crea otra fila.
+    #
+    # created_at indexado para daily_totals(), que filtra por rango de fechas.
+    __table_args__ = (
+        Index("ux_paymentrecord_provider_payment_id", "provider_payment_id", unique=True),
+        Index("ix_paymentrecord_created_at", "created_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -51,13 +88,23 @@ class PaymentRecord(SQLModel, table=True):
     currency: str
 
     # IDs del proveedor para auditoría
-    provider_payment_id: str = Field(index=True)
+    provider_payment_id: str        # Stripe: el payment_intent de la sesion
     email: Optional[str] = None
     notes: Optional[str] = None
 
 class Booking(SQLModel, table=True):
     """Reserva de instalacion de surge protector con deposito pagado."""
 
+    # Indice para taken_map(): filtra por estado y rango de fechas y agrupa
+    # por (dia, franja). Con las tres columnas en este orden la consulta se
+    # resuelve recorriendo solo la ventana del calendario.
+    #
+    # Al ser un indice nuevo sobre una tabla que ya existe, create_all() no lo
+    # crearia: lo crea init_db() aparte (ver db/session.py).
+    __table_args__ = (
+        Index("ix_booking_status_date_slot", "status", "service_date", "slot"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
 
     # Id publico corto y aleatorio. Va en la URL de confirmacion.
@@ -98,6 +145,99 @@ class Booking(SQLModel, table=True):
     notes: Optional[str] = None
 
     # Estado
-    status: str = "pending"            # pending|paid|cancelled
+    # overbooked: se pago cuando su apartado ya habia vencido y la franja
+    # estaba llena (ver db.booking.mark_paid). Cobrada, pero sin cupo.
+    status: str = "pending"            # pending|paid|cancelled|expired|overbooked
     stripe_session_id: Optional[str] = Field(default=None, index=True)
-    paid_at: Optional[datetime] = None
\ No newline at end of file
+    paid_at: Optional[datetime] = None
+
+    # Checkout idempotente (ver start_checkout en routes/booking.py). La clave
+    # sale del formulario + la seleccion: un doble clic o un "atras y enviar
+    # otra vez" trae la misma, y en vez de una reserva nueva se reutiliza esta
+    # y su sesion de Stripe. Unica para que dos envios simultaneos no puedan
+    # crear dos filas; NULL no cuenta para la unicidad.
+    checkout_key: Optional[str] = Field(default=None, index=True, unique=True)
+    stripe_checkout_url: Optional[str] = None
+
+class SlotLock(SQLModel, table=True):
+    """Cerrojo de una franja concreta. Una fila por (dia, franja) reservada.
+
+    No guarda nada que importe: existe para que la base tenga una fila que
+    bloquear. db.booking.reserve() la actualiza antes de contar los cupos, y
+    ese UPDATE hace esperar a cualquier otra reserva de la MISMA franja hasta
+    que la primera termine. Franjas distintas no se esperan entre si.
+    """
+
+    service_date: date_type = Field(primary_key=True)
+    slot: int = Field(primary_key=True)
+
+    # Cuantas veces se intento apartar esta franja. Es lo que escribe el
+    # UPDATE que toma el cerrojo; de paso sirve de estadistica.
+    claims: int = 0
+
+
+class WebhookEvent(SQLModel, table=True):
+    """Un webhook de Stripe ya verificado, esperando a procesarse.
+
+    La ruta del webhook solo verifica la firma y guarda aqui el evento; lo
+    procesa despues core/webhooks.py. Asi Stripe recibe su 200 al instante,
+    aunque el correo al dueno tarde o el servidor SMTP este caido.
+    """
+
+    # La cola se lee por (status, next_attempt_at): "lo pendiente que ya toca".
+    __table_args__ = (
+        Index("ix_webhookevent_status_next", "status", "next_attempt_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+    # Id del evento en Stripe ("evt_..."). Unico: Stripe reenvia el mismo
+    # evento si no recibe respuesta a tiempo, y el repetido no debe entrar.
+    event_id: str = Field(unique=True, index=True)
+    source: str                        # booking|payments — que endpoint lo recibio
+    type: str                          # checkout.session.completed, ...
+    payload: str                       # el JSON tal cual lo firmo Stripe
+
+    status: str = "pending"            # pending|done|failed
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    last_error: Optional[str] = None
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    processed_at: Optional[datetime] = None
+
+
+class OutboxEmail(SQLModel, table=True):
+    """Un correo al dueno esperando a salir.
+
+    Quien quiere mandar un correo lo deja aqui (core/emailer.py) y sigue; lo
+    manda despues la tarea de fondo, por una conexion SMTP que se reutiliza.
+    La peticion ya no espera el handshake TLS ni el LOGIN con el servidor de
+    correo, y un SMTP caido no pierde el aviso: se reintenta.
+    """
+
+    # Igual que WebhookEvent: la cola se lee por (status, next_attempt_at).
+    __table_args__ = (
+        Index("ix_outboxemail_status_next", "status", "next_attempt_at"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+    to: str
+    subject: str
+    body: str
+
+    # Correos del mismo grupo que esperan a la vez salen juntos en uno solo
+    # (ver core/emailer.py). NULL = sale solo.
+    group_key: Optional[str] = Field(default=None, index=True)
+    # Para correos que deben salir UNA vez aunque varios workers los pidan a
+    # la vez, como el resumen diario. NULL no cuenta para la unicidad.
+    dedupe_key: Optional[str] = Field(default=None, index=True, unique=True)
+
+    status: str = "pending"            # pending|sent|failed
+    attempts: int = 0
+    next_attempt_at: datetime = Field(default_factory=datetime.utcnow)
+    last_error: Optional[str] = None
+
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    sent_at: Optional[datetime] = None
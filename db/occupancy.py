@@ -0,0 +1,224 @@
+"""Indice en memoria de los cupos ocupados.
+
+POR QUE EXISTE
+    taken_map() consulta la base en cada visita a /booking y en cada POST a
+    /booking/checkout. Con trafico de Google Ads eso es una consulta por cada
+    vista de pagina, y cada vez sobre mas filas.
+
+    Este indice guarda lo mismo que devuelve taken_map() — el diccionario
+    `taken` de core/booking.py — pero ya armado en memoria. Se carga UNA vez
+    al arrancar y despues se mantiene al dia con cada cambio:
+
+      - add_hold()   se creo una reserva "pending"  (routes/booking.py)
+      - mark_paid()  la reserva se pago            (db/booking.mark_paid)
+      - release()    la reserva se cancelo         (routes/admin.py)
+
+    Las pendientes caducan solas, igual que en taken_map(): cada una guarda
+    cuando vence su apartado y al pedir el mapa se descartan las vencidas.
+    No hace falta ningun proceso que las limpie.
+
+QUE PASA SI SE DESINCRONIZA
+    La base sigue siendo la fuente de verdad. drift() compara el indice con
+    un taken_map() recien consultado y devuelve las diferencias; reload()
+    lo vuelve a cargar desde cero.
+
+CON VARIOS WORKERS
+    Cada proceso de uvicorn tiene su propio indice y solo ve al instante las
+    reservas que pasaron por el. Las de los otros workers las recoge al
+    recargarse, que pasa solo cada RELOAD_SECONDS (ver stale()).
+
+    Eso solo afecta a lo que se PINTA: un calendario puede ofrecer durante
+    unos segundos un cupo que otro worker acaba de tomar. Vender ese cupo es
+    imposible — db.booking.reserve() vuelve a contar en la base, bajo
+    cerrojo, antes de guardar.
+"""
+
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from core.booking import HOLD_MINUTES, HORIZON_DAYS, TZ
+from db.models import Booking
+
+# Cada cuanto se recarga el indice entero desde la base. Es lo que tarda un
+# worker en enterarse de las reservas hechas en OTRO worker. La recarga es una
+# consulta acotada a la ventana del calendario, asi que es barata.
+RELOAD_SECONDS = 60
+
+
+class OccupancyIndex:
+    """Cupos ocupados por dia y franja, con los apartados pendientes aparte.
+
+    Dos estructuras porque se comportan distinto:
+
+      _paid   {"2026-08-21": {1: 1}}  pagadas. Ocupan para siempre (o
+                                      hasta que se cancelen).
+      _holds  {booking_id: ("2026-08-21", 1, vence)}  pendientes. Cada una
+                                      vence a su hora, por eso van sueltas.
+
+    Todas las operaciones pasan por un lock: FastAPI corre las rutas sync en
+    un pool de hilos, y dos reservas a la vez no pueden pisarse el conteo.
+
+    Cada cambio sube un contador de version. Con el se arma el ETag de
+    /booking/availability: si la version no cambio, los cupos tampoco, y se
+    puede responder 304 sin calcular nada (ver version()).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._paid: dict[str, dict[int, int]] = {}
+        self._holds: dict[int, tuple[str, int, datetime]] = {}
+        self._loaded_at: float | None = None
+        self._version = 0
+        # Distinto en cada proceso. Dos workers pueden llegar al mismo numero
+        # de version con cupos distintos; con esto sus ETags nunca coinciden.
+        self._epoch = secrets.token_hex(4)
+
+    # -- carga ---------------------------------------------------------------
+
+    def reload(self, session: Session) -> None:
+        """Carga el indice desde la base, descartando lo que hubiera.
+
+        Solo se leen citas de hoy al horizonte: una reserva del ano pasado no
+        le quita cupo a nadie, y cargarla solo haria crecer el indice. Las
+        pagadas llegan ya contadas por (dia, franja); las pendientes una a
+        una, porque cada una vence a su hora — y solo las que no vencieron.
+        """
+        today = datetime.now(TZ).date()
+        window = Booking.service_date.between(today, today + timedelta(days=HORIZON_DAYS))
+        cutoff = datetime.utcnow() - timedelta(minutes=HOLD_MINUTES)
+
+        paid: dict[str, dict[int, int]] = {}
+        for service_date, slot, count in session.exec(
+            select(Booking.service_date, Booking.slot, func.count())
+            .where(Booking.status == "paid", window)
+            .group_by(Booking.service_date, Booking.slot)
+        ).all():
+            paid.setdefault(service_date.isoformat(), {})[slot] = count
+
+        holds: dict[int, tuple[str, int, datetime]] = {}
+        for booking_id, service_date, slot, created_at in session.exec(
+            select(Booking.id, Booking.service_date, Booking.slot, Booking.created_at)
+            .where(Booking.status == "pending", window, Booking.created_at >= cutoff)
+        ).all():
+            holds[booking_id] = (service_date.isoformat(), slot,
+                                 created_at + timedelta(minutes=HOLD_MINUTES))
+
+        with self._lock:
+            # La recarga periodica casi nunca trae nada nuevo. Si no cambio
+            # nada, la version se queda igual y los ETags siguen valiendo.
+            if paid != self._paid or holds != self._holds:
+                self._version += 1
+            self._paid = paid
+            self._holds = holds
+            self._loaded_at = time.monotonic()
+
+    def stale(self) -> bool:
+        """True si nunca se cargo o la ultima carga tiene mas de RELOAD_SECONDS."""
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > RELOAD_SECONDS
+
+    # -- cambios -------------------------------------------------------------
+
+    def add_hold(self, booking: Booking) -> None:
+        """Una reserva nueva en "pending": aparta su cupo HOLD_MINUTES."""
+        expires = booking.created_at + timedelta(minutes=HOLD_MINUTES)
+        with self._lock:
+            self._holds[booking.id] = (booking.service_date.isoformat(), booking.slot, expires)
+            self._version += 1
+
+    def mark_paid(self, booking: Booking) -> None:
+        """La reserva se pago: deja de ser un apartado y pasa a ocupar fijo.
+
+        Sirve tambien para una pendiente ya vencida — el cliente pudo pagar
+        tarde — porque el cupo se suma a las pagadas igual.
+        """
+        key = booking.service_date.isoformat()
+        with self._lock:
+            self._holds.pop(booking.id, None)
+            self._paid.setdefault(key, {})
+            self._paid[key][booking.slot] = self._paid[key].get(booking.slot, 0) + 1
+            self._version += 1
+
+    def release(self, booking: Booking, was_paid: bool) -> None:
+        """La reserva se cancelo: su cupo vuelve a estar libre.
+
+        `was_paid` es el estado ANTES de cancelar. El objeto ya dice
+        "cancelled", asi que quien llama tiene que pasarlo.
+        """
+        key = booking.service_date.isoformat()
+        with self._lock:
+            self._version += 1
+            self._holds.pop(booking.id, None)
+            if not was_paid:
+                return
+            used = self._paid.get(key, {})
+            if used.get(booking.slot, 0) > 1:
+                used[booking.slot] -= 1
+            else:
+                used.pop(booking.slot, None)
+                if not used:
+                    self._paid.pop(key, None)
+
+    # -- lectura -------------------------------------------------------------
+
+    def taken(self, now: datetime | None = None) -> dict:
+        """El diccionario `taken` de core/booking.py, armado desde memoria.
+
+        Aqui caducan las pendientes: las vencidas se borran del indice en el
+        mismo paso, asi el siguiente pedido ya no las recorre.
+
+        Devuelve una copia. Quien llama puede modificarla sin tocar el indice.
+        """
+        with self._lock:
+            self._expire(now or datetime.utcnow())
+            out = {key: dict(used) for key, used in self._paid.items()}
+            for key, slot, _ in self._holds.values():
+                out.setdefault(key, {})
+                out[key][slot] = out[key].get(slot, 0) + 1
+            return out
+
+    def version(self, now: datetime | None = None) -> str:
+        """Identifica el estado actual de los cupos: "<proceso>.<contador>".
+
+        Antes de leer el contador se descartan las pendientes vencidas: una
+        que vence libera un cupo, y eso tambien tiene que cambiar la version.
+        """
+        with self._lock:
+            self._expire(now or datetime.utcnow())
+            return f"{self._epoch}.{self._version}"
+
+    def _expire(self, now: datetime) -> None:
+        """Borra las pendientes vencidas. Llamar con el lock tomado."""
+        expired = [i for i, (_, _, exp) in self._holds.items() if exp <= now]
+        for booking_id in expired:
+            del self._holds[booking_id]
+        if expired:
+            self._version += 1
+
+    def drift(self, expected: dict) -> dict:
+        """Diferencias entre el indice y un `taken` recien leido de la base.
+
+            {"2026-08-21": {1: (indice, base)}, ...}
+
+        Vacio = estan de acuerdo. Solo se comparan fechas de hoy en adelante,
+        que son las unicas que el indice carga.
+        """
+        today = datetime.now(TZ).date().isoformat()
+        mine = self.taken()
+        out: dict = {}
+        for key in set(mine) | set(expected):
+            if key < today:
+                continue
+            a, b = mine.get(key, {}), expected.get(key, {})
+            for slot in set(a) | set(b):
+                if a.get(slot, 0) != b.get(slot, 0):
+                    out.setdefault(key, {})[slot] = (a.get(slot, 0), b.get(slot, 0))
+        return out
+
+
+# Instancia unica del proceso, como `engine` en db/session.py.
+occupancy = OccupancyIndex()
@@ -0,0 +1,129 @@
+"""Cola de correos salientes: guardar, reclamar y cerrar mensajes.
+
+Solo la parte de base de datos, como db/inbox.py para los webhooks. Como se
+mandan lo decide core/emailer.py.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlmodel import Session, select, update
+
+from db.inbox import LEASE, MAX_ATTEMPTS
+from db.models import OutboxEmail
+from db.session import insert_ignore
+
+
+def enqueue_email(session: Session, to: str, subject: str, body: str,
+                  group_key: str | None = None, delay: float = 0,
+                  dedupe_key: str | None = None) -> bool:
+    """Deja un correo en la cola. False si ya habia uno con ese dedupe_key.
+
+    `delay` retrasa el primer intento. Con `group_key` es la ventana de
+    agrupado: lo que llegue al mismo grupo mientras este espera sale con el.
+    """
+    now = datetime.utcnow()
+    added = insert_ignore(session, OutboxEmail, to=to, subject=subject, body=body,
+                          group_key=group_key, dedupe_key=dedupe_key, status="pending",
+                          attempts=0, next_attempt_at=now + timedelta(seconds=delay),
+                          created_at=now)
+    session.commit()
+    return added
+
+
+def _claim(session: Session, rows: list[OutboxEmail], now: datetime) -> list[int]:
+    """Reclama cada fila con un UPDATE condicional. Devuelve los ids que gano."""
+    claimed = []
+    for email in rows:
+        result = session.exec(
+            update(OutboxEmail)
+            .where(OutboxEmail.id == email.id,
+                   OutboxEmail.status == "pending",
+                   OutboxEmail.next_attempt_at == email.next_attempt_at)
+            .values(next_attempt_at=now + LEASE, attempts=OutboxEmail.attempts + 1)
+        )
+        if result.rowcount == 1:
+            claimed.append(email.id)
+    return claimed
+
+
+def claim_due(session: Session, limit: int = 50) -> list[OutboxEmail]:
+    """Toma hasta `limit` correos que ya toca mandar, en orden de llegada.
+
+    Mismo reclamo que db.inbox.claim_due: un UPDATE condicional por fila, asi
+    dos workers no mandan el mismo correo.
+
+    Si un correo con grupo ya toca, se llevan tambien los demas de su grupo
+    que siguen esperando su ventana, aunque todavia no les toque: es lo que
+    los junta en un solo correo. (Pueden pasar de `limit`.) Solo los que
+    nunca se intentaron: uno con intentos o esta reclamado por otro worker o
+    espera su reintento, y en los dos casos no es de esta tanda.
+    """
+    now = datetime.utcnow()
+    due = session.exec(
+        select(OutboxEmail)
+        .where(OutboxEmail.status == "pending", OutboxEmail.next_attempt_at <= now)
+        .order_by(OutboxEmail.id)
+        .limit(limit)
+    ).all()
+
+    claimed = _claim(session, due, now)
+    groups = {e.group_key for e in due if e.group_key and e.id in claimed}
+    if groups:
+        waiting = session.exec(
+            select(OutboxEmail)
+            .where(OutboxEmail.status == "pending", OutboxEmail.attempts == 0,
+                   OutboxEmail.next_attempt_at > now, OutboxEmail.group_key.in_(groups))
+        ).all()
+        claimed += _claim(session, [e for e in waiting if e.id not in claimed], now)
+    session.commit()
+    if not claimed:
+        return []
+    return session.exec(
+        select(OutboxEmail).where(OutboxEmail.id.in_(claimed)).order_by(OutboxEmail.id)
+    ).all()
+
+
+def mark_sent(session: Session, emails: list[OutboxEmail]) -> None:
+    """Cierra los correos que salieron, con un solo commit."""
+    now = datetime.utcnow()
+    for email in emails:
+        email.status = "sent"
+        email.sent_at = now
+        email.last_error = None
+        session.add(email)
+    session.commit()
+
+
+def mark_failed(session: Session, email: OutboxEmail, error: str) -> bool:
+    """Registra el fallo y programa el reintento. True si ya no se reintenta.
+
+    La misma espera que los webhooks: 30 s, 1 min, 2 min... hasta una hora,
+    y "failed" pasados MAX_ATTEMPTS.
+    """
+    email.last_error = error[:1000]
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = "failed"
+    else:
+        delay = min(30 * 2 ** (email.attempts - 1), 3600)
+        email.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+    session.add(email)
+    session.commit()
+    return email.status == "failed"
+
+
+def depth(session: Session) -> dict:
+    """Estado de la cola, con el mismo formato que db.inbox.depth."""
+    counts = dict(session.exec(
+        select(OutboxEmail.status, func.count())
+        .where(OutboxEmail.status.in_(("pending", "failed")))
+        .group_by(OutboxEmail.status)
+    ).all())
+    oldest = session.exec(
+        select(func.min(OutboxEmail.created_at)).where(OutboxEmail.status == "pending")
+    ).one()
+    return {
+        "pending": counts.get("pending", 0),
+        "failed": counts.get("failed", 0),
+        "oldest_pending_seconds": int((datetime.utcnow() - oldest).total_seconds()) if oldest else 0,
+    }
@@ -4,31 +4,195 @@ Conexión y creación de tablas.
 Una sola variable manda: DATABASE_URL. En Railway apunta a Postgres; en
 local, si no está definida, cae a SQLite. El mismo código corre en los dos
 sitios sin flags ni ramas.
+
+Hay dos motores sobre la misma base:
+  - engine / get_session: síncrono. Lo usan las rutas `def`, que FastAPI ya
+    corre en su pool de hilos.
+  - async_engine / get_async_session: asíncrono (asyncpg en Postgres,
+    aiosqlite en local). Lo usan las rutas `async def`: una consulta
+    síncrona dentro de ellas frenaría el event loop entero, y con él todas
+    las demás peticiones.
+El driver asíncrono se elige solo a partir de la misma DATABASE_URL.
 """
 
+import logging
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlmodel import create_engine, SQLModel, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from core.config import settings
 
+log = logging.getLogger(__name__)
+
 # Railway entrega la URL como "postgres://" y SQLAlchemy sólo entiende
 # "postgresql://". El replace va aquí porque es más seguro que confiar en que
 # alguien recuerde editar a mano la URL que Railway generó.
 _url = settings.database_url.replace("postgres://", "postgresql://", 1)
 
 # check_same_thread sólo existe en SQLite: pasárselo a Postgres da TypeError.
-_connect_args = {"check_same_thread": False} if _url.startswith("sqlite") else {}
+#
+# timeout: SQLite admite un solo escritor a la vez y los demás esperan su
+# turno. Por defecto esperan 5 s; con una ráfaga de reservas a la misma franja
+# (ver db.booking.reserve) la cola puede ser más larga que eso, y pasado el
+# plazo la reserva fallaría con "database is locked" en vez de esperar.
+_connect_args = {"check_same_thread": False, "timeout": 30} if _url.startswith("sqlite") else {}
 
 # pool_pre_ping: Railway corta las conexiones ociosas. Sin esto, la primera
 # petición tras un rato de calma falla con "server closed the connection".
 engine = create_engine(_url, connect_args=_connect_args, pool_pre_ping=True)
 
 
+def _async_url(url: str) -> str:
+    """La misma URL con el driver asíncrono de cada base.
+
+    "postgresql://..." -> "postgresql+asyncpg://..."
+    "sqlite:///..."    -> "sqlite+aiosqlite:///..."
+
+    Si la URL ya trae un driver ("postgresql+psycopg2://"), se sustituye.
+    """
+    scheme, rest = url.split("://", 1)
+    base = scheme.split("+", 1)[0]
+    driver = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}[base]
+    return f"{base}+{driver}://{rest}"
+
+
+# check_same_thread no aplica: aiosqlite ya corre la conexión en su propio
+# hilo. El timeout sí, por la misma razón que arriba.
+_async_connect_args = {"timeout": 30} if _url.startswith("sqlite") else {}
+async_engine = create_async_engine(_async_url(_url), connect_args=_async_connect_args,
+                                   pool_pre_ping=True)
+
+
+# Indices que se reemplazaron por otros y se borran al arrancar, para no
+# mantener dos sobre la misma columna en cada escritura.
+_RETIRED_INDEXES = (
+    # Reemplazado por ux_paymentrecord_provider_payment_id, que es unico.
+    "ix_paymentrecord_provider_payment_id",
+)
+
+# Indices unicos cuyas filas repetidas son la MISMA cosa anotada dos veces:
+# antes de crearlos se deja la primera y se borran las demas. Un pago de
+# Stripe es uno solo aunque el libro lo hubiera anotado por dos caminos.
+# Cualquier otro indice unico con repetidos detiene el arranque.
+_DEDUPE_BEFORE = {"ux_paymentrecord_provider_payment_id"}
+
+
+def _make_unique(conn, index) -> None:
+    """Deja la tabla lista para crear el indice unico `index`.
+
+    Sobre una tabla que ya tiene datos, un repetido haria fallar el CREATE
+    UNIQUE INDEX con un IntegrityError y la app no arrancaria. Los NULL no
+    cuentan: no chocan entre si.
+    """
+    table, cols = index.table, list(index.columns)
+    filled = [c.is_not(None) for c in cols]
+    dupes = conn.execute(
+        select(*cols, func.count()).where(*filled).group_by(*cols)
+        .having(func.count() > 1).limit(5)
+    ).all()
+    if not dupes:
+        return
+    names = ", ".join(c.name for c in cols)
+    if index.name not in _DEDUPE_BEFORE:
+        raise RuntimeError(
+            f"Cannot create unique index {index.name}: {table.name} has repeated "
+            f"values in ({names}), for example {[tuple(d[:-1]) for d in dupes]}. "
+            f"Fix those rows and start again.")
+    keep = select(func.min(table.c.id)).where(*filled).group_by(*cols)
+    removed = conn.execute(
+        table.delete().where(*filled).where(table.c.id.not_in(keep))
+    ).rowcount
+    log.warning("%s: removed %d repeated rows on (%s) before creating %s",
+                table.name, removed, names, index.name)
+
+
+def _check_columns(db) -> None:
+    """Falla si a una tabla que ya existe le falta una columna del modelo.
+
+    init_db no agrega columnas (README, "Columnas añadidas"). Sin este
+    control, arrancar sin haber corrido los ALTER daba un "no such column" al
+    crear el indice de la columna nueva, o en la primera consulta que la
+    usara. Asi el error dice exactamente que falta correr.
+    """
+    missing = []
+    for table in SQLModel.metadata.sorted_tables:
+        have = {c["name"] for c in db.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in have:
+                kind = column.type.compile(dialect=engine.dialect)
+                missing.append(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {kind};")
+    if missing:
+        raise RuntimeError(
+            "The database is missing columns the code uses. Run the migrations "
+            "in README.md (\"Columnas añadidas\") and start again:\n  "
+            + "\n  ".join(missing))
+
+
 def init_db() -> None:
-    """Crea las tablas que falten. No altera ni borra las existentes."""
+    """Crea las tablas e indices que falten. No altera columnas.
+
+    create_all() solo crea los indices de las tablas que crea. Un indice que
+    se declara despues sobre una tabla que ya existe — el compuesto de Booking,
+    por ejemplo — se quedaria sin crear en Railway. Por eso se recorren todos
+    y se crea cada uno que falte. Si es unico, antes se revisa que los datos
+    que ya hay lo permitan (ver _make_unique). Todo va en una transaccion.
+
+    Antes se revisa que las tablas tengan todas las columnas del modelo (ver
+    _check_columns): si falta un ALTER, no arranca y dice cual.
+    """
     SQLModel.metadata.create_all(engine)
+    with engine.begin() as conn:
+        db = inspect(conn)
+        _check_columns(db)
+        for table in SQLModel.metadata.sorted_tables:
+            existing = {ix["name"] for ix in db.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                if index.unique:
+                    _make_unique(conn, index)
+                index.create(conn)
+        for name in _RETIRED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
 
 
 def get_session():
     """Dependencia de FastAPI: abre una sesión y la cierra al terminar."""
     with Session(engine) as session:
         yield session
+
+
+async def get_async_session():
+    """Como get_session, para rutas `async def`.
+
+    expire_on_commit=False: en modo asíncrono, leer un atributo expirado
+    dispararía una consulta implícita fuera de un await, y eso falla. Así,
+    tras un commit los objetos conservan los valores que ya tenían.
+    """
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+def insert_ignore(session: Session, model, **values) -> bool:
+    """INSERT que no hace nada si la fila ya existe (misma clave unica).
+
+    Devuelve True si la fila se inserto, False si ya estaba.
+
+    Postgres y SQLite lo escriben igual — ON CONFLICT DO NOTHING — pero
+    SQLAlchemy lo expone por dialecto, asi que hay que elegir el insert de la
+    base que este conectada. Sin esto, dos peticiones que crean la misma fila
+    a la vez harian fallar a una con IntegrityError.
+    """
+    return insert_ignore_many(session, model, [values]) == 1
+
+
+def insert_ignore_many(session: Session, model, rows: list[dict]) -> int:
+    """insert_ignore para muchas filas en UN solo INSERT. Devuelve cuantas entraron."""
+    if not rows:
+        return 0
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+    result = session.exec(dialect.insert(model).values(rows).on_conflict_do_nothing())
+    return result.rowcount
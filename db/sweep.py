@@ -0,0 +1,30 @@
+"""
+Barrido de reservas abandonadas: "pending" viejas -> "expired".
+
+Corre solo dentro del servidor cada SWEEP_SECONDS (lo registra main.py en
+core/background.py). Tambien se puede lanzar a mano, por ejemplo la primera
+vez sobre una base con anos de abandonos:
+
+    python -m db.sweep
+"""
+
+from sqlmodel import Session
+
+import db.models  # noqa: F401 — registra las tablas antes de init_db()
+from db.booking import expire_abandoned
+from db.session import engine, init_db
+
+# Cada cuanto corre dentro del servidor. Es un UPDATE que casi siempre no
+# encuentra nada, asi que puede ser frecuente sin coste.
+SWEEP_SECONDS = 300
+
+
+def sweep() -> int:
+    """Una pasada completa. Devuelve cuantas reservas paso a "expired"."""
+    with Session(engine) as session:
+        return expire_abandoned(session)
+
+
+if __name__ == "__main__":
+    init_db()
+    print(f"expired {sweep()} abandoned bookings")
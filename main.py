@@ -1,10 +1,26 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.gzip import GZipMiddleware
+from sqlmodel import Session
 
+from core import background
+from core.checkout import close_stripe_client
 from core.config import settings
-from db.session import init_db
+from core.emailer import OUTBOX_SECONDS, send_outbox
+from core.images import IMAGES_SECONDS, ORPHAN_SECONDS, collect_orphan_photos, process_pending_photos
+from core.notify import DIGEST_CHECK_SECONDS, send_daily_digest
+from core.prerender import Prerendered
+from core.search import SEARCH_REFRESH_SECONDS, refresh_search
+from core.uploads import BodySizeLimit
+from core.webhooks import INBOX_SECONDS, process_inbox
+from db.ledger import LEDGER_FLUSH_SECONDS, flush_ledger
+from db.occupancy import occupancy
+from db.session import engine, init_db
+from db.sweep import SWEEP_SECONDS, sweep
 from routes.home import router as home_router
+from routes import estimates
 from routes.estimates import router as estimates_router
 from routes.payments import router as payments_router
 from routes.blog import router as blog_router
@@ -18,6 +34,10 @@ from routes.admin import router as admin_router
 def _register_middlewares(app: FastAPI) -> None:
     """Configura middlewares de la app (Gzip + Cache-Control en /static)."""
     app.add_middleware(GZipMiddleware, minimum_size=1000)
+    # Corta las subidas del formulario de estimados que no caben, antes de
+    # leerlas enteras (ver core/uploads.py).
+    app.add_middleware(BodySizeLimit, path="/estimate",
+                       max_bytes=estimates.MAX_REQUEST_BYTES, reject=estimates.too_large)
 
     @app.middleware("http")
     async def add_cache_headers(request: Request, call_next):
@@ -26,6 +46,11 @@ def _register_middlewares(app: FastAPI) -> None:
             response.headers["Cache-Control"] = "public, max-age=31536000"
         return response
 
+    # Va la ultima para quedar por fuera de todo: contesta las paginas ya
+    # pre-renderizadas (y comprimidas) sin pasar por la app (core/prerender.py).
+    if settings.prerender_dir:
+        app.add_middleware(Prerendered, directory=settings.prerender_dir)
+
 
 def _register_routers(app: FastAPI) -> None:
     """Registra todos los routers del proyecto."""
@@ -39,10 +64,37 @@ def _register_routers(app: FastAPI) -> None:
     app.include_router(admin_router)
 
 
+def _register_jobs() -> None:
+    """Registra las tareas periodicas que corren con la app (core/background.py)."""
+    background.register("sweep", SWEEP_SECONDS, sweep)
+    background.register("webhooks", INBOX_SECONDS, process_inbox)
+    background.register("ledger", LEDGER_FLUSH_SECONDS, flush_ledger)
+    background.register("outbox", OUTBOX_SECONDS, send_outbox)
+    background.register("digest", DIGEST_CHECK_SECONDS, send_daily_digest)
+    background.register("images", IMAGES_SECONDS, process_pending_photos)
+    background.register("orphans", ORPHAN_SECONDS, collect_orphan_photos)
+    background.register("search", SEARCH_REFRESH_SECONDS, refresh_search)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Las tareas de fondo mientras la app corre; al cerrar, tambien las
+    conexiones abiertas con Stripe."""
+    try:
+        async with background.lifespan(app):
+            yield
+    finally:
+        await close_stripe_client()
+
+
 def create_app() -> FastAPI:
     """Construye la app FastAPI con DB init, middlewares, static y routers."""
-    app = FastAPI(title=settings.app_name)
+    app = FastAPI(title=settings.app_name, lifespan=lifespan)
     init_db()
+    # Cupos ocupados en memoria: se leen de la base una sola vez, aqui.
+    with Session(engine) as session:
+        occupancy.reload(session)
+    _register_jobs()
     _register_middlewares(app)
     app.mount("/static", StaticFiles(directory="static"), name="static")
     _register_routers(app)
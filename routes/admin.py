@@ -4,18 +4,22 @@ Protegido con HTTP Basic contra una sola contrasena en .env: sin usuarios,
 sin sesiones, sin recuperar clave. Es una pagina para dos personas.
 """
 
-from datetime import date
+from datetime import date, timezone
 
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import RedirectResponse, Response
 from sqlmodel import Session, select
 
 from core.admin_auth import require_admin
-from core.booking import slot_label
+from core.booking import TZ, slot_label
 from core.export import bookings_csv
 from core.templating import templates
-from db.booking import get_by_public_id
+from db import inbox, outbox
+from db.estimates import STATUSES, URGENCIES, decode_cursor, inbox_page
+from db.booking import get_by_public_id, occupancy_drift
+from db.ledger import daily_totals
 from db.models import Booking
+from db.occupancy import occupancy
 from db.session import get_session
 
 router = APIRouter(prefix="/admin", tags=["admin"])
@@ -41,11 +45,18 @@ def bookings(request: Request, day: str = "", _: str = Depends(require_admin),
       confirmed  reservas pagadas. Son las citas reales.
       review     reservas en "pending". Aqui caen DOS casos que la base no
                  puede diferenciar: quien abandono el pago, y quien pago pero
-                 cuyo webhook se perdio. Hay que mirarlas en Stripe.
+                 cuyo webhook se perdio. python -m core.reconcile recoge las
+                 segundas de Stripe de una vez (ver core/reconcile.py).
 
     Sin esa segunda lista, una reserva con el pago colgado no aparece en
     ningun sitio: el cliente ve "We're confirming your payment" y ahi se
     acaba el rastro.
+
+    Pasada la gracia de db/sweep.py las abandonadas salen de "review" como
+    "expired". Un pago que llegue despues no se pierde: Stripe reintenta el
+    webhook durante dias y mark_paid() acepta tambien las expiradas. Si para
+    entonces la franja ya se lleno, la reserva sale arriba de todo, en
+    "overbooked": hay que llamar al cliente.
     """
     # ?day=2026-09-15 reduce la agenda a un solo dia. Una fecha mal escrita se
     # ignora en vez de dar error: es un filtro de conveniencia y no merece la
@@ -59,6 +70,7 @@ def bookings(request: Request, day: str = "", _: str = Depends(require_admin),
         "request": request,
         "confirmed": _upcoming(session, "paid", picked),
         "review": _upcoming(session, "pending", picked),
+        "overbooked": _upcoming(session, "overbooked", picked),
         "slot_label": slot_label,
         "picked": picked,
         "today": date.today(),
@@ -73,15 +85,17 @@ def cancel(public_id: str, _: str = Depends(require_admin),
     La fila NO se borra: el deposito ya se cobro y tiene que quedar constancia
     de a quien hay que devolverselo.
 
-    El cupo se libera solo, sin tocar nada mas: taken_map() solo cuenta las
-    pagadas y las pendientes recientes, asi que una "cancelled" deja de ocupar
-    en cuanto se guarda.
+    En la base el cupo se libera solo: taken_map() solo cuenta las pagadas y
+    las pendientes recientes, asi que una "cancelled" deja de ocupar en cuanto
+    se guarda. El indice en memoria si hay que avisarlo.
     """
     booking = get_by_public_id(session, public_id)
     if booking:
+        was_paid = booking.status == "paid"
         booking.status = "cancelled"
         session.add(booking)
         session.commit()
+        occupancy.release(booking, was_paid)
     return RedirectResponse("/admin/bookings", status_code=303)
 
 
@@ -102,3 +116,70 @@ def download_csv(_: str = Depends(require_admin),
         media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=bookings.csv"},
     )
+
+
+@router.get("/occupancy")
+def occupancy_check(_: str = Depends(require_admin),
+                    session: Session = Depends(get_session)):
+    """Compara el indice de cupos en memoria con la base y lo corrige.
+
+    Si hay diferencias se devuelven (para saber que paso) y el indice se
+    recarga en el mismo momento: el calendario vuelve a ser exacto sin
+    reiniciar el servidor.
+    """
+    drift = occupancy_drift(session)
+    if drift:
+        occupancy.reload(session)
+    # Las claves de franja son int y JSON solo admite texto como clave.
+    return {"ok": not drift,
+            "drift": {d: {str(n): v for n, v in slots.items()} for d, slots in drift.items()}}
+
+
+@router.get("/queues")
+def queues(_: str = Depends(require_admin), session: Session = Depends(get_session)):
+    """Profundidad de las colas en segundo plano, en JSON.
+
+    Una cola que solo crece, o un "failed" distinto de cero, quiere decir que
+    algo no se esta procesando: hay que mirar el log.
+    """
+    return {"webhooks": inbox.depth(session), "email": outbox.depth(session)}
+
+
+@router.get("/payments/daily")
+def payments_daily(start: date, end: date, _: str = Depends(require_admin),
+                   session: Session = Depends(get_session)):
+    """Totales cobrados por dia entre dos fechas (incluidas), en JSON.
+
+    Sale del libro de pagos (db/ledger.py): depositos de reservas y cobros
+    sueltos, en hora de Florida.
+    """
+    return {"days": daily_totals(session, start, end)}
+
+
+@router.get("/estimates")
+def estimates(request: Request, status: str = "", urgency: str = "", after: str = "",
+              _: str = Depends(require_admin), session: Session = Depends(get_session)):
+    """Bandeja de solicitudes de estimado, de la mas nueva a la mas vieja.
+
+    ?status= y ?urgency= filtran; ?after= es el cursor de "Older" (ver
+    db/estimates.py). Como en la agenda, un filtro o cursor que no se
+    entiende se ignora en vez de dar error.
+    """
+    status = status if status in STATUSES else ""
+    urgency = urgency if urgency in URGENCIES else ""
+    rows, photos, next_cursor = inbox_page(session, status or None, urgency or None,
+                                           decode_cursor(after) if after else None)
+
+    return templates.TemplateResponse("admin/estimates.html", {
+        "request": request,
+        "rows": rows,
+        "photos": photos,
+        "next_cursor": next_cursor,
+        "first_page": not after,
+        "status": status,
+        "urgency": urgency,
+        "statuses": STATUSES,
+        "urgencies": URGENCIES,
+        # created_at se guarda en UTC sin zona; se muestra en hora local.
+        "local": lambda dt: dt.replace(tzinfo=timezone.utc).astimezone(TZ),
+    })
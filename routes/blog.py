@@ -1,19 +1,16 @@
-from pathlib import Path
 from fastapi import APIRouter, Request
 from fastapi.responses import HTMLResponse
-import markdown as md
 
 from core.utils import get_lang
 from core.i18n import t
 from core.config import settings
-from core.posts import load_posts
+from core.posts import get_post, load_posts, render_post
+from core.search import search_index
 from core.templating import templates
 from core.seo_blog import build_article_schema
 
 router = APIRouter(prefix="/blog", tags=["blog"])
 
-POSTS_DIR = Path("posts")
-
 
 @router.get("", response_class=HTMLResponse)
 def blog_list(request: Request):
@@ -25,11 +22,24 @@ def blog_list(request: Request):
     )
 
 
+# Antes que /{slug}: si no, "search" se tomaria por el slug de un post.
+@router.get("/search", response_class=HTMLResponse)
+def blog_search(request: Request, q: str = ""):
+    """Resultados de busqueda con la misma plantilla de la lista (core/search.py)."""
+    lang = get_lang(request)
+    q = q.strip()[:200]
+    posts = [post for post, _ in search_index.search(q, limit=20)] if q else []
+    return templates.TemplateResponse(
+        "blog_list.html",
+        {"request": request, "lang": lang, "t": lambda k: t(lang, k), "app_name": settings.app_name,
+         "posts": posts, "q": q, "searched": True},
+    )
+
+
 @router.get("/{slug}", response_class=HTMLResponse)
 def blog_post(request: Request, slug: str):
     lang = get_lang(request)
-    posts = load_posts()
-    post = next((p for p in posts if p.get("slug") == slug), None)
+    post = get_post(slug)
     if not post:
         not_found = {"title": "Post Not Found", "excerpt": "The post you are looking for does not exist.", "slug": slug}
         return templates.TemplateResponse(
@@ -39,8 +49,9 @@ def blog_post(request: Request, slug: str):
             status_code=404,
         )
 
-    md_file = POSTS_DIR / post["file"]
-    html = md.markdown(md_file.read_text(encoding="utf-8")) if md_file.exists() else "<p>Contenido no disponible.</p>"
+    # Ya convertido y en memoria (core/posts.py); solo se relee si el
+    # archivo cambio.
+    html = render_post(post) or "<p>Contenido no disponible.</p>"
 
     return templates.TemplateResponse(
         "blog_post.html",
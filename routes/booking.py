@@ -2,8 +2,10 @@
 
 Flujo completo:
     GET  /booking?plan=recommended   el cliente elige fecha y llena datos
+    GET  /booking/availability       los mismos dias en JSON, para refrescar
     POST /booking/checkout           se valida, se aparta el cupo, va a Stripe
     GET  /booking/confirmed          vuelve de Stripe, se dispara el evento GA4
+    GET  /booking/status/{public_id} la confirmacion sondea aqui si sigue pendiente
     POST /booking/webhook            Stripe avisa que el pago se completo
 
 Los dos ultimos confirman el pago y pueden llegar en cualquier orden. Los dos
@@ -11,37 +13,139 @@ llaman a mark_paid(), que deja pasar solo al primero: por eso el aviso al
 dueno sale una sola vez.
 """
 
+import hashlib
 import secrets
+from datetime import datetime, timedelta
 
 import stripe
-from fastapi import APIRouter, Depends, Form, Request
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Depends, Form, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, RedirectResponse
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from core.booking import DEPOSIT, BookingUnavailable, open_days, slot_label, validate_selection
-from core.checkout import create_booking_session
+from core.booking import (DEPOSIT, HOLD_MINUTES, UNAVAILABLE, BookingUnavailable, calendar_version, open_days,
+                          slot_label, validate_selection)
+from core.checkout import create_booking_session, session_status, stripe_email
 from core.config import settings
+from core.http_cache import is_fresh, not_modified, validators
 from core.notify import notify_new_booking
 from core.offers import get_plan
 from core.templating import templates          # ajustar si tu helper se llama distinto
-from db.booking import get_by_stripe_session, mark_paid, taken_map
+from core.webhooks import wake_inbox
+from db.booking import (get_by_checkout_key_async, get_by_stripe_session_async, get_status,
+                        mark_paid_async, reserve_async)
+from db.inbox import enqueue_async
+from db.ledger import ledger
 from db.models import Booking
-from db.session import get_session              # ajustar si tu dependencia se llama distinto
+from db.occupancy import occupancy
+from db.session import get_async_session, get_session
 
 router = APIRouter(prefix="/booking", tags=["booking"])
 
 
-def _stripe_email(obj) -> str:
-    """Email que Stripe recogio en su checkout. Cadena vacia si no viene.
+def _taken(session: Session) -> dict:
+    """Cupos ocupados segun el indice en memoria, recargado si ya es viejo.
 
-    Sirve igual para la sesion que devuelve la API y para el objeto que llega
-    en el webhook: los dos son diccionarios con la misma forma.
+    La recarga periodica es lo que trae las reservas hechas en otros workers
+    (ver db/occupancy.py). Casi siempre no recarga y no toca la base.
+    """
+    if occupancy.stale():
+        occupancy.reload(session)
+    return occupancy.taken()
+
+
+async def _taken_async(session: AsyncSession) -> dict:
+    """Como _taken, para rutas `async def`."""
+    if occupancy.stale():
+        await session.run_sync(occupancy.reload)
+    return occupancy.taken()
+
+
+async def _unavailable(request: Request, p: dict, session: AsyncSession, error: str):
+    """Vuelve a pintar el calendario ya actualizado, con el mensaje arriba.
+
+    Se recarga el indice antes: si se llego aqui porque otro worker se llevo
+    el cupo, el indice de este proceso todavia no lo sabe, y volveria a
+    ofrecer la misma franja que se acaba de rechazar.
+    """
+    await session.run_sync(occupancy.reload)
+    return templates.TemplateResponse("booking/select_date.html", {
+        "request": request,
+        "plan": p,
+        "deposit": DEPOSIT,
+        "balance": p["price"] - DEPOSIT,
+        "days": open_days(occupancy.taken()),
+        "error": error,
+        "idem_key": secrets.token_urlsafe(16),
+    }, status_code=409)
+
+
+def _checkout_key(idem_key: str, plan: str, service_date: str, slot: int) -> str | None:
+    """Clave de idempotencia del checkout. None si el formulario no trae una.
+
+    El formulario lleva una clave aleatoria por carga de pagina. Un doble clic
+    en "Pay deposit", o volver atras y enviar de nuevo, manda la misma; una
+    carga nueva de la pagina es un intento nuevo y trae otra.
+
+    La seleccion entra en la clave: si el cliente vuelve atras y cambia de
+    franja, es otra reserva y no debe reutilizar la anterior.
+    """
+    if not idem_key or len(idem_key) > 64:
+        return None
+    raw = f"{idem_key}|{plan}|{service_date}|{slot}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def _hold_is_live(booking: Booking) -> bool:
+    """True si la reserva sigue pendiente y su cupo sigue apartado."""
+    return (booking.status == "pending"
+            and booking.created_at + timedelta(minutes=HOLD_MINUTES) > datetime.utcnow())
+
+
+async def _to_stripe(booking: Booking, session: AsyncSession) -> RedirectResponse:
+    """Manda a pagar una reserva ya guardada. Crea su sesion de Stripe si no tiene.
+
+    La clave de idempotencia de Stripe es la reserva: por muchas veces que se
+    llegue aqui con la misma reserva — dos peticiones a la vez incluidas —
+    Stripe crea una sola sesion y devuelve esa misma a todos.
+    """
+    if not booking.stripe_checkout_url:
+        # {CHECKOUT_SESSION_ID} lo sustituye Stripe por el id real al redirigir.
+        stripe_session = await create_booking_session(
+            amount=booking.deposit_amount,
+            description=f"{booking.plan_name} surge protector — deposit",
+            success_url=f"{settings.base_url}/booking/confirmed?session_id={{CHECKOUT_SESSION_ID}}",
+            cancel_url=f"{settings.base_url}/services/surge-protector-installation",
+            metadata={"booking_id": booking.public_id},
+            idempotency_key=f"booking-{booking.public_id}",
+        )
+        booking.stripe_session_id = stripe_session.id
+        booking.stripe_checkout_url = stripe_session.url
+        session.add(booking)
+        await session.commit()
+
+    return RedirectResponse(booking.stripe_checkout_url, status_code=303)
+
+
+async def _reuse(booking: Booking, session: AsyncSession) -> RedirectResponse | None:
+    """Respuesta para un checkout repetido, o None si hay que empezar de cero.
 
-    El encadenado con "or" evita reventar si Stripe omitiera el bloque — no
-    deberia pasar, pero un email ausente jamas puede tumbar la confirmacion de
-    un pago que ya se cobro.
+      - Pendiente con el cupo aun apartado: a la misma sesion de Stripe.
+      - Ya pagada: a la pagina de confirmacion, no a pagar otra vez.
+      - Vencida o cancelada: su cupo ya no esta apartado. Se le quita la
+        clave para que la reserva nueva pueda llevarla.
     """
-    return (obj.get("customer_details") or {}).get("email") or ""
+    if _hold_is_live(booking):
+        return await _to_stripe(booking, session)
+    if booking.status == "paid":
+        return RedirectResponse(f"/booking/confirmed?session_id={booking.stripe_session_id}",
+                                status_code=303)
+    booking.checkout_key = None
+    session.add(booking)
+    await session.commit()
+    return None
 
 
 @router.get("")
@@ -64,12 +168,39 @@ def choose_date(request: Request, plan: str = "recommended",
         "plan": p,
         "deposit": DEPOSIT,
         "balance": p["price"] - DEPOSIT,
-        "days": open_days(taken_map(session)),
+        "days": open_days(_taken(session)),
+        # Una por carga de pagina: ver _checkout_key.
+        "idem_key": secrets.token_urlsafe(16),
     })
 
 
+@router.get("/availability")
+def availability(request: Request, session: Session = Depends(get_session)):
+    """Los dias y franjas libres en JSON, con el mismo formato que open_days().
+
+    La pagina de seleccion de fecha lo consulta cada cierto rato para quitar
+    las franjas que se van llenando, sin recargar la plantilla entera.
+
+    El ETag sale de dos versiones — la de los cupos y la del calendario — y
+    NO del JSON. Asi, cuando el navegador pregunta con If-None-Match y nada
+    cambio, se contesta 304 sin llamar a open_days ni serializar nada: una
+    consulta repetida cuesta practicamente cero.
+    """
+    if occupancy.stale():
+        occupancy.reload(session)
+
+    version = f"{occupancy.version()}|{calendar_version()}"
+    etag = '"' + hashlib.sha1(version.encode()).hexdigest()[:20] + '"'
+    # "private": son cupos en vivo, ningun proxy ni Cloudflare debe guardarlos.
+    headers = validators(etag, cache_control="private, no-cache")
+    if is_fresh(request, etag):
+        return not_modified(headers)
+
+    return JSONResponse({"days": open_days(occupancy.taken())}, headers=headers)
+
+
 @router.post("/checkout")
-def start_checkout(request: Request,
+async def start_checkout(request: Request,
                    plan: str = Form(...),
                    service_date: str = Form(...),
                    slot: int = Form(...),
@@ -77,29 +208,43 @@ def start_checkout(request: Request,
                    customer_phone: str = Form(...),
                    address: str = Form(...),
                    notes: str = Form(""),
-                   session: Session = Depends(get_session)):
+                   idem_key: str = Form(""),
+                   session: AsyncSession = Depends(get_async_session)):
     """Valida, aparta el cupo y manda a pagar.
 
     El orden importa: primero validar, despues crear la reserva, y solo
     entonces ir a Stripe. Cobrar antes de validar significaria tener que
     devolver dinero cuando la fecha resulte no estar disponible.
+
+    La validacion va en dos pasos. validate_selection revisa las reglas del
+    calendario contra el indice en memoria, sin tocar la base. reserve()
+    vuelve a contar el cupo en la base, bajo cerrojo, en la misma transaccion
+    que guarda: es lo que impide que dos peticiones se lleven el ultimo equipo
+    de una franja.
+
+    Es `async def` por la llamada a Stripe: mientras se espera su respuesta
+    el worker atiende otras peticiones en vez de quedarse con un hilo parado.
+    Por eso la base va por la sesion asincrona.
+
+    Es idempotente: el mismo envio repetido (doble clic, atras y reenviar)
+    lleva a la misma reserva y la misma sesion de Stripe, sin apartar otro
+    cupo ni crear otra sesion (ver _checkout_key y _reuse).
     """
+    # Antes de validar: en un doble clic el primer envio ya aparto el cupo, y
+    # la validacion del segundo lo veria ocupado.
+    key = _checkout_key(idem_key, plan, service_date, slot)
+    if key and (existing := await get_by_checkout_key_async(session, key)):
+        if response := await _reuse(existing, session):
+            return response
+
     try:
         p = get_plan(plan)
-        day, slot = validate_selection(service_date, slot, taken_map(session))
+        day, slot = validate_selection(service_date, slot, await _taken_async(session))
     except (KeyError, ValueError):
         return RedirectResponse("/services/surge-protector-installation", status_code=303)
     except BookingUnavailable as e:
-        # El cupo se lleno o la seleccion no sirve: se vuelve a pintar el
-        # calendario ya actualizado, con el mensaje arriba.
-        return templates.TemplateResponse("booking/select_date.html", {
-            "request": request,
-            "plan": p,
-            "deposit": DEPOSIT,
-            "balance": p["price"] - DEPOSIT,
-            "days": open_days(taken_map(session)),
-            "error": str(e),
-        }, status_code=409)
+        # El cupo se lleno o la seleccion no sirve.
+        return await _unavailable(request, p, session, str(e))
 
     # La reserva nace como "pending". Desde este momento su cupo queda
     # apartado durante HOLD_MINUTES, aunque el cliente todavia no pague.
@@ -116,47 +261,52 @@ def start_checkout(request: Request,
         customer_phone=customer_phone.strip(),
         address=address.strip(),
         notes=notes.strip() or None,
+        checkout_key=key,
     )
-    session.add(booking)
-    session.commit()
-    session.refresh(booking)
-
-    # {CHECKOUT_SESSION_ID} lo sustituye Stripe por el id real al redirigir.
-    stripe_session = create_booking_session(
-        amount=DEPOSIT,
-        description=f"{p['name']} surge protector — deposit",
-        success_url=f"{settings.base_url}/booking/confirmed?session_id={{CHECKOUT_SESSION_ID}}",
-        cancel_url=f"{settings.base_url}/services/surge-protector-installation",
-        metadata={"booking_id": booking.public_id},
-    )
-
-    booking.stripe_session_id = stripe_session.id
-    session.add(booking)
-    session.commit()
-
-    return RedirectResponse(stripe_session.url, status_code=303)
+    try:
+        reserved = await reserve_async(session, booking)
+    except IntegrityError:
+        # Otra reserva ya tiene esta clave (ver abajo).
+        await session.rollback()
+        reserved = False
+    if not reserved:
+        # Otra peticion se llevo el cupo entre la validacion y este punto. Si
+        # fue un envio identico a este (dos clics casi a la vez), se usa su
+        # reserva: ya sea que lleno la franja o que choco la clave unica.
+        if key and (existing := await get_by_checkout_key_async(session, key)):
+            if response := await _reuse(existing, session):
+                return response
+        return await _unavailable(request, p, session, UNAVAILABLE)
+
+    return await _to_stripe(booking, session)
 
 
 @router.get("/confirmed")
-def confirmed(request: Request, session_id: str = "",
-              session: Session = Depends(get_session)):
+async def confirmed(request: Request, session_id: str = "",
+                    session: AsyncSession = Depends(get_async_session)):
     """Pagina de gracias. Aqui se dispara el evento de conversion.
 
     Trae un respaldo del webhook: si Stripe todavia no lo mando (o fallo),
     se le pregunta directo por el estado del pago. Sin esto, un webhook
     perdido dejaria la reserva en "pending" para siempre.
+
+    La pregunta va por session_status(): las recargas seguidas de la misma
+    pagina comparten una sola llamada a Stripe.
     """
-    booking = get_by_stripe_session(session, session_id) if session_id else None
+    booking = await get_by_stripe_session_async(session, session_id) if session_id else None
     if not booking:
         return RedirectResponse("/services/surge-protector-installation", status_code=303)
 
-    if booking.status == "pending":
+    # "expired" tambien: el cliente pudo pagar despues de que el barrido
+    # diera la reserva por abandonada (ver mark_paid).
+    if booking.status in ("pending", "expired"):
         try:
-            s = stripe.checkout.Session.retrieve(session_id)
+            s = await session_status(session_id)
+            ledger.record_stripe(s, "deposit", notes=booking.public_id)
             # mark_paid solo devuelve True si esta llamada gano la carrera
             # contra el webhook. Asi el aviso sale una vez, no dos.
-            if s.payment_status == "paid" and mark_paid(session, booking, _stripe_email(s)):
-                notify_new_booking(booking)
+            if s.payment_status == "paid" and await mark_paid_async(session, booking, stripe_email(s)):
+                await run_in_threadpool(notify_new_booking, booking)
         except stripe.error.StripeError:
             pass  # el webhook lo resolvera
 
@@ -167,8 +317,33 @@ def confirmed(request: Request, session_id: str = "",
     })
 
 
+@router.get("/status/{public_id}")
+def status(public_id: str, request: Request, session: Session = Depends(get_session)):
+    """Estado de una reserva en JSON: {"status": "pending"}.
+
+    Lo sondea la pagina de confirmacion mientras espera al webhook. Antes la
+    unica forma de ver el cambio era recargar la pagina entera, que vuelve a
+    renderizar y a preguntarle a Stripe. Esto lee una columna de la base y
+    nada mas: NUNCA llama a Stripe. Si el webhook no llega, la recarga de
+    /booking/confirmed sigue siendo el respaldo.
+
+    El ETag es el propio estado, asi que mientras siga igual cada sondeo se
+    contesta 304. El public_id no se puede adivinar (ver Booking), por eso no
+    hace falta mas proteccion para exponer solo el estado.
+    """
+    current = get_status(session, public_id)
+    if current is None:
+        raise HTTPException(status_code=404)
+
+    etag = f'"{current}"'
+    headers = validators(etag, cache_control="private, no-cache")
+    if is_fresh(request, etag):
+        return not_modified(headers)
+    return JSONResponse({"status": current}, headers=headers)
+
+
 @router.post("/webhook")
-async def webhook(request: Request, session: Session = Depends(get_session)):
+async def webhook(request: Request, session: AsyncSession = Depends(get_async_session)):
     """Confirmacion de pago del lado de Stripe.
 
     Es la fuente autoritativa: llega aunque el cliente cierre el navegador
@@ -176,6 +351,12 @@ async def webhook(request: Request, session: Session = Depends(get_session)):
 
     La firma se verifica siempre. Sin eso, cualquiera podria mandar un POST
     falso a esta URL y marcar reservas como pagadas sin pagar.
+
+    Aqui solo se verifica y se guarda el evento en la bandeja de entrada; el
+    trabajo de verdad (marcar pagada, avisar al dueno) lo hace
+    core/webhooks.py en segundo plano. Asi Stripe recibe su 200 enseguida,
+    aunque el correo tarde: antes, un SMTP lento retrasaba la respuesta y
+    Stripe reenviaba el webhook.
     """
     payload = await request.body()
     sig = request.headers.get("stripe-signature", "")
@@ -187,10 +368,6 @@ async def webhook(request: Request, session: Session = Depends(get_session)):
     except (ValueError, stripe.error.SignatureVerificationError):
         return {"ok": False}
 
-    if event["type"] == "checkout.session.completed":
-        data = event["data"]["object"]
-        booking = get_by_stripe_session(session, data["id"])
-        if booking and mark_paid(session, booking, _stripe_email(data)):
-            notify_new_booking(booking)
-
-    return {"ok": True}
\ No newline at end of file
+    await enqueue_async(session, "booking", event["id"], event["type"], payload.decode())
+    wake_inbox()
+    return {"ok": True}
@@ -1,24 +1,35 @@
-import os
-import uuid
 from pathlib import Path
 from typing import List
 
 from fastapi import APIRouter, Depends, Request, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import HTMLResponse
-from sqlmodel import Session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from core.utils import get_lang
 from core.i18n import t
 from core.config import settings
 from core.emailer import send_owner_email
+from core.images import UPLOAD_ROOT, wake_images
 from core.templating import templates
-from db.session import get_session
+from core.uploads import UploadTooLarge, discard_new, save_upload
+from db.session import get_async_session
 from db.models import EstimateRequest, EstimatePhoto
 
 router = APIRouter(prefix="/estimate", tags=["estimate"])
 
 ALLOWED_EXT = {".jpg", ".jpeg", ".png", ".webp"}
-UPLOAD_ROOT = Path("static/uploads/estimates")
+# Misma foto, misma extension: si no, foto.jpg y foto.jpeg serian dos archivos.
+SAME_EXT = {".jpeg": ".jpg"}
+MAX_PHOTOS = 5
+MAX_PHOTO_BYTES = settings.max_upload_mb * 1024 * 1024
+
+# Tope de la peticion entera (lo aplica core/uploads.BodySizeLimit desde
+# main.py): todas las fotos al maximo mas 1 MB para el resto del formulario.
+MAX_REQUEST_BYTES = MAX_PHOTOS * MAX_PHOTO_BYTES + 1024 * 1024
+
+TOO_LARGE = f"One of the photos is larger than {settings.max_upload_mb}MB."
 
 
 def _safe_filename(name: str) -> str:
@@ -29,8 +40,8 @@ def _safe_filename(name: str) -> str:
 
 
 def _check_upload_rules(files: List[UploadFile]) -> str | None:
-    if len(files) > 5:
-        return "You can upload up to 5 photos."
+    if len(files) > MAX_PHOTOS:
+        return f"You can upload up to {MAX_PHOTOS} photos."
 
     for f in files:
         ext = Path(f.filename or "").suffix.lower()
@@ -39,7 +50,7 @@ def _check_upload_rules(files: List[UploadFile]) -> str | None:
     return None
 
 
-def _render_form(request: Request, error: str = ""):
+def _render_form(request: Request, error: str = "", status_code: int = 400):
     """Pinta el formulario. Con `error`, lo muestra arriba y responde 400.
 
     Existe porque este mismo bloque estaba copiado cuatro veces; la proxima
@@ -55,10 +66,15 @@ def _render_form(request: Request, error: str = ""):
             "app_name": settings.app_name,
             "error": error,
         },
-        status_code=400 if error else 200,
+        status_code=status_code if error else 200,
     )
 
 
+def too_large(request: Request):
+    """Respuesta de BodySizeLimit: el formulario con el error, 413."""
+    return _render_form(request, TOO_LARGE, status_code=413)
+
+
 def _success(request: Request, estimate_id=None):
     """Pagina de gracias. Sin estimate_id no muestra numero de referencia."""
     lang = get_lang(request)
@@ -104,7 +120,9 @@ def estimate_form(request: Request):
 @router.post("", response_class=HTMLResponse)
 async def submit_estimate(
     request: Request,
-    session: Session = Depends(get_session),
+    # Sesion asincrona: esta ruta es `async def` y una consulta sincrona aqui
+    # frenaria el event loop de todo el servidor (ver db/session.py).
+    session: AsyncSession = Depends(get_async_session),
 
     name: str = Form(...),
     phone: str = Form(...),
@@ -145,60 +163,69 @@ async def submit_estimate(
     if err:
         return _render_form(request, err)
 
-    # Guardar solicitud
-    est = EstimateRequest(
-        name=name,
-        phone=phone,
-        email=email.strip() or None,
-        address=address.strip() or None,
-        zip_code=zip_code.strip() or None,
-        job_type=job_type,
-        description=description,
-        urgency=urgency,
-        contact_preference=contact_preference,
-    )
-    session.add(est)
-    session.commit()
-    session.refresh(est)
-
-    # Guardar fotos
-    UPLOAD_ROOT.mkdir(parents=True, exist_ok=True)
-    saved_paths = []
-
-    for f in photos:
-        if not f.filename:
-            continue
-        ext = Path(f.filename).suffix.lower()
-        unique = f"{est.id}_{uuid.uuid4().hex}{ext}"
-        disk_path = UPLOAD_ROOT / unique
-
-        # Guardado streaming (no cargar todo en memoria)
-        with open(disk_path, "wb") as out:
-            while True:
-                chunk = await f.read(1024 * 1024)
-                if not chunk:
-                    break
-                # Límite simple por tamaño total (aprox): MAX_UPLOAD_MB
-                if out.tell() > settings.max_upload_mb * 1024 * 1024:
-                    # Si excede, borramos y no guardamos
-                    out.close()
-                    try:
-                        os.remove(disk_path)
-                    except Exception:
-                        pass
-                    return _render_form(
-                        request,
-                        f"One of the photos is larger than {settings.max_upload_mb}MB.",
-                    )
-                out.write(chunk)
-
-        rel_path = f"/static/uploads/estimates/{unique}"
-        session.add(EstimatePhoto(estimate_id=est.id, file_path=rel_path, original_name=_safe_filename(f.filename)))
-        saved_paths.append(rel_path)
-
-    session.commit()
-
-    # Aviso al dueño (no rompe si no hay SMTP configurado)
-    _notify_owner(est, len(saved_paths))
+    photos = [f for f in photos if f.filename]
+    if any(f.size is not None and f.size > MAX_PHOTO_BYTES for f in photos):
+        return _render_form(request, TOO_LARGE)
+
+    # Primero las fotos, despues la base. save_upload escribe en un hilo,
+    # corta al pasar el limite, renombra al final y nombra el archivo por su
+    # contenido: la misma foto reenviada no ocupa disco otra vez. Copiar
+    # varias fotos grandes lleva su tiempo, y con la transaccion ya abierta
+    # SQLite tendria la base entera bloqueada mientras tanto: reserve() y los
+    # pagos esperarian a una subida lenta.
+    written = []
+    try:
+        for f in photos:
+            ext = Path(f.filename).suffix.lower()
+            written.append(await save_upload(f, UPLOAD_ROOT, SAME_EXT.get(ext, ext), MAX_PHOTO_BYTES))
+
+        est = EstimateRequest(
+            name=name,
+            phone=phone,
+            email=email.strip() or None,
+            address=address.strip() or None,
+            zip_code=zip_code.strip() or None,
+            job_type=job_type,
+            description=description,
+            urgency=urgency,
+            contact_preference=contact_preference,
+        )
+        # flush() para tener el id de las fotos; el commit va justo detras,
+        # con las fotos ya en disco: la transaccion dura lo que los INSERT.
+        session.add(est)
+        await session.flush()
+        for f, (disk_path, digest, _) in zip(photos, written):
+            session.add(EstimatePhoto(estimate_id=est.id, file_path="/" + disk_path.as_posix(),
+                                      sha256=digest, original_name=_safe_filename(f.filename)))
+        await session.commit()
+    except Exception as e:
+        # Sin fila. Se borran los archivos que escribio esta peticion y que
+        # nadie mas usa (core/uploads.discard_new); uno que ya estaba puede
+        # ser de otra peticion con la misma foto.
+        #
+        # Exception y no BaseException: si la peticion se cancela (el cliente
+        # corto), esperar aqui a la base retrasaria la cancelacion. La
+        # transaccion sin confirmar se deshace igual al cerrarse la sesion, y
+        # lo que quede en disco se lo lleva core/images.collect_orphan_photos.
+        await session.rollback()
+        if written:
+            digests = [digest for _, digest, _ in written]
+            used = set((await session.exec(
+                select(EstimatePhoto.sha256).where(EstimatePhoto.sha256.in_(digests))
+            )).all())
+            await run_in_threadpool(discard_new, written, used)
+        if isinstance(e, UploadTooLarge):
+            return _render_form(request, TOO_LARGE)
+        raise
+
+    # Preview y miniatura en segundo plano (core/images.py): la respuesta no
+    # los espera.
+    if written:
+        wake_images()
+
+    # Aviso al dueño (no rompe si no hay SMTP configurado). Solo deja el
+    # correo en la cola (core/emailer.py), pero eso es una escritura con la
+    # sesion sincrona: va a un hilo para no frenar el event loop.
+    await run_in_threadpool(_notify_owner, est, len(written))
 
     return _success(request, est.id)
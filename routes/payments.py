@@ -1,12 +1,16 @@
 import stripe
-from fastapi import APIRouter, Request, Form, Header, HTTPException
+from fastapi import APIRouter, Depends, Request, Form, Header, HTTPException
 from fastapi.responses import RedirectResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from core.config import settings
 from core.utils import get_lang
 from core.i18n import t
 from core.templating import templates
 from core.checkout import create_stripe_session
+from core.webhooks import wake_inbox
+from db.inbox import enqueue_async
+from db.session import get_async_session
 
 router = APIRouter(prefix="/payments", tags=["payments"])
 
@@ -40,7 +44,7 @@ def pay_page(request: Request):
 
 
 @router.post("/checkout")
-def create_checkout(request: Request, amount: float = Form(...), description: str = Form("")):
+async def create_checkout(request: Request, amount: float = Form(...), description: str = Form("")):
     """
     Crea una sesión de pago en Stripe Checkout.
     
@@ -48,7 +52,7 @@ def create_checkout(request: Request, amount: float = Form(...), description: st
     # Validación mínima
     
     try:
-        session_url = create_stripe_session(amount, description)
+        session_url = await create_stripe_session(amount, description)
         return RedirectResponse(session_url, status_code=303)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -78,10 +82,13 @@ def payment_cancel(request: Request):
 
 
 @router.post("/webhook")
-async def stripe_webhook(request: Request, stripe_signature: str = Header(None)):
+async def stripe_webhook(request: Request, stripe_signature: str = Header(None),
+                         session: AsyncSession = Depends(get_async_session)):
     """
     Webhook para confirmar pagos.
-    OJO: usa settings.stripe_webhook_secret (minúsculas, según tu config.py).
+
+    Igual que el de reservas: verifica la firma, guarda el evento en la bandeja
+    de entrada y responde. Lo procesa core/webhooks.py en segundo plano.
     """
     payload = await request.body()
 
@@ -94,22 +101,18 @@ async def stripe_webhook(request: Request, stripe_signature: str = Header(None))
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid webhook")
 
-    if event["type"] == "checkout.session.completed":
-        session = event["data"]["object"]
-        print("Payment received:", session.get("amount_total"))
-
-        # TODO: Guardar en SQLite si quieres
-
+    await enqueue_async(session, "payments", event["id"], event["type"], payload.decode())
+    wake_inbox()
     return {"status": "ok"}
 
 
 @router.post("/link")
-def create_shareable_link(request: Request, amount: float = Form(...), description: str = Form("")):
+async def create_shareable_link(request: Request, amount: float = Form(...), description: str = Form("")):
     """
     Genera un link compartible (Stripe Checkout Session URL).
     """
     try:
-        session_url = create_stripe_session(amount, description)
+        session_url = await create_stripe_session(amount, description)
         return RedirectResponse(f"/payments/?link={session_url}", status_code=303)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
@@ -3,12 +3,24 @@ Archivos para rastreadores: robots.txt y sitemap.xml.
 
 Las paginas de servicio NO viven aqui — estan en routes/services.py.
 Este archivo solo genera los dos archivos que leen los bots.
+
+El sitemap se genera una vez por cambio del blog, no por visita: los bots lo
+piden seguido y casi nunca cambia. Queda en memoria ya comprimido en gzip,
+con su ETag y su Last-Modified, y un bot que ya lo tiene recibe un 304 sin
+cuerpo. Si algun dia pasa de los limites del protocolo (SITEMAP_MAX_URLS
+URLs o SITEMAP_MAX_BYTES por archivo), /sitemap.xml pasa a ser un indice
+que apunta a /sitemap-1.xml, /sitemap-2.xml, ... sin tocar robots.txt.
 """
 
-from fastapi import APIRouter, Response
+import gzip
+import hashlib
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, HTTPException, Request, Response
 
 from core.config import settings
-from core.posts import load_posts
+from core.http_cache import is_fresh, not_modified, validators
+from core.posts import index_modified, load_posts
 
 router = APIRouter(tags=["seo"])
 
@@ -46,8 +58,92 @@ Sitemap: {settings.base_url}/sitemap.xml
     return Response(content=txt, media_type="text/plain")
 
 
+# Limites de sitemaps.org por archivo. Los bytes con margen para la cabecera
+# y el cierre del <urlset>.
+SITEMAP_MAX_URLS = 50_000
+SITEMAP_MAX_BYTES = 50 * 1024 * 1024 - 1024
+
+_URLSET = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n{}\n</urlset>\n')
+_INDEX = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+          '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n{}\n</sitemapindex>\n')
+
+# Las paginas fijas cambian con cada deploy, que reinicia el proceso: el
+# Last-Modified nunca es anterior al arranque.
+_STARTED = datetime.now(timezone.utc).replace(microsecond=0)
+
+# (la lista de posts de la que salio, {nombre: (xml, xml.gz, cabeceras, fecha)})
+_sitemaps: tuple[list | None, dict[str, tuple]] = (None, {})
+
+
+def _chunks(entries: list[str]) -> list[list[str]]:
+    """Parte las entradas en grupos que quepan en un archivo cada uno."""
+    chunks, current, size = [], [], 0
+    for entry in entries:
+        n = len(entry.encode()) + 1                     # + el salto de linea
+        if current and (len(current) >= SITEMAP_MAX_URLS or size + n > SITEMAP_MAX_BYTES):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(entry)
+        size += n
+    return chunks + [current]
+
+
+def _build(posts: list[dict]) -> dict[str, tuple]:
+    """Todos los archivos del sitemap: "sitemap.xml" y, si hace falta partir,
+    "sitemap-1.xml"... con su cuerpo, cuerpo gzip y cabeceras de cache."""
+    entries = [_url(p) for p in _STATIC_PATHS]
+    entries += [_url(f"/blog/{p['slug']}", p.get("published_at", ""))
+                for p in posts]
+
+    chunks = _chunks(entries)
+    if len(chunks) == 1:
+        files = {"sitemap.xml": _URLSET.format("\n".join(chunks[0]))}
+    else:
+        files = {f"sitemap-{n}.xml": _URLSET.format("\n".join(chunk))
+                 for n, chunk in enumerate(chunks, 1)}
+        files["sitemap.xml"] = _INDEX.format("\n".join(
+            f"<sitemap><loc>{settings.base_url}/{name}</loc></sitemap>" for name in files))
+
+    modified = max(filter(None, [_STARTED, index_modified()]))
+    out = {}
+    for name, xml in files.items():
+        body = xml.encode()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:20]}"'
+        out[name] = (body, gzip.compress(body, 9, mtime=0), validators(etag, modified), modified)
+    return out
+
+
+def _sitemap_file(request: Request, name: str) -> Response:
+    """Sirve un archivo del sitemap desde la cache, con 304 y gzip.
+
+    La cache se rehace solo cuando cambia la lista de posts: load_posts()
+    devuelve la misma lista mientras data/blog_posts.json no cambie
+    (core/posts.py), asi que comparar la identidad basta.
+    """
+    global _sitemaps
+    posts = load_posts()
+    if _sitemaps[0] is not posts:
+        _sitemaps = (posts, _build(posts))
+
+    page = _sitemaps[1].get(name)
+    if page is None:
+        raise HTTPException(status_code=404)
+    body, gz, headers, modified = page
+
+    headers = {**headers, "Vary": "Accept-Encoding"}
+    if is_fresh(request, headers["ETag"], modified):
+        return not_modified(headers)
+    # Ya comprimido: GZipMiddleware no vuelve a comprimir una respuesta que
+    # trae Content-Encoding.
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body = gz
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/xml", headers=headers)
+
+
 @router.get("/sitemap.xml")
-def sitemap():
+def sitemap(request: Request):
     """Sitemap del sitio: paginas fijas + posts del blog.
 
     Las paginas fijas no llevan <lastmod>: no guardamos cuando cambiaron, y
@@ -57,12 +153,17 @@ def sitemap():
 
     Las URLs retiradas (panel-upgrade, electrical-installations) responden 301
     y por eso no se ofrecen aqui como destino.
+
+    Con mas URLs de las que caben en un archivo, es el indice de los
+    sitemap-N.xml (ver arriba).
     """
-    entries = [_url(p) for p in _STATIC_PATHS]
-    entries += [_url(f"/blog/{p['slug']}", p.get("published_at", ""))
-                for p in load_posts()]
+    return _sitemap_file(request, "sitemap.xml")
+
+
+@router.get("/sitemap-{n}.xml")
+def sitemap_part(request: Request, n: str):
+    """Una parte del sitemap cuando esta partido. 404 si no existe.
 
-    xml = ('<?xml version="1.0" encoding="UTF-8"?>\n'
-           '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
-           + "\n".join(entries) + "\n</urlset>\n")
-    return Response(content=xml, media_type="application/xml")
+    `n` como texto: un numero mal escrito es un 404 como cualquier otra parte
+    que no existe, no un 422 de validacion."""
+    return _sitemap_file(request, f"sitemap-{n}.xml")
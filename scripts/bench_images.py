@@ -0,0 +1,101 @@
+"""Benchmark de core/images.make_variants: tiempo y memoria por foto.
+
+    python scripts/bench_images.py
+    python scripts/bench_images.py --photo ruta/a/una/foto.jpg --runs 10
+
+Sin --photo genera una foto como las de un telefono: 4032x3024 (12 MP), JPEG
+de calidad 92, guardada de lado con la rotacion en el EXIF y con GPS.
+
+Cada pasada corre en un proceso "spawn" nuevo, como el pool de la app, y
+mide dos casos:
+
+  - draft:  lo que hace make_variants, con el decodificador JPEG entregando
+            la imagen ya reducida.
+  - entera: la misma funcion con draft() desactivado, decodificando los
+            12 MP completos.
+
+Imprime la mediana de segundos por foto y el pico de memoria del proceso, y
+al final revisa el resultado: tamanos, peso, y que no quede EXIF.
+"""
+
+import argparse
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw  # noqa: E402
+from PIL.JpegImagePlugin import JpegImageFile  # noqa: E402
+
+from core.images import make_variants  # noqa: E402
+
+
+def phone_photo(path: Path) -> None:
+    rng = random.Random(1)
+    img = Image.new("RGB", (4032, 3024))
+    draw = ImageDraw.Draw(img)
+    for _ in range(3000):
+        x, y = rng.randint(0, 3900), rng.randint(0, 2900)
+        draw.ellipse([x, y, x + rng.randint(5, 400), y + rng.randint(5, 400)],
+                     fill=(rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)))
+    exif = Image.Exif()
+    exif[0x0112] = 6                       # orientacion: girada 90 grados
+    exif[0x8825] = {2: (28.0, 32.0, 0.0)}  # GPS
+    img.save(path, "JPEG", quality=92, exif=exif)
+
+
+def _baseline() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run(src: str, preview: str, thumb: str, draft: bool) -> dict:
+    """Corre en el proceso hijo."""
+    if not draft:
+        # JpegImageFile tiene su propio draft(): parchear el de Image no basta.
+        JpegImageFile.draft = lambda self, mode, size: None
+    return make_variants(src, preview, thumb)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--photo", help="foto a usar (por defecto, una generada)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    out = Path(tempfile.mkdtemp())
+    src = Path(args.photo) if args.photo else out / "photo.jpg"
+    if not args.photo:
+        phone_photo(src)
+    with Image.open(src) as img:
+        print(f"original {img.width}x{img.height}, {src.stat().st_size / 1e6:.1f} MB")
+
+    preview, thumb = out / "p.webp", out / "t.webp"
+    for name, draft in (("draft", True), ("full decode", False)):
+        seconds, peaks, bases = [], [], []
+        for _ in range(args.runs):
+            # Un proceso nuevo por pasada: el pico de memoria es el de UNA foto.
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                base = pool.submit(_baseline).result()
+                r = pool.submit(_run, str(src), str(preview), str(thumb), draft).result()
+            seconds.append(r["seconds"])
+            peaks.append(r["max_rss_mb"])
+            bases.append(base)
+        print(f"  {name:12} {statistics.median(seconds) * 1000:6.0f} ms/photo (median of "
+              f"{args.runs}), worker peak RSS {statistics.median(peaks):.0f} MB "
+              f"(idle {statistics.median(bases):.0f} MB)")
+
+    for path in (preview, thumb):
+        with Image.open(path) as img:
+            print(f"  {path.stem:7} {img.width}x{img.height}, {os.path.getsize(path) / 1e3:.0f} KB, "
+                  f"EXIF tags: {len(img.getexif())}")
+
+
+if __name__ == "__main__":
+    main()
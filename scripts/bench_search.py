@@ -0,0 +1,127 @@
+"""Benchmark de core/search.py sobre un blog sintetico de miles de posts.
+
+    python scripts/bench_search.py                # 5000 posts
+    python scripts/bench_search.py --posts 20000
+
+Genera el corpus en una carpeta temporal (indice JSON + un .md por post, de
+400 a 1200 palabras, un tercio en espanol) y apunta core.posts y core.search
+a ella. Mide:
+
+  - la construccion inicial del indice y lo que ocupa en memoria;
+  - refresh() sin cambios (solo stat()) y despues de editar un post;
+  - p50 y p99 de una serie de consultas, frecuentes y raras;
+  - que el top del algoritmo de umbral sea exactamente el de sumar todos
+    los puntajes, en consultas al azar.
+"""
+
+import argparse
+import json
+import random
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import core.posts as posts  # noqa: E402
+import core.search as search  # noqa: E402
+
+EN = ("panel upgrade breaker outlet wiring lighting charger surge protector electrician "
+      "orlando kissimmee inspection permit circuit voltage ground fault install installation "
+      "repair replacing flickering tripping generator ceiling fan switch dimmer smoke detector "
+      "code safety home kitchen bathroom garage pool hurricane storm").split()
+ES = ("tablero instalacion electricista cargador reparacion cableado iluminacion interruptor "
+      "enchufe tormenta huracan seguridad inspeccion permiso voltaje circuito cocina garaje "
+      "piscina generador ventilador detector humo codigo casa hogar").split()
+# Relleno con frecuencias de Zipf: unas pocas palabras muy comunes y una cola
+# larga, como en texto real.
+FILLER = [f"w{i}" for i in range(20_000)]
+
+QUERIES = ["panel upgrade", "surge protector orlando", "cargador electrico",
+           "flickering lights kitchen", "generator hurricane", "tablero",
+           "permit inspection code", "w3 w17", "instalación de cargador"]
+
+
+def make_corpus(root: Path, n: int) -> None:
+    rng = random.Random(7)
+    (root / "posts").mkdir(parents=True)
+    index = []
+    for i in range(n):
+        vocab = ES if i % 3 == 0 else EN
+        words = [rng.choice(vocab) if rng.random() < 0.3
+                 else FILLER[int(rng.paretovariate(1.1)) % len(FILLER)]
+                 for _ in range(rng.randint(400, 1200))]
+        (root / "posts" / f"p{i}.md").write_text(f"# {' '.join(words[:8])}\n\n{' '.join(words)}")
+        index.append({"slug": f"p{i}", "file": f"p{i}.md",
+                      "title": " ".join(rng.sample(vocab, 5)),
+                      "excerpt": " ".join(rng.sample(vocab, 10))})
+    (root / "blog_posts.json").write_text(json.dumps(index))
+
+
+def ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+def brute_force(index: search.SearchIndex, query: str, limit: int) -> list[float]:
+    totals: dict[str, float] = {}
+    for term in set(search.tokenize(query)):
+        ranking = index._ranking(term)
+        for slug, score in (ranking[0].items() if ranking else ()):
+            totals[slug] = totals.get(slug, 0.0) + score
+    return sorted((round(v, 9) for v in totals.values()), reverse=True)[:limit]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=200, help="veces que se mide cada consulta")
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp())
+    make_corpus(root, args.posts)
+    posts._PATH = root / "blog_posts.json"
+    search.POSTS_DIR = root / "posts"
+
+    index = search.SearchIndex()
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    built = index.refresh()
+    build_ms = ms(started)
+    grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024
+    print(f"{built} posts, {sum(index._lens.values()) / 1e6:.1f}M terms, "
+          f"{len(index._postings)} distinct: built in {build_ms / 1000:.2f} s, ~{grown:.0f} MB")
+
+    started = time.perf_counter()
+    index.refresh()
+    print(f"refresh, nothing changed: {ms(started):.1f} ms")
+    edited = root / "posts" / "p42.md"
+    edited.write_text(edited.read_text() + " tormenta nueva")
+    started = time.perf_counter()
+    changed = index.refresh()
+    print(f"refresh, one post edited: {ms(started):.1f} ms ({changed} reindexed)")
+
+    for query in QUERIES:
+        index.search(query)                    # la primera arma las listas del termino
+        times = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            index.search(query)
+            times.append(ms(started))
+        times.sort()
+        print(f"  {query!r:28} p50 {times[len(times) // 2]:.3f} ms  "
+              f"p99 {times[int(len(times) * 0.99) - 1]:.3f} ms")
+
+    rng = random.Random(3)
+    terms = EN[:20] + ES[:10] + FILLER[:50]
+    wrong = 0
+    for _ in range(300):
+        query = " ".join(rng.sample(terms, rng.randint(1, 4)))
+        got = [round(score, 9) for _, score in index.search(query)]
+        wrong += got != brute_force(index, query, 10)
+    print(f"threshold top-10 vs full sum: {wrong} mismatches in 300 random queries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Benchmark de db.booking.taken_map: antes y despues de llevarlo a SQL.
+
+    python scripts/bench_taken_map.py            # 100k reservas
+    python scripts/bench_taken_map.py --rows 500000
+
+Llena un SQLite temporal con `--rows` reservas, casi todas historicas (de los
+ultimos cuatro anos) y unas pocas dentro del horizonte, y mide:
+
+  - antes: la version vieja, que traia TODAS las reservas pagadas o
+    pendientes y descartaba en Python las pendientes vencidas y el pasado.
+  - despues: taken_map(), un GROUP BY acotado a hoy..HORIZON_DAYS sobre el
+    indice (status, service_date, slot).
+
+Antes de medir comprueba que las dos devuelvan lo mismo para el horizonte.
+Nunca toca voltvista.db.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+os.environ["DATABASE_URL"] = f"sqlite:///{Path(tempfile.mkdtemp()) / 'bench.db'}"
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import insert  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+from core.booking import HOLD_MINUTES, HORIZON_DAYS  # noqa: E402
+from db.booking import taken_map  # noqa: E402
+from db.models import Booking  # noqa: E402
+from db.session import engine, init_db  # noqa: E402
+
+
+def taken_map_before(session: Session) -> dict:
+    """La version anterior: filas crudas de toda la historia, filtro en Python."""
+    cutoff = datetime.utcnow() - timedelta(minutes=HOLD_MINUTES)
+    rows = session.exec(
+        select(Booking.service_date, Booking.slot, Booking.status, Booking.created_at)
+        .where(Booking.status.in_(("paid", "pending")))
+    ).all()
+    out: dict = {}
+    for service_date, slot, status, created_at in rows:
+        if status == "pending" and created_at < cutoff:
+            continue
+        day = out.setdefault(service_date.isoformat(), {})
+        day[slot] = day.get(slot, 0) + 1
+    return out
+
+
+def fill(rows: int, upcoming: int) -> None:
+    rng = random.Random(2)
+    today, now = date.today(), datetime.utcnow()
+    batch = []
+    for i in range(rows):
+        if i < rows - upcoming:
+            day = today - timedelta(days=rng.randint(1, 1500))
+        else:
+            day = today + timedelta(days=rng.randint(0, HORIZON_DAYS))
+        batch.append(dict(
+            public_id=f"b{i}", plan_key="basic", plan_name="Essential", plan_price=299,
+            deposit_amount=50, balance_due=249, service_date=day, slot=rng.randint(1, 5),
+            customer_name="x", customer_phone="1", address="a", customer_email="",
+            status=rng.choice(("paid", "pending", "cancelled", "expired")),
+            created_at=now - timedelta(minutes=rng.randint(0, 600)),
+        ))
+        if len(batch) == 10_000:
+            with engine.begin() as conn:
+                conn.execute(insert(Booking), batch)
+            batch = []
+    if batch:
+        with engine.begin() as conn:
+            conn.execute(insert(Booking), batch)
+
+
+def measure(fn, session: Session, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn(session)
+    return (time.perf_counter() - started) / calls * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--upcoming", type=int, default=100,
+                        help="cuantas de las reservas caen dentro del horizonte")
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    init_db()
+    fill(args.rows, args.upcoming)
+
+    today = date.today().isoformat()
+    with Session(engine) as session:
+        before = {d: v for d, v in taken_map_before(session).items() if d >= today}
+        assert before == taken_map(session), "the two versions disagree"
+
+        print(f"{args.rows} bookings, {args.upcoming} inside the {HORIZON_DAYS}-day horizon")
+        for name, fn in (("before", taken_map_before), ("after", taken_map)):
+            print(f"  {name:7} {measure(fn, session, args.calls):8.2f} ms/call")
+
+
+if __name__ == "__main__":
+    main()
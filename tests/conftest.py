@@ -0,0 +1,76 @@
+"""Configuracion comun de las pruebas.
+
+    python -m pytest
+
+Las pruebas nunca tocan voltvista.db, la base de Railway, Stripe ni el
+correo de verdad. Todo se configura por variables de entorno ANTES de
+importar nada de la app, porque core/config.py las lee al importarse y
+db/session.py crea los motores en ese momento:
+
+  - DATABASE_URL      un SQLite temporal
+  - STRIPE_API_BASE   el doble de tests/stripe_stub.py (fixture stripe_stub)
+  - SMTP_*            un puerto libre donde tests/test_outbox.py levanta su
+                      servidor SMTP local
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+STRIPE_PORT = _free_port()
+SMTP_PORT = _free_port()
+
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{Path(tempfile.mkdtemp()) / 'test.db'}",
+    STRIPE_API_BASE=f"http://127.0.0.1:{STRIPE_PORT}",
+    STRIPE_SECRET_KEY="sk_test_stub",
+    STRIPE_MAX_CONCURRENCY="4",
+    SMTP_HOST="127.0.0.1",
+    SMTP_PORT=str(SMTP_PORT),
+    SMTP_USER="site@voltvista.test",
+    SMTP_PASS="secret",
+    EMAIL_TO_OWNER="owner@voltvista.test",
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="session")
+def db():
+    """Crea las tablas una vez y devuelve el motor sincrono."""
+    from db.session import engine, init_db
+
+    init_db()
+    return engine
+
+
+@pytest.fixture(scope="session")
+def stripe_stub(db):
+    """Levanta tests/stripe_stub.py en STRIPE_PORT y devuelve el modulo."""
+    import uvicorn
+
+    import stripe_stub
+
+    server = uvicorn.Server(uvicorn.Config(stripe_stub.app, host="127.0.0.1",
+                                           port=STRIPE_PORT, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        assert time.monotonic() < deadline, "the Stripe stub did not start"
+        time.sleep(0.01)
+    yield stripe_stub
+    server.should_exit = True
+    thread.join(5)
@@ -0,0 +1,96 @@
+"""Doble local de la API de Stripe, solo lo que usa la app.
+
+    POST /v1/checkout/sessions        crear (respeta Idempotency-Key)
+    GET  /v1/checkout/sessions/{id}   consultar
+    GET  /v1/checkout/sessions        listar, de la mas nueva a la mas vieja,
+                                      con limit, starting_after y status
+
+core/checkout.py le habla a traves de STRIPE_API_BASE (tests/conftest.py).
+Las pruebas cambian y miran el estado directamente: pay() marca una sesion
+como pagada y STATS cuenta llamadas y cuantas hubo en vuelo a la vez.
+"""
+
+import asyncio
+import itertools
+import time
+
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse
+
+# Lo que tarda cada respuesta: da tiempo a que se junten llamadas en vuelo.
+DELAY = 0.02
+
+app = FastAPI()
+SESSIONS: dict[str, dict] = {}
+STATS = {"create": 0, "retrieve": 0, "list": 0, "inflight": 0, "max_inflight": 0}
+
+_ids = itertools.count(1)
+_idempotent: dict[str, dict] = {}
+
+
+def reset_stats() -> None:
+    for key in STATS:
+        STATS[key] = 0
+
+
+def pay(session_id: str, email: str = "customer@example.com") -> dict:
+    SESSIONS[session_id].update(payment_status="paid", status="complete",
+                                customer_details={"email": email})
+    return SESSIONS[session_id]
+
+
+async def _slow() -> None:
+    STATS["inflight"] += 1
+    STATS["max_inflight"] = max(STATS["max_inflight"], STATS["inflight"])
+    try:
+        await asyncio.sleep(DELAY)
+    finally:
+        STATS["inflight"] -= 1
+
+
+@app.post("/v1/checkout/sessions")
+async def create(request: Request, idempotency_key: str | None = Header(None)):
+    STATS["create"] += 1
+    await _slow()
+    if idempotency_key in _idempotent:
+        return _idempotent[idempotency_key]
+    form = await request.form()
+    n = next(_ids)
+    session = {
+        "id": f"cs_test_{n}", "object": "checkout.session",
+        "url": f"https://checkout.stripe.test/c/{n}",
+        "status": "open", "payment_status": "unpaid", "created": int(time.time()),
+        "amount_total": 5000, "currency": "usd", "payment_intent": f"pi_test_{n}",
+        "customer_details": None,
+        "metadata": {k[len("metadata["):-1]: v for k, v in form.items() if k.startswith("metadata[")},
+    }
+    SESSIONS[session["id"]] = session
+    if idempotency_key:
+        _idempotent[idempotency_key] = session
+    return session
+
+
+@app.get("/v1/checkout/sessions/{session_id}")
+async def retrieve(session_id: str):
+    STATS["retrieve"] += 1
+    await _slow()
+    if session_id not in SESSIONS:
+        return JSONResponse({"error": {"type": "invalid_request_error",
+                                       "message": f"No such checkout.session: {session_id}"}},
+                            status_code=404)
+    return SESSIONS[session_id]
+
+
+@app.get("/v1/checkout/sessions")
+async def list_sessions(request: Request):
+    STATS["list"] += 1
+    q = request.query_params
+    limit = int(q.get("limit", 10))
+    items = sorted(SESSIONS.values(), key=lambda s: -int(s["id"].rsplit("_", 1)[1]))
+    if q.get("status"):
+        items = [s for s in items if s["status"] == q["status"]]
+    if q.get("starting_after"):
+        ids = [s["id"] for s in items]
+        items = items[ids.index(q["starting_after"]) + 1:]
+    return {"object": "list", "url": "/v1/checkout/sessions",
+            "data": items[:limit], "has_more": len(items) > limit}
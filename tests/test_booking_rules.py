@@ -0,0 +1,86 @@
+"""open_days y validate_selection tienen que decir lo mismo, siempre.
+
+Las dos usan las mismas reglas (_day_is_open, _slot_is_open), pero por
+caminos distintos: una recorre el esqueleto cacheado del horizonte, la otra
+evalua un solo par. Aqui se comprueba exhaustivamente: para cada "ahora" de
+una lista (horas sueltas, el borde exacto de las 24 h, los cambios de
+horario), con feriados y cupos ocupados al azar, CADA dia desde antes de hoy
+hasta despues del horizonte y CADA franja (mas dos que no existen) se acepta
+en validate_selection si y solo si open_days la ofrece.
+"""
+
+import json
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+import core.booking as booking
+from core.booking import (CREWS, HORIZON_DAYS, LEAD_HOURS, SLOTS, TZ, BookingUnavailable,
+                          open_days, validate_selection)
+
+
+def _refs() -> list[datetime]:
+    refs = [
+        datetime(2026, 8, 20, 9, 30, tzinfo=TZ),
+        datetime(2026, 8, 22, 23, 59, tzinfo=TZ),         # sabado por la noche
+        datetime(2026, 12, 31, 0, 0, tzinfo=TZ),          # cambio de ano
+        datetime(2026, 3, 7, 10, 0, tzinfo=TZ),           # antes del horario de verano
+        datetime(2026, 10, 31, 14, 0, tzinfo=TZ),         # antes de volver al de invierno
+    ]
+    # Exactamente LEAD_HOURS antes de una franja, y un segundo despues.
+    edge = datetime.combine(datetime(2026, 9, 15).date(), SLOTS[3][0], TZ) - timedelta(hours=LEAD_HOURS)
+    refs += [edge, edge + timedelta(seconds=1)]
+    rng = random.Random(3)
+    refs += [datetime(2026, 1, 1, tzinfo=TZ) + timedelta(minutes=rng.randrange(365 * 24 * 60))
+             for _ in range(12)]
+    return refs
+
+
+@pytest.fixture
+def blocked_file(tmp_path, monkeypatch):
+    """Feriados en un archivo temporal; las caches de core/booking.py se
+    vacian para que lo lean."""
+    path = tmp_path / "blocked_dates.json"
+    monkeypatch.setattr(booking, "BLOCKED_FILE", path)
+    monkeypatch.setattr(booking, "_blocked_cache", None)
+    monkeypatch.setattr(booking, "_skeleton_cache", None)
+    return path
+
+
+@pytest.mark.parametrize("ref", _refs(), ids=lambda r: r.isoformat())
+def test_open_days_and_validate_selection_agree(ref, blocked_file):
+    rng = random.Random(ref.isoformat())
+    today = ref.date()
+    days = [today + timedelta(days=i) for i in range(-3, HORIZON_DAYS + 4)]
+
+    blocked_file.write_text(json.dumps([d.isoformat() for d in rng.sample(days, 4)]))
+    taken = {}
+    for day in rng.sample(days, 10):
+        taken[day.isoformat()] = {n: rng.randint(0, CREWS) for n in SLOTS}
+
+    offered = {(d["date"], s["n"]) for d in open_days(taken, ref) for s in d["slots"]}
+
+    checked = 0
+    for day in days:
+        for slot in (0, *SLOTS, max(SLOTS) + 1):
+            key = (day.isoformat(), slot)
+            try:
+                accepted = validate_selection(*key, taken, ref) == (day, slot)
+            except BookingUnavailable:
+                accepted = False
+            assert accepted == (key in offered), key
+            checked += 1
+    assert checked == len(days) * (len(SLOTS) + 2)
+    # Todo lo ofrecido cae dentro de lo recorrido.
+    assert offered <= {(d.isoformat(), n) for d in days for n in SLOTS}
+
+
+def test_validate_selection_rejects_non_iso_dates(blocked_file):
+    blocked_file.write_text("[]")
+    ref = datetime(2026, 8, 20, 9, 30, tzinfo=TZ)
+    day = ref.date() + timedelta(days=5)      # martes
+    assert validate_selection(day.isoformat(), 2, {}, ref) == (day, 2)
+    for text in (day.strftime("%Y%m%d"), "2026-02-30", "", "tomorrow"):
+        with pytest.raises(BookingUnavailable):
+            validate_selection(text, 2, {}, ref)
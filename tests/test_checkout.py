@@ -0,0 +1,110 @@
+"""Stripe por el cliente async compartido, contra el doble de tests/stripe_stub.py.
+
+  - Un checkout completo: formulario -> sesion de Stripe -> pago ->
+    /booking/confirmed marca la reserva pagada (el respaldo del webhook).
+  - El mismo envio dos veces lleva a la misma sesion, sin crear otra.
+  - Nunca hay mas de STRIPE_MAX_CONCURRENCY llamadas a Stripe en vuelo.
+  - Un error de Stripe cacheado sale como una excepcion nueva cada vez.
+"""
+
+import asyncio
+import secrets
+import traceback
+
+import httpx
+import stripe
+from sqlmodel import Session, select
+
+import routes.booking
+from core.booking import open_days
+from core.checkout import create_stripe_session, session_status
+from core.config import settings
+from db.models import Booking
+from db.occupancy import occupancy
+
+
+def _client() -> httpx.AsyncClient:
+    import main
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+def test_checkout_pays_through_confirmed_page(db, stripe_stub, monkeypatch):
+    notified = []
+    monkeypatch.setattr(routes.booking, "notify_new_booking", notified.append)
+    day = open_days(occupancy.taken())[0]
+    form = {"plan": "recommended", "service_date": day["date"], "slot": str(day["slots"][0]["n"]),
+            "customer_name": "Ana", "customer_phone": "4075550100", "address": "1 Main St",
+            "idem_key": secrets.token_urlsafe(8)}
+
+    async def run():
+        async with _client() as client:
+            first = await client.post("/booking/checkout", data=form)
+            again = await client.post("/booking/checkout", data=form)
+            assert first.status_code == again.status_code == 303
+            assert first.headers["location"] == again.headers["location"]
+            assert first.headers["location"].startswith("https://checkout.stripe.test/")
+
+            with Session(db) as session:
+                booking = session.exec(select(Booking).where(
+                    Booking.checkout_key.is_not(None),
+                    Booking.stripe_checkout_url == first.headers["location"])).one()
+            stripe_stub.pay(booking.stripe_session_id)
+            page = await client.get("/booking/confirmed",
+                                    params={"session_id": booking.stripe_session_id})
+            assert page.status_code == 200
+            return booking.id
+
+    booking_id = asyncio.run(run())
+    with Session(db) as session:
+        booking = session.get(Booking, booking_id)
+    assert booking.status == "paid"
+    assert booking.customer_email == "customer@example.com"
+    assert [b.id for b in notified] == [booking_id]
+
+
+def test_stripe_calls_are_bounded(stripe_stub):
+    stripe_stub.reset_stats()
+
+    async def run():
+        return await asyncio.gather(*[create_stripe_session(10, "Test") for _ in range(20)])
+
+    urls = asyncio.run(run())
+    assert len(set(urls)) == 20
+    assert stripe_stub.STATS["create"] == 20
+    assert 1 < stripe_stub.STATS["max_inflight"] <= settings.stripe_max_concurrency
+
+
+def test_stripe_client_is_closed_on_shutdown(stripe_stub):
+    import core.checkout
+
+    async def run():
+        await create_stripe_session(10, "Test")
+        http = core.checkout._state[2]
+        await core.checkout.close_stripe_client()
+        return http
+
+    http = asyncio.run(run())
+    assert http._client.is_closed
+    assert core.checkout._state is None
+
+
+def test_cached_stripe_error_is_raised_fresh(stripe_stub):
+    stripe_stub.reset_stats()
+
+    async def run():
+        errors = []
+        for _ in range(3):
+            try:
+                await session_status("cs_missing")
+            except stripe.StripeError as e:
+                errors.append(e)
+        return errors
+
+    first, *cached = asyncio.run(run())
+    assert stripe_stub.STATS["retrieve"] == 1
+    assert len({id(e) for e in [first, *cached]}) == 3
+    assert all(e.http_status == first.http_status == 404 for e in cached)
+    # La misma instancia relanzada iria sumando frames en cada acierto.
+    assert len(traceback.extract_tb(cached[0].__traceback__)) == \
+        len(traceback.extract_tb(cached[1].__traceback__))
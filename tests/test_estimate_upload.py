@@ -0,0 +1,85 @@
+"""POST /estimate: las fotos van a disco antes de tocar la base.
+
+  - Un envio bueno deja el estimado y sus fotos, con los archivos en disco.
+  - Si una foto falla a mitad, no queda fila y se borran los archivos que
+    escribio ese envio; uno que ya usaba otro estimado se queda.
+"""
+
+import asyncio
+import secrets
+
+import httpx
+import pytest
+from sqlmodel import Session, select
+
+import routes.estimates
+from core.uploads import UploadTooLarge
+from db.models import EstimatePhoto, EstimateRequest
+
+
+def _client() -> httpx.AsyncClient:
+    import main
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+def _post(files) -> tuple[httpx.Response, str]:
+    name = f"Ana {secrets.token_hex(4)}"
+    form = {"name": name, "phone": "4075550100", "job_type": "panel",
+            "description": "Breaker trips"}
+
+    async def run():
+        async with _client() as client:
+            return await client.post("/estimate", data=form, files=files)
+
+    return asyncio.run(run()), name
+
+
+@pytest.fixture
+def uploads(tmp_path, monkeypatch):
+    monkeypatch.setattr(routes.estimates, "UPLOAD_ROOT", tmp_path)
+    monkeypatch.setattr(routes.estimates, "wake_images", lambda: None)
+    monkeypatch.setattr(routes.estimates, "_notify_owner", lambda est, count: None)
+    return tmp_path
+
+
+def _on_disk(root) -> set[str]:
+    return {p.name for p in root.glob("??/*")}
+
+
+def test_photos_and_rows_are_saved_together(db, uploads):
+    photo = secrets.token_bytes(64)
+    response, name = _post([("photos", ("a.jpg", photo, "image/jpeg"))])
+    assert response.status_code == 200
+
+    with Session(db) as session:
+        est = session.exec(select(EstimateRequest).where(EstimateRequest.name == name)).one()
+        rows = session.exec(select(EstimatePhoto).where(EstimatePhoto.estimate_id == est.id)).all()
+    assert [f"{r.sha256}.jpg" for r in rows] == sorted(_on_disk(uploads))
+
+
+def test_failed_upload_removes_only_its_new_files(db, uploads, monkeypatch):
+    shared = secrets.token_bytes(64)
+    _post([("photos", ("shared.jpg", shared, "image/jpeg"))])
+    kept = _on_disk(uploads)
+
+    real_save = routes.estimates.save_upload
+    calls = []
+
+    async def fail_on_third(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise UploadTooLarge()
+        return await real_save(*args)
+
+    monkeypatch.setattr(routes.estimates, "save_upload", fail_on_third)
+    response, name = _post([
+        ("photos", ("shared.jpg", shared, "image/jpeg")),
+        ("photos", ("new.jpg", secrets.token_bytes(64), "image/jpeg")),
+        ("photos", ("big.jpg", secrets.token_bytes(64), "image/jpeg")),
+    ])
+
+    assert response.status_code == 400
+    assert _on_disk(uploads) == kept
+    with Session(db) as session:
+        assert session.exec(select(EstimateRequest).where(EstimateRequest.name == name)).first() is None
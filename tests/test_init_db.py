@@ -0,0 +1,61 @@
+"""db.session.init_db sobre una base que ya tiene datos.
+
+El indice unico de PaymentRecord llega a bases de Railway donde el libro ya
+habia anotado algun pago dos veces: init_db deja el primero, borra los demas
+y crea el indice, en vez de no arrancar. Y una base a la que le falta un
+ALTER del README no arranca, pero dice cual.
+"""
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlmodel import Session, create_engine, select
+
+from db import session as session_module
+from db.models import PaymentRecord
+from db.session import init_db
+
+
+def _indexes(engine) -> set[str]:
+    return {ix["name"] for ix in inspect(engine).get_indexes("paymentrecord")}
+
+
+def _payment(payment_id: str) -> PaymentRecord:
+    return PaymentRecord(provider="stripe", purpose="deposit", amount=50,
+                         currency="usd", provider_payment_id=payment_id)
+
+
+def test_repeated_payments_are_removed_before_the_unique_index(db):
+    with db.begin() as conn:
+        conn.execute(text("DROP INDEX ux_paymentrecord_provider_payment_id"))
+        conn.execute(text("CREATE INDEX ix_paymentrecord_provider_payment_id "
+                          "ON paymentrecord (provider_payment_id)"))
+    with Session(db) as session:
+        rows = [_payment("pi_twice"), _payment("pi_twice"), _payment("pi_twice"),
+                _payment("pi_once")]
+        session.add_all(rows)
+        session.commit()
+        first = rows[0].id
+
+    init_db()
+
+    assert "ux_paymentrecord_provider_payment_id" in _indexes(db)
+    assert "ix_paymentrecord_provider_payment_id" not in _indexes(db)
+    with Session(db) as session:
+        twice = session.exec(select(PaymentRecord.id)
+                             .where(PaymentRecord.provider_payment_id == "pi_twice")).all()
+        once = session.exec(select(PaymentRecord.id)
+                            .where(PaymentRecord.provider_payment_id == "pi_once")).all()
+    assert twice == [first]
+    assert len(once) == 1
+
+
+def test_missing_column_stops_startup_with_the_alter_to_run(tmp_path, monkeypatch):
+    # Base aparte: la de las demas pruebas no se toca.
+    old = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    monkeypatch.setattr(session_module, "engine", old)
+    init_db()
+    with old.begin() as conn:
+        conn.execute(text("ALTER TABLE booking DROP COLUMN stripe_checkout_url"))
+
+    with pytest.raises(RuntimeError, match="ALTER TABLE booking ADD COLUMN stripe_checkout_url VARCHAR;"):
+        init_db()
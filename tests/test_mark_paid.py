@@ -0,0 +1,70 @@
+"""db.booking.mark_paid: un pago tardio nunca vende un cupo dos veces.
+
+Una reserva expirada (o pendiente de mas de HOLD_MINUTES) ya no guardaba su
+franja. Si se paga y la franja sigue libre, queda pagada; si otro cliente la
+ocupo mientras tanto, queda en "overbooked" y no cuenta como cupo.
+"""
+
+import secrets
+from datetime import date, datetime, timedelta
+from itertools import count
+
+from sqlmodel import Session
+
+from core.booking import CREWS, HOLD_MINUTES
+from db.booking import mark_paid, reserve, taken_map
+from db.models import Booking
+
+_days = count(600)
+
+
+def _booking(day: date, status: str = "pending", age_minutes: int = 0) -> Booking:
+    return Booking(
+        public_id=secrets.token_urlsafe(8), plan_key="basic", plan_name="Essential",
+        plan_price=299, deposit_amount=50, balance_due=249, service_date=day, slot=2,
+        customer_name="Ana", customer_phone="4075550100", address="1 Main St",
+        status=status, created_at=datetime.utcnow() - timedelta(minutes=age_minutes),
+    )
+
+
+def _day() -> date:
+    return date.today() + timedelta(days=next(_days))
+
+
+def _add(session: Session, booking: Booking) -> Booking:
+    session.add(booking)
+    session.commit()
+    session.refresh(booking)
+    return booking
+
+
+def test_live_hold_is_paid(db):
+    day = _day()
+    with Session(db) as session:
+        booking = _add(session, _booking(day))
+        assert mark_paid(session, booking, "ana@example.com")
+        assert booking.status == "paid"
+        assert not mark_paid(session, booking)          # la segunda vez no gana
+
+
+def test_expired_hold_with_room_is_paid(db):
+    day = _day()
+    with Session(db) as session:
+        booking = _add(session, _booking(day, "expired", HOLD_MINUTES * 4))
+        assert mark_paid(session, booking)
+        assert booking.status == "paid"
+
+
+def test_lapsed_hold_on_a_full_slot_is_flagged(db):
+    for status in ("expired", "pending"):
+        day = _day()
+        with Session(db) as session:
+            late = _add(session, _booking(day, status, HOLD_MINUTES + 5))
+            for _ in range(CREWS):
+                assert reserve(session, _booking(day))
+
+            assert mark_paid(session, late, "ana@example.com")
+            assert late.status == "overbooked"
+            assert late.customer_email == "ana@example.com"
+            assert not mark_paid(session, late)
+            assert taken_map(session, day)[day.isoformat()] == {2: CREWS}
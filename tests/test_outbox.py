@@ -0,0 +1,133 @@
+"""Cola de correos (core/emailer.py, db/outbox.py) contra un SMTP local.
+
+El servidor es aiosmtpd con STARTTLS y LOGIN obligatorios, como el de
+produccion, en el SMTP_PORT de tests/conftest.py. Se comprueba que:
+
+  - muchos correos salen por UNA conexion autenticada;
+  - un rechazo temporal se reintenta mas tarde, sin perder el correo;
+  - si el servidor corta la conexion, se reconecta y el correo sale;
+  - los avisos agrupados salen en un solo mensaje.
+"""
+
+import shutil
+import socket
+import ssl
+import subprocess
+from datetime import datetime, timedelta
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+from sqlmodel import Session, select, update
+
+import core.emailer as emailer
+from core.emailer import send_outbox, send_owner_email
+from db.models import OutboxEmail
+
+from conftest import SMTP_PORT
+
+
+class _Mailbox:
+    def __init__(self) -> None:
+        self.messages: list[str] = []
+        self.logins = 0
+        self.reject = 0                        # cuantos DATA mas contestar con 451
+
+    def authenticate(self, server, session, envelope, mechanism, data):
+        self.logins += 1
+        return AuthResult(success=True)
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reject:
+            self.reject -= 1
+            return "451 4.3.0 Try again later"
+        self.messages.append(envelope.content.decode())
+        return "250 OK"
+
+    def subjects(self, prefix: str) -> list[str]:
+        return [line[len("Subject: "):] for m in self.messages for line in m.splitlines()
+                if line.startswith("Subject: ") and prefix in line]
+
+
+@pytest.fixture(scope="module")
+def mailbox(db, tmp_path_factory):
+    if not shutil.which("openssl"):
+        pytest.skip("openssl is needed for the STARTTLS certificate")
+    cert, key = (tmp_path_factory.mktemp("smtp") / n for n in ("cert.pem", "key.pem"))
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-keyout", str(key), "-out", str(cert)],
+                   check=True, capture_output=True)
+    tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    tls.load_cert_chain(cert, key)
+
+    box = _Mailbox()
+    controller = Controller(box, hostname="127.0.0.1", port=SMTP_PORT, tls_context=tls,
+                            require_starttls=True, authenticator=box.authenticate,
+                            auth_require_tls=True)
+    controller.start()
+    yield box
+    emailer._smtp.close()
+    controller.stop()
+
+
+@pytest.fixture
+def fresh(db, mailbox):
+    """Cola vacia y conexion cerrada: cada prueba cuenta sus propios LOGIN."""
+    send_outbox()
+    emailer._smtp.close()
+    mailbox.messages.clear()
+    mailbox.logins = 0
+    return mailbox
+
+
+def _make_due(engine) -> None:
+    """Adelanta los reintentos y ventanas pendientes para no esperarlos."""
+    with Session(engine) as session:
+        session.exec(update(OutboxEmail).where(OutboxEmail.status == "pending")
+                     .values(next_attempt_at=datetime.utcnow() - timedelta(seconds=1)))
+        session.commit()
+
+
+def test_many_emails_one_login(db, fresh):
+    for i in range(20):
+        assert send_owner_email(f"bulk {i}", "body", coalesce=False)
+    assert send_outbox() == 20
+    assert len(fresh.subjects("bulk")) == 20
+    assert fresh.logins == 1
+
+
+def test_temporary_rejection_is_retried(db, fresh):
+    fresh.reject = 1
+    send_owner_email("retry me", "body", coalesce=False)
+    assert send_outbox() == 0
+
+    with Session(db) as session:
+        email = session.exec(select(OutboxEmail).where(OutboxEmail.subject == "retry me")).one()
+    assert (email.status, email.attempts) == ("pending", 1)
+    assert "451" in email.last_error
+    assert email.next_attempt_at > datetime.utcnow()
+
+    _make_due(db)
+    assert send_outbox() == 1
+    assert fresh.subjects("retry me") == ["retry me"]
+
+
+def test_reconnects_after_the_server_drops_the_connection(db, fresh):
+    send_owner_email("before drop", "body", coalesce=False)
+    assert send_outbox() == 1
+    emailer._smtp._server.sock.shutdown(socket.SHUT_RDWR)
+
+    send_owner_email("after drop", "body", coalesce=False)
+    assert send_outbox() == 1
+    assert fresh.subjects("after drop") == ["after drop"]
+    assert fresh.logins == 2
+
+
+def test_grouped_notices_go_out_as_one_message(db, fresh):
+    send_owner_email("notice A", "first")
+    send_owner_email("notice B", "second")
+    assert send_outbox() == 0                   # todavia dentro de la ventana
+
+    _make_due(db)
+    assert send_outbox() == 2
+    assert fresh.subjects("notice") == ["2 NEW - notice A | notice B"]
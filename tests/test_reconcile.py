@@ -0,0 +1,78 @@
+"""core/reconcile.py contra el doble de Stripe (tests/stripe_stub.py).
+
+Reservas cuyas sesiones se pagaron sin que llegara el webhook, mezcladas
+con otras sin pagar y con sesiones de mas, en varias paginas del listado.
+La conciliacion marca pagadas justo las que hay que marcar, avisa una vez
+por reserva, pide el listado por paginas (no un retrieve por reserva) y una
+segunda pasada no cambia nada.
+"""
+
+import asyncio
+import secrets
+from datetime import date, timedelta
+
+from sqlmodel import Session
+
+import core.reconcile
+from core.checkout import stripe_client
+from core.reconcile import PAGE_SIZE, reconcile
+from db.models import Booking
+
+
+def _booking(session_id: str, status: str, n: int) -> Booking:
+    return Booking(
+        public_id=secrets.token_urlsafe(8), plan_key="basic", plan_name="Essential",
+        plan_price=299, deposit_amount=50, balance_due=249,
+        service_date=date.today() + timedelta(days=1000 + n), slot=1,
+        customer_name="Ana", customer_phone="4075550100", address="1 Main St",
+        stripe_session_id=session_id, status=status,
+    )
+
+
+def test_reconcile_marks_paid_sessions_in_bulk(db, stripe_stub, monkeypatch):
+    notified = []
+    monkeypatch.setattr(core.reconcile, "notify_new_booking", notified.append)
+
+    async def create(n):
+        client, _ = stripe_client()
+        sessions = await asyncio.gather(*[
+            client.checkout.sessions.create_async(params={"mode": "payment"}) for _ in range(n)])
+        return [s.id for s in sessions]
+
+    session_ids = asyncio.run(create(PAGE_SIZE * 2 + 30))
+    paid = set(session_ids[::3])
+    for sid in paid:
+        stripe_stub.pay(sid)
+
+    # Una reserva por sesion, salvo las ultimas 20: sesiones sin reserva.
+    # Las pendientes se alternan con expiradas (el cliente pago tarde), cada
+    # una en su dia: con la franja libre, la expirada tambien queda pagada.
+    with Session(db) as session:
+        bookings = [_booking(sid, "pending" if i % 2 else "expired", i)
+                    for i, sid in enumerate(session_ids[:-20])]
+        session.add_all(bookings)
+        session.commit()
+        ids = {b.id: b.stripe_session_id for b in bookings}
+
+    stripe_stub.reset_stats()
+    report = asyncio.run(reconcile())
+
+    expected = {bid for bid, sid in ids.items() if sid in paid}
+    assert {b.id for b in notified} == expected
+    assert report["marked_paid"] == len(expected)
+    assert stripe_stub.STATS["retrieve"] == 0
+    assert stripe_stub.STATS["list"] == report["pages"]
+    assert report["pages"] <= len(stripe_stub.SESSIONS) // PAGE_SIZE + 1
+
+    with Session(db) as session:
+        for bid, sid in ids.items():
+            booking = session.get(Booking, bid)
+            if sid in paid:
+                assert booking.status == "paid"
+                assert booking.customer_email == "customer@example.com"
+            else:
+                assert booking.status in ("pending", "expired")
+
+    again = asyncio.run(reconcile())
+    assert again["marked_paid"] == 0
+    assert len(notified) == len(expected)
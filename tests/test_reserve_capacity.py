@@ -0,0 +1,73 @@
+"""Cupos bajo carga: muchas reservas a la vez nunca pasan de CREWS por franja.
+
+Es la garantia de db.booking.reserve(): contar y guardar van en una sola
+transaccion que empieza tomando la fila de SlotLock. Aqui se le tiran
+cientos de reservas simultaneas sobre SQLite, por el camino async de las
+rutas (reserve_async) y por hilos con el sincrono, y se cuenta en la base.
+"""
+
+import asyncio
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from sqlalchemy import func
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from core.booking import CREWS, SLOTS
+from db.booking import reserve, reserve_async
+from db.models import Booking
+from db.session import async_engine
+
+ATTEMPTS_PER_SLOT = 60
+
+
+def _booking(day: date, slot: int) -> Booking:
+    return Booking(
+        public_id=secrets.token_urlsafe(8), plan_key="basic", plan_name="Essential",
+        plan_price=299, deposit_amount=50, balance_due=249,
+        service_date=day, slot=slot,
+        customer_name="Load Test", customer_phone="4075550100", address="1 Main St",
+    )
+
+
+def _per_slot(engine, day: date) -> dict[int, int]:
+    with Session(engine) as session:
+        rows = session.exec(
+            select(Booking.slot, func.count())
+            .where(Booking.service_date == day, Booking.status != "cancelled")
+            .group_by(Booking.slot)
+        ).all()
+    return dict(rows)
+
+
+def test_parallel_reserve_async_never_oversells(db):
+    day = date.today() + timedelta(days=400)
+
+    async def one(slot: int) -> bool:
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            return await reserve_async(session, _booking(day, slot))
+
+    async def run() -> list[bool]:
+        jobs = [one(slot) for slot in SLOTS for _ in range(ATTEMPTS_PER_SLOT)]
+        return await asyncio.gather(*jobs)
+
+    results = asyncio.run(run())
+
+    assert sum(results) == CREWS * len(SLOTS)
+    assert _per_slot(db, day) == {slot: CREWS for slot in SLOTS}
+
+
+def test_parallel_reserve_threads_never_oversell(db):
+    day = date.today() + timedelta(days=401)
+
+    def one(slot: int) -> bool:
+        with Session(db, expire_on_commit=False) as session:
+            return reserve(session, _booking(day, slot))
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        results = list(pool.map(one, [slot for slot in SLOTS for _ in range(ATTEMPTS_PER_SLOT)]))
+
+    assert sum(results) == CREWS * len(SLOTS)
+    assert _per_slot(db, day) == {slot: CREWS for slot in SLOTS}